@@ -16,12 +16,18 @@ import queue
 import time
 import matplotlib.pyplot as mp
 
+from event_driven_trading.event_log import EventLogWriter
+from event_driven_trading.multi_strategy import MultiStrategyPortfolio, StrategyEventQueue
+from event_driven_trading.sim_clock import SimulatedClock, TimedEventQueue, to_ns
+
 """
 The Backtest object is designed to carry out a nested while-loop event-driven system in
 order to handle the events placed on the Event Queue object. The outer while-loop is known as
 the "heartbeat loop" and decides the temporal resolution of the backtesting system. In a live
 environment this value will be a positive number, such as 600 seconds (every ten minutes). Thus
-the market data and positions will only be updated on this timeframe.
+the market data and positions will only be updated on this timeframe. LiveTrader in live.py
+runs the same components on an asyncio event loop instead, handling bars and fills as they
+arrive and marking the portfolio to market on the heartbeat.
 
 The inner while-loop actually processes the signals and sends them to the correct component
 depending upon the event type. Thus the Event Queue is continually being populated and
@@ -39,7 +45,8 @@ class Backtest(object):
     def __init__(
             self, csv_dir, symbol_list, initial_capital,
             heartbeat, start_date, data_handler,
-            execution_handler, portfolio, strategy
+            execution_handler, portfolio, strategy,
+            event_log=None, event_log_field="adj_close"
             ):
         """
         Initilises the backtest
@@ -50,10 +57,17 @@ class Backtest(object):
         heartbeat - Backtest "heartbeat" in seconds
         start_date - The start datetime of the strategy.
         data_handler - (Class) Handles the market data feed.
-        execution_handler - (Class) Handles the orders/fills for trades.
+        execution_handler - (Class) Handles the orders/fills for trades,
+        constructed with the events queue and bars=the DataHandler.
         portfolio - (Class) Keeps track of portfolio current
         and prior positions.
-        strategy - (Class) Generates signals based on market data.
+        strategy - (Class) Generates signals based on market data, or a
+        list of them to run side by side over the one data feed, each
+        with its own sub-portfolio (see multi_strategy.py).
+        event_log - Optional path of a binary log to which every
+        dispatched event is appended, for replay with event_log.py.
+        event_log_field - The bar field the portfolio values positions
+        with, "adj_close" for Portfolio and "close" for PortfolioHFT.
         """
         self.csv_dir = csv_dir
         self.symbol_list = symbol_list
@@ -65,8 +79,15 @@ class Backtest(object):
         self.execution_handler_cls = execution_handler
         self.portfolio_cls = portfolio
         self.strategy_cls = strategy
+        self.event_log = event_log
+        self.event_log_field = event_log_field
         
-        self.events = queue.Queue()
+        #events are dispatched in order of their simulated time, FIFO
+        #among events due at the same time. The clock is moved to each
+        #bar as it is released, so it starts unset rather than at
+        #start_date, which may be later than the first bar
+        self.clock = SimulatedClock()
+        self.events = TimedEventQueue(self.clock)
         
         self.signals = 0
         self.orders = 0
@@ -82,10 +103,33 @@ class Backtest(object):
         print("Creating DataHandler, Strategy, Portfolio, and ExecutionHandler"
               )
         self.data_handler = self.data_handler_cls(self.events, self.csv_dir, self.symbol_list)
-        self.strategy = self.strategy_cls(self.data_handler, self.events)
-        self.portfolio = self.portfolio_cls(
-                self.data_handler, self.events, self.start_date, self.initial_capital)
-        self.execution_handler = self.execution_handler_cls(self.events)
+        if isinstance(self.strategy_cls, (list, tuple)):
+            strategy_clss = list(self.strategy_cls)
+        else:
+            strategy_clss = [self.strategy_cls]
+        self.num_strats = len(strategy_clss)
+        
+        if self.num_strats == 1:
+            self.strategies = [strategy_clss[0](self.data_handler, self.events)]
+            self.portfolio = self.portfolio_cls(
+                    self.data_handler, self.events, self.start_date, self.initial_capital)
+        else:
+            #strategy ids 1..num_strats, stamped on the signals of each
+            strategy_ids = list(range(1, self.num_strats + 1))
+            self.strategies = [
+                    cls(self.data_handler, StrategyEventQueue(self.events, sid))
+                    for sid, cls in zip(strategy_ids, strategy_clss)]
+            self.portfolio = MultiStrategyPortfolio(
+                    self.data_handler, self.events, self.start_date,
+                    self.initial_capital, self.portfolio_cls, strategy_ids)
+        self.strategy = self.strategies[0]
+        self.execution_handler = self.execution_handler_cls(
+                self.events, bars=self.data_handler)
+        self.event_logger = None
+        if self.event_log is not None:
+            self.event_logger = EventLogWriter(
+                    self.event_log, self.data_handler, self.event_log_field,
+                    self.initial_capital, self.start_date)
             
             
     def _run_backtest(self):
@@ -98,34 +142,88 @@ class Backtest(object):
             print(i)
             #update the market bars
             if self.data_handler.continue_backtest == True:
+                #dispatch the scheduled events (e.g. delayed fills) due
+                #before the next bar, then move the clock on to it
+                next_datetime = self.data_handler.get_next_bar_datetime()
+                if next_datetime is not None:
+                    self._dispatch_until(next_datetime)
+                    self.clock.advance_to(next_datetime)
                 self.data_handler.update_bars()
             else:
+                self._dispatch_until(None)
+                if self.event_logger is not None:
+                    self.event_logger.close()
                 break
             
-            #handle the events
-            while True:
-                try:
-                    event = self.events.get(False)
-                except queue.Empty:
-                    break
-                else:
-                    if event is not None:
-                        if event.type == 'MARKET':
-                            self.strategy.calculate_signals(event)
-                            self.portfolio.update_timeindex(event)
-                        elif event.type == 'SIGNAL':
-                            self.signals +=1
-                            self.portfolio.update_signal(event)
-                            
-                        elif event.type == 'ORDER':
-                            self.orders +=1
-                            self.execution_handler.execute_order(event)
-                            
-                        elif event.type == 'FILL':
-                            self.fills +=1
-                            self.portfolio.update_fill(event)
-                            
+            self._handle_events()
             time.sleep(self.heartbeat)
+            
+    def _handle_events(self):
+        """
+        Handles the events due at the current simulated time, including
+        the fills of orders the execution handler batches.
+        """
+        while True:
+            self._drain_events()
+            self.execution_handler.process_pending_orders()
+            next_ns = self.events.next_time()
+            if next_ns is None or next_ns > self.clock.now_ns:
+                break
+            
+    def _drain_events(self):
+        """
+        Dispatches the queued events due at the current time.
+        """
+        while True:
+            try:
+                event = self.events.get(False)
+            except queue.Empty:
+                break
+            else:
+                if event is not None:
+                    self._dispatch(event)
+                    
+    def _dispatch(self, event):
+        """
+        Sends an event to the components that act upon it.
+        """
+        if self.event_logger is not None:
+            self.event_logger.log(event)
+        if event.type == 'MARKET':
+            self._on_market(event)
+        elif event.type == 'SIGNAL':
+            self.signals +=1
+            self.portfolio.update_signal(event)
+            
+        elif event.type == 'ORDER':
+            self.orders +=1
+            self.execution_handler.execute_order(event)
+            
+        elif event.type == 'FILL':
+            self.fills +=1
+            self.portfolio.update_fill(event)
+            
+    def _on_market(self, event):
+        """
+        Runs the strategies on a new bar and marks the portfolio to it.
+        """
+        for strategy in self.strategies:
+            strategy.calculate_signals(event)
+        self.portfolio.update_timeindex(event)
+        self.execution_handler.update_timeindex(event)
+        
+    def _dispatch_until(self, until):
+        """
+        Steps the clock through the pending events due before until (a
+        datetime, or None for all of them), handling each in time order.
+        """
+        until_ns = None if until is None else to_ns(until)
+        while True:
+            next_ns = self.events.next_time()
+            if next_ns is None or (until_ns is not None and next_ns >= until_ns):
+                break
+            self.clock.advance_to(next_ns)
+            self._handle_events()
         
     def _output_performance(self):
         """
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+#bench_mac.py
+from __future__ import print_function
+"""
+Benchmarks MovingAverageCrossStrategy.calculate_signals over a synthetic
+universe of several hundred symbols, against the previous implementation
+which re-fetched the full long window and called np.mean twice per symbol
+per bar. Both are driven by the same in-memory bars so only the strategy
+cost is timed, and the emitted signal streams are checked to be identical.
+
+    python bench_mac.py [num_symbols] [num_bars]
+"""
+
+import contextlib
+import datetime
+import os
+import queue
+import sys
+import time
+
+import numpy as np
+
+from event_driven_trading.data import DataHandler
+from event_driven_trading.event import MarketEvent, SignalEvent
+from event_driven_trading.mac import MovingAverageCrossStrategy
+
+
+class Bar(object):
+    """
+    Minimal stand-in for the pandas row that HistoricCSVDataHandler
+    stores, exposing the bar fields as attributes.
+    """
+    def __init__(self, adj_close):
+        self.adj_close = adj_close
+
+
+class InMemoryDataHandler(DataHandler):
+    """
+    Feeds a (bars x symbols) price matrix through the DataHandler
+    interface without touching disk or pandas.
+    """
+    def __init__(self, events, prices, symbol_list, start):
+        self.events = events
+        self.prices = prices
+        self.symbol_list = symbol_list
+        self.start = start
+        self.bar_index = 0
+        self.latest_symbol_data = dict( (s, []) for s in symbol_list )
+        self.continue_backtest = True
+
+    def get_latest_bar(self, symbol):
+        return self.latest_symbol_data[symbol][-1]
+
+    def get_latest_bars(self, symbol, N=1):
+        return self.latest_symbol_data[symbol][-N:]
+
+    def get_latest_bar_datetime(self, symbol):
+        return self.latest_symbol_data[symbol][-1][0]
+
+    def get_latest_bar_value(self, symbol, val_type):
+        return getattr(self.latest_symbol_data[symbol][-1][1], val_type)
+
+    def get_latest_bars_values(self, symbol, val_type, N=1):
+        bars_list = self.get_latest_bars(symbol, N)
+        return np.array([getattr(b[1], val_type) for b in bars_list])
+
+    def update_bars(self):
+        if self.bar_index >= self.prices.shape[0]:
+            self.continue_backtest = False
+            return
+        dt = self.start + datetime.timedelta(days=self.bar_index)
+        row = self.prices[self.bar_index]
+        for j, s in enumerate(self.symbol_list):
+            self.latest_symbol_data[s].append((dt, Bar(row[j])))
+        self.bar_index += 1
+        self.events.put(MarketEvent())
+
+
+class WindowMovingAverageCrossStrategy(MovingAverageCrossStrategy):
+    """
+    The previous implementation, which recomputes both averages from
+    the latest long_window bars on every MarketEvent.
+    """
+    def calculate_signals(self, event):
+        if event.type == 'MARKET':
+            for s in self.symbol_list:
+                bars = self.bars.get_latest_bars_values(
+                        s, "adj_close", N=self.long_window)
+                if bars is not None and len(bars) > 0:
+                    short_sma = np.mean(bars[-self.short_window:])
+                    long_sma = np.mean(bars[-self.long_window:])
+                    dt = datetime.datetime.utcnow()
+                    if short_sma > long_sma and self.bought[s] == 'OUT':
+                        self.events.put(SignalEvent(1, s, dt, 'LONG', 1.0))
+                        self.bought[s] = 'LONG'
+                    elif short_sma < long_sma and self.bought[s] == 'LONG':
+                        self.events.put(SignalEvent(1, s, dt, 'EXIT', 1.0))
+                        self.bought[s] = 'OUT'
+
+
+def run(strategy_cls, prices, symbol_list):
+    """
+    Steps the strategy through every bar, returning the elapsed time
+    spent in calculate_signals and the (bar, symbol, signal) stream.
+    """
+    events = queue.Queue()
+    bars = InMemoryDataHandler(
+            events, prices, symbol_list, datetime.datetime(2000, 1, 1))
+    strategy = strategy_cls(bars, events)
+    signals = []
+    elapsed = 0.0
+    devnull = open(os.devnull, 'w')
+    while True:
+        bars.update_bars()
+        if not bars.continue_backtest:
+            break
+        event = events.get(False)
+        t0 = time.time()
+        with contextlib.redirect_stdout(devnull):
+            strategy.calculate_signals(event)
+        elapsed += time.time() - t0
+        while not events.empty():
+            sig = events.get(False)
+            signals.append((bars.bar_index, sig.symbol, sig.signal_type))
+    devnull.close()
+    return elapsed, signals
+
+
+if __name__ == "__main__":
+    num_symbols = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    num_bars = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    rng = np.random.RandomState(42)
+    returns = rng.normal(0.0002, 0.01, size=(num_bars, num_symbols))
+    prices = 100.0 * np.exp(np.cumsum(returns, axis=0))
+    symbol_list = ["S{}".format(i) for i in range(num_symbols)]
+
+    print("{} symbols x {} bars".format(num_symbols, num_bars))
+    window_time, window_signals = run(
+            WindowMovingAverageCrossStrategy, prices, symbol_list)
+    print("Window np.mean:  {:.3f}s".format(window_time))
+    running_time, running_signals = run(
+            MovingAverageCrossStrategy, prices, symbol_list)
+    print("Running sum:     {:.3f}s".format(running_time))
+    print("Speedup:         {:.1f}x".format(window_time / running_time))
+    print("Signals: {} (identical: {})".format(
+            len(running_signals), running_signals == window_signals))
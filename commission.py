@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+#commission.py
+from __future__ import print_function
+"""
+Table-driven commission models.
+
+A commission table has one row per schedule (or per tier of a tiered
+schedule) with the columns
+
+    venue, symbol - What the schedule applies to, '*' matching any.
+    kind - 'per_share', 'percentage' (rate is a fraction of the trade
+        value), 'fixed' (rate per fill) or 'tiered' (a per-share rate
+        set by the band the fill quantity falls in).
+    threshold - The lowest quantity of a tier, 0 for other kinds.
+    rate - The rate of the schedule or tier.
+    minimum, maximum - Caps on the commission of a fill.
+    max_pct - An optional cap as a fraction of the trade value.
+
+and can be loaded from a CSV file with load_commission_table. A fill uses
+the most specific schedule matching it, trying (venue, symbol), then
+(venue, '*'), ('*', symbol) and ('*', '*'). CommissionModel.compute works
+on whole batches of fills, grouping them by schedule and pricing each
+group with numpy.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+TABLE_COLUMNS = [
+        'venue', 'symbol', 'kind', 'threshold', 'rate',
+        'minimum', 'maximum', 'max_pct'
+]
+
+#the "US API Directed Order" rates of FillEvent.calculate_ib_commission
+IB_DIRECTED_TABLE = pd.DataFrame([
+        ('*', '*', 'per_share', 0, 0.013, 1.3, np.inf, np.nan),
+], columns=TABLE_COLUMNS)
+
+
+class CommissionSchedule(object):
+    """
+    One commission schedule, computed over arrays of fills.
+    """
+    def __init__(self, kind, rates, thresholds=(0,), minimum=0.0,
+                 maximum=np.inf, max_pct=np.nan):
+        if kind not in ('per_share', 'percentage', 'fixed', 'tiered'):
+            raise ValueError("Unknown commission kind {}".format(kind))
+        order = np.argsort(thresholds)
+        self.kind = kind
+        self.thresholds = np.asarray(thresholds, dtype=np.float64)[order]
+        self.rates = np.asarray(rates, dtype=np.float64)[order]
+        self.minimum = minimum
+        self.maximum = maximum
+        self.max_pct = max_pct
+
+    def compute(self, quantity, price):
+        quantity = np.abs(np.asarray(quantity, dtype=np.float64))
+        value = quantity * np.asarray(price, dtype=np.float64)
+        if self.kind == 'per_share':
+            comm = self.rates[0] * quantity
+        elif self.kind == 'percentage':
+            comm = self.rates[0] * value
+        elif self.kind == 'fixed':
+            comm = np.full(quantity.shape, self.rates[0])
+        else:
+            tier = np.searchsorted(self.thresholds, quantity, side='right') - 1
+            comm = self.rates[np.maximum(tier, 0)] * quantity
+        comm = np.clip(comm, self.minimum, self.maximum)
+        if not np.isnan(self.max_pct):
+            comm = np.minimum(comm, self.max_pct * value)
+        return comm
+
+
+class CommissionModel(object):
+    """
+    Commission schedules selected per venue and instrument.
+    """
+    def __init__(self, schedules):
+        """
+        Parameters:
+        schedules - A dict of CommissionSchedules keyed by (venue,
+            symbol), with '*' as a wildcard.
+        """
+        self.schedules = dict(schedules)
+
+    @classmethod
+    def from_table(cls, table):
+        """
+        Builds the model from a DataFrame with the TABLE_COLUMNS.
+        """
+        table = table.copy()
+        for col, default in (('threshold', 0), ('minimum', 0.0),
+                             ('maximum', np.inf), ('max_pct', np.nan)):
+            if col not in table:
+                table[col] = default
+            table[col] = table[col].fillna(default)
+        schedules = {}
+        for (venue, symbol), rows in table.groupby(['venue', 'symbol'], sort=False):
+            kinds = rows['kind'].unique()
+            if len(kinds) != 1:
+                raise ValueError(
+                        "Mixed commission kinds for {}, {}".format(venue, symbol))
+            first = rows.iloc[0]
+            schedules[(venue, symbol)] = CommissionSchedule(
+                    kinds[0], rows['rate'].values, rows['threshold'].values,
+                    first['minimum'], first['maximum'], first['max_pct'])
+        return cls(schedules)
+
+    def schedule_for(self, venue, symbol):
+        for key in ((venue, symbol), (venue, '*'), ('*', symbol), ('*', '*')):
+            if key in self.schedules:
+                return self.schedules[key]
+        raise KeyError("No commission schedule for {}, {}".format(venue, symbol))
+
+    def compute(self, venues, symbols, quantities, prices):
+        """
+        Returns the commission of each of a batch of fills.
+
+        Parameters:
+        venues, symbols - Per fill, or a single venue for all of them.
+        quantities - The filled quantities.
+        prices - The fill prices, needed by 'percentage' schedules and
+            max_pct caps.
+        """
+        quantities = np.asarray(quantities, dtype=np.float64)
+        prices = np.broadcast_to(np.asarray(prices, dtype=np.float64), quantities.shape)
+        n = len(quantities)
+        venues = np.broadcast_to(np.asarray(venues, dtype=object), (n,))
+        symbols = np.asarray(symbols, dtype=object)
+
+        #look up the schedule of each distinct (venue, symbol) pair once
+        uv, v_code = np.unique(venues.astype(str), return_inverse=True)
+        us, s_code = np.unique(symbols.astype(str), return_inverse=True)
+        pairs, group = np.unique(v_code * len(us) + s_code, return_inverse=True)
+        comm = np.empty(n)
+        for g, pair in enumerate(pairs):
+            mask = group == g
+            schedule = self.schedule_for(uv[pair // len(us)], us[pair % len(us)])
+            comm[mask] = schedule.compute(quantities[mask], prices[mask])
+        return comm
+
+
+def load_commission_table(path):
+    """
+    Reads a commission table from a CSV file into a CommissionModel.
+    """
+    return CommissionModel.from_table(pd.read_csv(path))
+
+
+def default_commission_model():
+    return CommissionModel.from_table(IB_DIRECTED_TABLE)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+#costs.py
+from __future__ import print_function
+"""
+Vectorised slippage and market impact models.
+
+A cost model is a function
+
+    model(price, quantity, bars) -> cost
+
+over arrays with one entry per fill: price is the reference price, quantity
+the (unsigned) number of shares and bars a dict of the fill's bar fields
+('open', 'high', 'low', 'close', 'volume'), each an array. It returns the
+cost of each fill as a fraction of its price, always adverse, which
+apply_costs turns into fill prices. Models are parameterised by building
+them with the factories below and summed with combine_costs:
+
+    slippage = combine_costs(fixed_bps(1.0), square_root_impact(0.5))
+
+The simulated execution handlers call their model once per batch of fills
+rather than once per order.
+"""
+
+import numpy as np
+
+
+BAR_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+
+def fixed_bps(bps):
+    """
+    A fixed cost of bps basis points per fill.
+    """
+    def model(price, quantity, bars):
+        return np.full(np.shape(price), bps * 1e-4)
+    return model
+
+
+def spread_cost(spread_bps=None, range_fraction=0.1):
+    """
+    Crossing half the bid-ask spread. Bars carry no quotes, so unless a
+    fixed spread_bps is given the spread is estimated as range_fraction
+    of the bar's high-low range, relative to the bar's own close so that
+    it does not depend on the scale of the reference price (e.g.
+    adj_close).
+    """
+    def model(price, quantity, bars):
+        if spread_bps is not None:
+            return np.full(np.shape(price), 0.5 * spread_bps * 1e-4)
+        spread = range_fraction * (bars['high'] - bars['low'])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.nan_to_num(0.5 * spread / bars['close'])
+    return model
+
+
+def square_root_impact(coefficient=1.0, max_participation=1.0):
+    """
+    The square-root law of market impact: a cost of
+    coefficient * sigma * sqrt(quantity / volume), with sigma the
+    Parkinson volatility estimate ln(high / low) / sqrt(4 ln 2) of the
+    bar. The participation rate is capped at max_participation, which is
+    also assumed where the bar volume is missing or zero.
+    """
+    def model(price, quantity, bars):
+        volume = np.asarray(bars['volume'], dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            participation = np.where(
+                    volume > 0, np.asarray(quantity) / volume, max_participation)
+            sigma = np.log(bars['high'] / bars['low']) / np.sqrt(4.0 * np.log(2.0))
+        participation = np.minimum(participation, max_participation)
+        return np.nan_to_num(coefficient * sigma * np.sqrt(participation))
+    return model
+
+
+def combine_costs(*models):
+    """
+    A model whose cost is the sum of the costs of models.
+    """
+    def model(price, quantity, bars):
+        cost = np.zeros(np.shape(price))
+        for m in models:
+            cost += m(price, quantity, bars)
+        return cost
+    return model
+
+
+def apply_costs(price, direction, cost):
+    """
+    Returns the fill prices of buys (direction 1) and sells (-1) at the
+    reference prices after a fractional cost.
+    """
+    return np.asarray(price) * (1.0 + np.asarray(direction) * cost)
+
+
+def latest_bar_fields(bars, symbols, fields=BAR_FIELDS):
+    """
+    Returns a dict of arrays of the latest bar values of each field for
+    the given symbols (which may repeat) of the DataHandler bars.
+    """
+    code = dict( (s, i) for i, s in enumerate(bars.symbol_list) )
+    idx = np.array([code[s] for s in symbols], dtype=np.intp)
+    return dict(
+            (field, bars.get_latest_bars_matrix(field, N=1)[-1][idx])
+            for field in fields )
+
+
+def fill_prices(model, price, directions, quantities, fields):
+    """
+    Returns the fill prices of a batch of fills at the reference prices
+    after the costs of model.
+
+    Parameters:
+    model - The cost model.
+    price - The reference price of each fill.
+    directions - 'BUY' or 'SELL' per fill.
+    quantities - The quantity of each fill.
+    fields - The bar fields of each fill, from latest_bar_fields.
+    """
+    price = np.asarray(price, dtype=np.float64)
+    sign = np.where(np.asarray(directions) == 'BUY', 1.0, -1.0)
+    quantity = np.asarray(quantities, dtype=np.float64)
+    return apply_costs(price, sign, model(price, quantity, fields))
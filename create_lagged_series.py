@@ -9,70 +9,158 @@ Created on Sun May 12 05:54:19 2019
 """
 
 import datetime
+import multiprocessing
+import time
 import numpy as np
 import pandas as pd
 import sklearn
 
-import pandas_datareader as pdr
+from sklearn.base import clone
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.linear_model import LogisticRegression
 from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
 from sklearn.metrics import confusion_matrix
 from sklearn.discriminant_analysis import QuadraticDiscriminantAnalysis
+from sklearn.model_selection import TimeSeriesSplit
 from sklearn.svm import LinearSVC, SVC
 
+from event_driven_trading.feature_store import lagged_features
+
 """
 Create a Pandas DataFrame that contains the lagged price returns for a prior number of days. 
+The features are built from the local symbol.csv files and cached on disk by the
+feature store, so repeated calls (and the SPY forecast strategy) share one computation.
 """
-def create_lagged_series(symbol, start_date, end_date, lags=5):
-    #yahoo stock info
-    ts = pdr.DataReader(
-                    symbol, 'yahoo', start_date-datetime.timedelta(days=365), 
-                    end_date
-    )
-    
-    #Create the new lagged dataframe
-    tslag = pd.DataFrame(index=ts.index)
-    tslag["Today"] = ts["Adj Close"]
-    tslag["Volume"] = ts["Volume"]
-    
-    #Create the shifted lag series of prior trading period close values
-    for i in range(0, lags):
-        tslag["Lag{}".format(str(i+1))] = ts["Adj Close"].shift(i+1)
-        
-    #Create the returns DataFrame
-    tsret = pd.DataFrame(index=tslag.index)
-    tsret["Volume"] = tslag["Volume"]
-    tsret["Today"] = tslag["Today"].pct_change()*100.0
-    
-    #If any of the values of percentage returns equal zero, set them to a small
-    #number (stops issues with QDA model in SKLEARN)
-    for i,x in enumerate(tsret["Today"]):
-        if (abs(x) < 0.0001):
-            tsret["Today"][i] = 0.0001
-            
-    #Create the lagged percentage returns columns
-    for i in range(0, lags):
-        tsret["Lag{}".format(str(i+1))] = \
-        tslag["Lag{}".format(str(i+1))].pct_change() * 100.0
-        
-    #Create the direction column indicating an up or down day
-    tsret["Direction"] = np.sign(tsret["Today"])
-    tsret = tsret[tsret.index >= start_date]
-    
-    return tsret
+def create_lagged_series(symbol, start_date, end_date, lags=5, csv_dir=None):
+    return lagged_features(
+            symbol, start_date, end_date, lags=lags, csv_dir=csv_dir)
 
 
 """
-forecast US stock market in 05' using 2001 - 2004 data.
-We will generate a training/testing split. using default parameters for the radial support
-vector machines and random forest. Then iterate over the models and we then made predictions
-and find the hit rate and the confusion matrix for each model.
+Model comparison harness. Every (model, fold) combination is an independent fit, so
+they are farmed out over a process pool. The fold train/test arrays are cut once and
+handed to each worker when the pool starts, rather than being rebuilt (or pickled)
+for every model.
+"""
+def default_models():
+    """
+    Returns the (name, unfitted model) list compared for the daily forecasts.
+    """
+    return [("LR", LogisticRegression()),
+            ("LDA", LinearDiscriminantAnalysis()),
+            ("QDA", QuadraticDiscriminantAnalysis()),
+            ("LSVC", LinearSVC()),
+            ("RSVM", SVC(
+                    C=1000000.0, cache_size=200, class_weight=None,
+                    coef0=0.0, degree=3, gamma=0.0001, kernel='rbf',
+                    max_iter=-1, probability=False, random_state=None,
+                    shrinking=True, tol=0.001, verbose=False)
+              ),
+              ("RF", RandomForestClassifier(
+                      n_estimators=1000, criterion='gini',
+                      max_depth=None, min_samples_split=2,
+                      min_samples_leaf=1, max_features='sqrt',
+                      bootstrap=True, oob_score=False, n_jobs=1,
+                      random_state=None, verbose=0)
+               )]
+
+
+def make_folds(X, y, n_splits=5):
+    """
+    Cuts X, y into expanding-window time series cross validation folds,
+    returned as a list of (X_train, y_train, X_test, y_test) arrays.
+    """
+    X = np.asarray(X)
+    y = np.asarray(y)
+    return [(X[tr], y[tr], X[te], y[te])
+            for tr, te in TimeSeriesSplit(n_splits=n_splits).split(X)]
+
+
+#the folds are handed to each worker once, not with every task
+_worker_folds = None
+
+
+def _init_worker(folds):
+    global _worker_folds
+    _worker_folds = folds
+
+
+def _fit_fold(task):
+    """
+    Worker entry point: fits a fresh clone of a model on one fold and
+    returns its hit rate, confusion matrix and fit/predict timings.
+    """
+    name, model, fold = task
+    X_train, y_train, X_test, y_test = _worker_folds[fold]
+    model = clone(model)
+    t0 = time.time()
+    model.fit(X_train, y_train)
+    t1 = time.time()
+    pred = model.predict(X_test)
+    t2 = time.time()
+    cm = confusion_matrix(y_test, pred, labels=[-1.0, 1.0])
+    return (name, fold, np.mean(pred == y_test), cm, t1 - t0, t2 - t1)
+
+
+def compare_models(models, X, y, n_splits=5, folds=None, processes=None):
+    """
+    Evaluates each model on every fold, in parallel over processes.
+    
+    Parameters:
+    models - A list of (name, unfitted model) tuples.
+    X, y - The features and labels, in time order.
+    n_splits - The number of TimeSeriesSplit folds.
+    folds - Optionally, precomputed folds from make_folds (or any list
+        of (X_train, y_train, X_test, y_test)), which are then reused.
+    processes - The pool size (default: all cores); 1 runs in process.
+    
+    Returns:
+    summary - A DataFrame indexed by model name with the mean and std
+        hit rate and mean fit and predict times (seconds) over the folds.
+    confusion - A dict of model name to its confusion matrix summed over
+        the folds (rows are true -1/+1, columns predicted -1/+1).
+    """
+    if folds is None:
+        folds = make_folds(X, y, n_splits)
+    tasks = [(name, model, f)
+             for name, model in models for f in range(len(folds))]
+    
+    if processes == 1:
+        _init_worker(folds)
+        results = [_fit_fold(t) for t in tasks]
+    else:
+        pool = multiprocessing.Pool(
+                processes, initializer=_init_worker, initargs=(folds,))
+        try:
+            results = pool.map(_fit_fold, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    
+    rows = pd.DataFrame(
+            [(r[0], r[1], r[2], r[4], r[5]) for r in results],
+            columns=["model", "fold", "hit_rate", "fit_time", "predict_time"])
+    names = [name for name, _ in models]
+    summary = rows.groupby("model").agg(
+            hit_rate=("hit_rate", "mean"), hit_rate_std=("hit_rate", "std"),
+            fit_time=("fit_time", "mean"),
+            predict_time=("predict_time", "mean")).reindex(names)
+    confusion = dict((name, np.zeros((2, 2), dtype=int)) for name in names)
+    for r in results:
+        confusion[r[0]] += r[3]
+    return summary, confusion
+
+
+"""
+forecast US stock market direction using 2001 - 2005 data.
+We evaluate each model over expanding-window time series cross validation folds, using default
+parameters for the radial support vector machines and random forest. The model/fold fits run in
+parallel and we report the hit rate, the confusion matrix and the fit/predict times for each model.
 """
 if __name__ == "__main__":
-    #create the lagged series of the SP500
+    #create the lagged series of the SP500, using the local SPY data
     snpret = create_lagged_series(
-        "^GSPC", datetime.datetime(2001,1,10),
+        "SPY", datetime.datetime(2001,1,10),
         datetime.datetime(2005,12,31), lags=5                           
     )
     
@@ -82,52 +170,10 @@ if __name__ == "__main__":
     X = snpret[["Lag1", "Lag2"]]
     y = snpret["Direction"]
     
-    #the test data is split into two parts
-    start_test = datetime.datetime(2005,1,1)
-    
-    #Create training and test sets
-    X_train = X[X.index < start_test]
-    X_test = X[X.index >= start_test]
-    y_train = y[y.index < start_test]
-    y_test = y[y.index >= start_test]
-    
-    #create the parametrised models
+    #evaluate every model over time series cross validation folds
     print("Hit Rates/Confusion Matrices:\n")
-    models = [("LR", LogisticRegression()),
-              ("LDA", LinearDiscriminantAnalysis()),
-              ("QDA", QuadraticDiscriminantAnalysis()),
-              ("LSVC", LinearSVC()),
-              ("RSVM", SVC(
-                      C=1000000.0, cache_size=200, class_weight=None,
-                      coef0=0.0, degree=3, gamma=0.0001, kernel='rbf',
-                      max_iter=-1, probability=False, random_state=None,
-                      shrinking=True, tol=0.001, verbose=False)
-                ),
-                ("RF", RandomForestClassifier(
-                        n_estimators=1000, criterion='gini',
-                        max_depth=None, min_samples_split=2,
-                        min_samples_leaf=1, max_features='auto',
-                        bootstrap=True, oob_score=False, n_jobs=1,
-                        random_state=None, verbose=0)
-                 )]
-    
-    #iterate through the models
-    for m in models:
-        #Train each of the models on the training set
-        m[1].fit(X_train, y_train)
-        pred = m[1].predict(X_test)
-        
-        #output the hit rate and the confusion matrix for each model
-        print("{}:\n{}".format(m[0], m[1].score(X_test, y_test)))
-        print("{}\n".format(confusion_matrix(pred, y_test)))
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
\ No newline at end of file
+    summary, confusion = compare_models(default_models(), X, y, n_splits=5)
+    print(summary.to_string(float_format="{:.4f}".format))
+    print("")
+    for name in summary.index:
+        print("{}:\n{}\n".format(name, confusion[name]))
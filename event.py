@@ -57,7 +57,8 @@ class OrderEvent(Event):
     Handles the event of sending an order to an execution system.
     the order contains a symbol, a type, quantity and direction.
     """
-    def __init__(self, symbol, order_type, quantity, direction):
+    def __init__(self, symbol, order_type, quantity, direction,
+                 strategy_id=1, price=None):
         """
         Initialise the order type, setting whether it is a market
         order or limit order, has a quantity, and its direction
@@ -67,12 +68,16 @@ class OrderEvent(Event):
             order type
             quantity
             direction
+            strategy_id - the strategy whose signal produced the order
+            price - the limit or stop price of LMT and STP orders
         """
         self.type = 'ORDER'
         self.symbol = symbol
         self.order_type = order_type
         self.quantity = quantity
         self.direction = direction
+        self.strategy_id = strategy_id
+        self.price = price
     
     def print_order(self):
         """
@@ -91,7 +96,7 @@ class FillEvent(Event):
     in addition, stores the commission of the trade from the brokerage.
     """
     def __init__(self, timeindex, symbol, exchange, quantity, direction,
-                 fill_cost, commission=None):
+                 fill_cost, commission=None, strategy_id=1):
         """
         Initialises the fillevent object. sets the symbol, 
         exchange, quantity, direction, cost of fill and an optional comm.
@@ -104,8 +109,10 @@ class FillEvent(Event):
         exchange - The exchange where the order was filled.
         quantity - The filled quantity.
         direction - The direction of fill (’BUY’ or ’SELL’)
-        fill_cost - The holdings value in dollars.
+        fill_cost - The fill price per share, or None to value the
+            fill at the latest bar.
         commission - An optional commission sent from IB.
+        strategy_id - The strategy whose order was filled.
         """
         self.type = 'FILL'
         self.timeindex = timeindex
@@ -114,6 +121,7 @@ class FillEvent(Event):
         self.quantity = quantity
         self.direction = direction
         self.fill_cost = fill_cost
+        self.strategy_id = strategy_id
         
         #calculate commission
         if commission is None:
@@ -130,13 +138,11 @@ class FillEvent(Event):
         Based on "US API Directed Order":
         https://www.interactivebrokers.com/en/index.php?
         f=commission&p=stocks2
+        
+        The simulated execution handlers price whole batches of fills
+        with the table-driven models of commission.py instead.
         """    
-        full_cost = 1.3
-        if self.quantity <= 500:
-            full_cost = max(1.3, 0.013 * self.quantity)
-        else: #Greater than 500
-            full_cost = max(1.3, 0.013 * self.quantity)
-        return full_cost
+        return max(1.3, 0.013 * self.quantity)
         
 
     
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+#event_log.py
+from __future__ import print_function
+"""
+Deterministic event log recording and replay.
+
+When Backtest is given an event_log path every event it dispatches is
+appended to a binary log of fixed-size records: MARKET events with the bar
+timestamp followed by the mark price of every symbol, then SIGNAL, ORDER
+and FILL events with their symbols, quantities, prices and commissions.
+Every record is stamped with the bar time rather than the wall clock, so
+two runs that behave identically write identical logs.
+
+The log is read back with a single np.fromfile and the portfolio holdings,
+equity curve and summary statistics are rebuilt with cumulative sums over
+whole arrays, without re-running the strategy, data handler or event loop.
+"""
+
+import json
+import struct
+
+import numpy as np
+import pandas as pd
+
+from event_driven_trading.performance import create_sharpe_ratio, create_drawdowns
+
+
+MAGIC = b'EVLOG1\n'
+
+#record types
+MARKET, PRICE, SIGNAL, ORDER, FILL = 0, 1, 2, 3, 4
+EVENT_TYPES = {'MARKET': MARKET, 'SIGNAL': SIGNAL, 'ORDER': ORDER, 'FILL': FILL}
+
+DIRECTIONS = {'LONG': 1, 'SHORT': -1, 'EXIT': 0, 'BUY': 1, 'SELL': -1}
+ORDER_TYPES = {'MKT': 0, 'LMT': 1, 'STP': 2}
+
+LOG_DTYPE = np.dtype([
+        ('type', 'u1'),
+        ('order_type', 'u1'),
+        ('direction', 'i1'),
+        ('symbol', 'i4'),
+        ('strategy_id', 'i4'),
+        ('timestamp', 'i8'),
+        ('quantity', 'f8'),
+        ('price', 'f8'),
+        ('commission', 'f8'),
+        ('strength', 'f8'),
+])
+
+NAT = np.iinfo(np.int64).min
+
+
+def _to_ns(dt):
+    if dt is None:
+        return NAT
+    return pd.Timestamp(dt).value
+
+
+class EventLogWriter(object):
+    """
+    Appends the events dispatched by a Backtest to a binary log.
+    Records are buffered in memory and written in blocks.
+    """
+    def __init__(self, path, bars, mark_field="adj_close",
+                 initial_capital=None, start_date=None, buffer_size=65536):
+        """
+        Parameters:
+        path - The log file, created (or truncated) when opened.
+        bars - The DataHandler object of the backtest.
+        mark_field - The bar field used to value positions, "adj_close"
+            for Portfolio and "close" for PortfolioHFT.
+        initial_capital, start_date - Stored in the header for replay.
+        buffer_size - The number of records buffered between writes.
+        """
+        self.bars = bars
+        self.symbol_list = list(bars.symbol_list)
+        self.symbol_code = dict( (s, i) for i, s in enumerate(self.symbol_list) )
+        self.mark_field = mark_field
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered = 0
+        self.current_ts = NAT
+
+        header = json.dumps({
+                'symbols': self.symbol_list,
+                'mark_field': mark_field,
+                'initial_capital': initial_capital,
+                'start_date': None if start_date is None else str(start_date),
+                'dtype': LOG_DTYPE.descr,
+        }).encode('utf-8')
+        self.f = open(path, 'wb')
+        self.f.write(MAGIC)
+        self.f.write(struct.pack('<I', len(header)))
+        self.f.write(header)
+
+    def _append(self, records):
+        self.buffer.append(records)
+        self.buffered += len(records)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def log(self, event):
+        """
+        Appends a record for the event (and, for a MARKET event, a
+        PRICE record per symbol).
+        """
+        if event.type == 'MARKET':
+            self._log_market()
+            return
+        rec = np.zeros(1, dtype=LOG_DTYPE)
+        rec['type'] = EVENT_TYPES[event.type]
+        rec['timestamp'] = self.current_ts
+        rec['symbol'] = self.symbol_code.get(event.symbol, -1)
+        rec['price'] = np.nan
+        rec['strategy_id'] = event.strategy_id
+        if event.type == 'SIGNAL':
+            rec['direction'] = DIRECTIONS[event.signal_type]
+            rec['strength'] = event.strength
+        elif event.type == 'ORDER':
+            rec['direction'] = DIRECTIONS[event.direction]
+            rec['order_type'] = ORDER_TYPES.get(event.order_type, 255)
+            rec['quantity'] = event.quantity
+            if event.price is not None:
+                rec['price'] = event.price
+        elif event.type == 'FILL':
+            rec['direction'] = DIRECTIONS[event.direction]
+            rec['quantity'] = event.quantity
+            if event.fill_cost is not None:
+                rec['price'] = event.fill_cost
+            rec['commission'] = event.commission
+        self._append(rec)
+
+    def _log_market(self):
+        s0 = self.symbol_list[0]
+        if len(self.bars.get_latest_bars(s0, N=1)) == 0:
+            return
+        self.current_ts = _to_ns(self.bars.get_latest_bar_datetime(s0))
+        prices = self.bars.get_latest_bars_matrix(self.mark_field, N=1)
+        recs = np.zeros(1 + len(self.symbol_list), dtype=LOG_DTYPE)
+        recs['timestamp'] = self.current_ts
+        recs['type'][0] = MARKET
+        recs['price'][0] = np.nan
+        recs['type'][1:] = PRICE
+        recs['symbol'][1:] = np.arange(len(self.symbol_list))
+        recs['price'][1:] = prices[-1]
+        self._append(recs)
+
+    def flush(self):
+        if self.buffer:
+            np.concatenate(self.buffer).tofile(self.f)
+            self.f.flush()
+            self.buffer = []
+            self.buffered = 0
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+
+def read_event_log(path):
+    """
+    Returns the header dict and the structured array of records.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not an event log".format(path))
+        size = struct.unpack('<I', f.read(4))[0]
+        header = json.loads(f.read(size).decode('utf-8'))
+        records = np.fromfile(f, dtype=LOG_DTYPE)
+    return header, records
+
+
+def replay_equity_curve(path, initial_capital=None, start_date=None):
+    """
+    Rebuilds the Portfolio holdings and equity curve from an event log,
+    as Portfolio.create_equity_curve_dataframe would after the run.
+
+    As in the event loop, the snapshot taken on a MARKET event holds the
+    fills of earlier bars valued at that bar's prices, and a fill is
+    costed at its fill price, or where the handler gave none at the mark
+    price of the bar on which it occurs.
+    """
+    header, rec = read_event_log(path)
+    symbols = header['symbols']
+    if initial_capital is None:
+        initial_capital = header['initial_capital']
+    if start_date is None and header['start_date'] is not None:
+        start_date = pd.Timestamp(header['start_date'])
+
+    types = rec['type']
+    #bar number of every record: the latest MARKET at or before it
+    bar_no = np.cumsum(types == MARKET) - 1
+    market = np.flatnonzero(types == MARKET)
+    n_bars, n_sym = len(market), len(symbols)
+
+    prices = np.full((n_bars, n_sym), np.nan)
+    p = np.flatnonzero(types == PRICE)
+    prices[bar_no[p], rec['symbol'][p]] = rec['price'][p]
+
+    #aggregate the fills of each bar per symbol
+    f = np.flatnonzero((types == FILL) & (bar_no >= 0))
+    fb, fs = bar_no[f], rec['symbol'][f]
+    qty = rec['direction'][f] * rec['quantity'][f]
+    fill_price = rec['price'][f]
+    cost = qty * np.where(np.isnan(fill_price), prices[fb, fs], fill_price)
+    commission = rec['commission'][f]
+    dpos = np.zeros((n_bars, n_sym))
+    np.add.at(dpos, (fb, fs), qty)
+    dcash = np.zeros(n_bars)
+    np.add.at(dcash, fb, -(cost + commission))
+    dcomm = np.zeros(n_bars)
+    np.add.at(dcomm, fb, commission)
+
+    #the snapshot at bar b sees the fills of bars before b
+    def before(x):
+        out = np.zeros_like(x)
+        out[1:] = np.cumsum(x, axis=0)[:-1]
+        return out
+    positions = before(dpos)
+    cash = initial_capital + before(dcash)
+    comm = before(dcomm)
+    holdings = positions * prices
+
+    curve = pd.DataFrame(holdings, columns=symbols)
+    curve['datetime'] = pd.to_datetime(rec['timestamp'][market])
+    curve['cash'] = cash
+    curve['commission'] = comm
+    curve['total'] = cash + holdings.sum(axis=1)
+
+    first = dict( (s, 0.0) for s in symbols )
+    first.update({
+            'datetime': start_date, 'cash': initial_capital,
+            'commission': 0.0, 'total': initial_capital})
+    curve = pd.concat([pd.DataFrame([first]), curve], ignore_index=True)
+    curve.set_index('datetime', inplace=True)
+    curve['returns'] = curve['total'].pct_change()
+    curve['equity_curve'] = (1.0+curve['returns']).cumprod()
+    return curve
+
+
+def replay_summary_stats(path, periods=252*60*6.5, **kwargs):
+    """
+    Returns the equity curve and the Portfolio summary statistics
+    rebuilt from an event log.
+    """
+    curve = replay_equity_curve(path, **kwargs)
+    total_return = curve['equity_curve'].iloc[-1]
+    sharpe_ratio = create_sharpe_ratio(curve['returns'], periods=periods)
+    drawdown, max_dd, dd_duration = create_drawdowns(curve['equity_curve'])
+    curve['drawdown'] = drawdown
+    stats = [("Total Return", "{:.4f}".format(((total_return-1.0) *100.0))),
+             ("Sharpe Ratio", "{:.4f}".format(sharpe_ratio)),
+             ("Max Drawdown", "{:.4f}".format((max_dd * 100.0))),
+             ("Drawdown Duration", "{:.4f}".format(dd_duration)) ]
+    return curve, stats
+
+
+def compare_event_logs(path_a, path_b):
+    """
+    Returns the index of the first record at which two logs differ,
+    or None if they are identical.
+    """
+    header_a, a = read_event_log(path_a)
+    header_b, b = read_event_log(path_b)
+    n = min(len(a), len(b))
+    #compare the raw bytes so NaN prices compare equal to themselves
+    raw_a = a[:n].view(np.uint8).reshape(n, LOG_DTYPE.itemsize)
+    raw_b = b[:n].view(np.uint8).reshape(n, LOG_DTYPE.itemsize)
+    diff = np.flatnonzero((raw_a != raw_b).any(axis=1))
+    if len(diff) > 0:
+        return int(diff[0])
+    if len(a) != len(b) or header_a['symbols'] != header_b['symbols']:
+        return n
+    return None
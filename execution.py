@@ -11,7 +11,14 @@ Created on Thu May 23 20:31:04 2019
 from abc import ABCMeta, abstractmethod
 import datetime
 import queue
+
+import numpy as np
+import pandas as pd
+
 from event_driven_trading.event import FillEvent, OrderEvent
+from event_driven_trading.order_book import MatchingEngine
+from event_driven_trading.costs import BAR_FIELDS, latest_bar_fields, fill_prices
+from event_driven_trading.commission import default_commission_model
 
 
 class ExecutionHandler(object):
@@ -33,54 +40,235 @@ class ExecutionHandler(object):
         that gets placed into the Event queue.
         """
         raise NotImplementedError("Should implement execute_order()")
+    
+    def update_timeindex(self, event):
+        """
+        Called by the Backtest on every MarketEvent, for handlers which
+        work resting orders against new bars. Does nothing by default.
+        """
+        pass
+    
+    def process_pending_orders(self):
+        """
+        Called by the Backtest once the events due at the current time
+        have been handled, for handlers which fill their orders in
+        batches. Does nothing by default.
+        """
+        pass
         
 class SimulatedExecutionHandler(ExecutionHandler):
     """
     The simulated execution handler simply converts all order
     objects into their equivalent fill objects automatically
-    without latency, slippage or fill-ratio issues.
+    without fill-ratio issues, optionally after a simulated
+    latency and with slippage from a cost model. Commissions
+    come from a CommissionModel (commission.py).
     This allows a straightforward "first go" test of any strategy,
     before implementation with a more sophisticated execution
     handler.
     """
     
-    def __init__(self, events):
+    def __init__(self, events, bars=None, latency=None, slippage=None,
+                 price_field="adj_close", commission=None, exchange='ARCA',
+                 batch_orders=False):
         """
         Initialises the handler, settting the queues up internally
+        
+        Parameters:
+        events - The Event Queue object. Latency needs the
+            TimedEventQueue of the Backtest.
+        bars - The DataHandler object.
+        latency - None, a latency in seconds, or a callable returning
+            one per order (see sim_clock.py).
+        slippage - An optional cost model from costs.py. Without one
+            fill_cost is None and the portfolio values the fill at the
+            latest bar.
+        price_field - The bar field the slippage is applied to.
+        commission - The CommissionModel, defaulting to the IB
+            directed order rates of FillEvent.
+        exchange - The venue of the fills.
+        batch_orders - Hold the orders until the Backtest calls
+            process_pending_orders, pricing all the orders due at the
+            same time in one batch. By default each order is filled as
+            it is executed, its fill queued behind the events already
+            pending, as before batching was added.
         """
         self.events = events
+        self.bars = bars
+        self.latency = latency
+        self.batch_orders = batch_orders
+        self.slippage = slippage
+        self.price_field = price_field
+        self.commission = commission or default_commission_model()
+        self.exchange = exchange
+        self.pending = []
         
     def execute_order(self, event):
         """
-        Simply converts order objects into Fill objects naively,
-        i.e. without any latency, slippage or fill ratio problems.
+        Fills the order, or with batch_orders queues it to be filled
+        with the rest of the orders due at the current time.
         """
         if event.type == 'ORDER':
+            self.pending.append(event)
+            if not self.batch_orders:
+                self.process_pending_orders()
+            
+    def process_pending_orders(self):
+        """
+        Converts the queued orders into Fill objects, pricing them and
+        their commissions in one call each to the slippage and
+        commission models, each stamped with the simulated time at
+        which it arrives.
+        """
+        if not self.pending:
+            return
+        orders, self.pending = self.pending, []
+        symbols = [o.symbol for o in orders]
+        quantities = [o.quantity for o in orders]
+        
+        prices = np.nan
+        fill_costs = [None] * len(orders)
+        if self.slippage is not None:
+            fields = latest_bar_fields(
+                    self.bars, symbols, BAR_FIELDS + (self.price_field,))
+            prices = fill_prices(
+                    self.slippage, fields[self.price_field],
+                    [o.direction for o in orders], quantities, fields)
+            fill_costs = prices.tolist()
+        elif self.bars is not None:
+            prices = latest_bar_fields(
+                    self.bars, symbols, (self.price_field,))[self.price_field]
+        commissions = self.commission.compute(
+                self.exchange, symbols, quantities, prices).tolist()
+        
+        clock = getattr(self.events, 'clock', None)
+        for order, fill_cost, commission in zip(orders, fill_costs, commissions):
+            if clock is None:
+                #a plain queue has no simulated time
+                fill_ns = None
+                timeindex = datetime.datetime.utcnow()
+            else:
+                fill_ns = clock.now_ns
+                if self.latency is not None:
+                    latency = self.latency() if callable(self.latency) else self.latency
+                    fill_ns += int(round(latency * 1e9))
+                timeindex = pd.Timestamp(fill_ns)
             fill_event = FillEvent(
-                    datetime.datetime.utcnow(), event.symbol,
-                    'ARCA', event.quantity, event.direction, None
+                    timeindex, order.symbol,
+                    self.exchange, order.quantity, order.direction, fill_cost,
+                    commission, strategy_id=order.strategy_id
                     )
-            self.events.put(fill_event)
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+            if fill_ns is None:
+                self.events.put(fill_event)
+            else:
+                self.events.put(fill_event, at=fill_ns)
+            
 
+class MatchingExecutionHandler(ExecutionHandler):
+    """
+    Simulates execution of MKT, LMT and STP orders against the bars of
+    the DataHandler. Orders rest in a MatchingEngine and are matched
+    against each new bar, so an order never fills on the bar whose
+    data produced it. Fills carry their fill price per share as
+    fill_cost and the bar datetime as their timeindex.
+    
+    An optional slippage cost model is applied to the MKT and STP
+    fills of each bar in one batch. LMT fills are never worse than
+    their limit.
+    
+    Orders are matched on the scale of the field the portfolio marks
+    positions at: open, high and low are multiplied by mark_field / close
+    per bar, so with adjusted data limit and stop prices are adjusted
+    prices too, and a fill books no jump when it is first marked.
+    """
+    def __init__(self, events, bars=None, exchange='ARCA', slippage=None,
+                 commission=None, mark_field="adj_close"):
+        """
+        Parameters:
+        events - The Event Queue object.
+        bars - The DataHandler object, with open, high, low, close and
+            volume fields.
+        exchange - The exchange stamped on the fills.
+        slippage - An optional cost model from costs.py.
+        commission - The CommissionModel, defaulting to the IB
+            directed order rates of FillEvent.
+        mark_field - The bar field the portfolio values positions
+            with, "adj_close" for Portfolio and "close" for PortfolioHFT.
+        """
+        self.events = events
+        self.bars = bars
+        self.exchange = exchange
+        self.slippage = slippage
+        self.commission = commission or default_commission_model()
+        self.mark_field = mark_field
+        self.engine = MatchingEngine()
+        self.latest_datetime = None
+        
+    def execute_order(self, event):
+        """
+        Places the order in the book, returning its order id for
+        cancel_order.
+        """
+        if event.type == 'ORDER':
+            return self.engine.submit(event)
+        
+    def cancel_order(self, order_id):
+        return self.engine.cancel(order_id)
+        
+    def _marked_range(self, symbol):
+        """
+        Returns the open, high and low of the symbol's latest bar on the
+        scale of mark_field.
+        """
+        value = self.bars.get_latest_bar_value
+        open_, high, low = [value(symbol, f) for f in ("open", "high", "low")]
+        if self.mark_field != "close":
+            close = value(symbol, "close")
+            if close:
+                scale = value(symbol, self.mark_field) / close
+                open_, high, low = open_ * scale, high * scale, low * scale
+        return open_, high, low
+        
+    def update_timeindex(self, event):
+        """
+        Matches the resting orders of every symbol against its latest
+        bar, once per bar.
+        """
+        symbol_list = self.bars.symbol_list
+        if len(self.bars.get_latest_bars(symbol_list[0], N=1)) == 0:
+            return
+        latest_datetime = self.bars.get_latest_bar_datetime(symbol_list[0])
+        #update_bars emits a final MarketEvent once the data has run out
+        if latest_datetime == self.latest_datetime:
+            return
+        self.latest_datetime = latest_datetime
+        
+        fills = []
+        for symbol in self.engine.active_symbols():
+            open_, high, low = self._marked_range(symbol)
+            fills.extend(self.engine.match(symbol, open_, high, low))
+        if not fills:
+            return
+        
+        prices = [price for order, price in fills]
+        slipped = [k for k, (order, price) in enumerate(fills)
+                   if order.order_type != 'LMT']
+        if self.slippage is not None and slipped:
+            orders = [fills[k][0] for k in slipped]
+            fields = latest_bar_fields(self.bars, [o.symbol for o in orders])
+            costs = fill_prices(
+                    self.slippage, [prices[k] for k in slipped],
+                    [o.direction for o in orders],
+                    [o.quantity for o in orders], fields)
+            for k, price in zip(slipped, costs.tolist()):
+                prices[k] = price
+        
+        commissions = self.commission.compute(
+                self.exchange, [order.symbol for order, _ in fills],
+                [order.quantity for order, _ in fills], prices).tolist()
+        
+        for (order, _), price, commission in zip(fills, prices, commissions):
+            self.events.put(FillEvent(
+                    latest_datetime, order.symbol, self.exchange,
+                    order.quantity, order.direction, price, commission,
+                    strategy_id=order.strategy_id))
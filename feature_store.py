@@ -0,0 +1,139 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#feature_store.py
+from __future__ import print_function
+"""
+Local feature store for the daily forecasting models.
+
+Lagged return and direction features are built from the local
+'symbol.csv' price files (SPY.csv etc.) with vectorised pandas operations,
+and memoised both in memory and on disk keyed by (symbol, date range,
+lags) and the source file's size and modification time. The strategy and
+the model comparison script therefore share one computation, and neither
+needs a network connection.
+"""
+
+import datetime
+import hashlib
+import os, os.path
+
+import numpy as np
+import pandas as pd
+
+
+#the price CSVs live alongside the code by default
+DEFAULT_CSV_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR_NAME = '.feature_cache'
+
+_memory_cache = {}
+
+
+def load_symbol_csv(symbol, csv_dir=None):
+    """
+    Reads a local 'symbol.csv' file of daily bars into a DataFrame
+    indexed on date, with the same column names as HistoricCSVDataHandler.
+    """
+    csv_dir = csv_dir or DEFAULT_CSV_DIR
+    return pd.read_csv(
+            os.path.join(csv_dir, '{}.csv'.format(symbol)),
+            header=0, index_col=0, parse_dates=True,
+            names=[
+                    'datetime', 'open', 'high', 'low',
+                    'close', 'adj_close', 'volume'
+                    ]).sort_index(axis=0)
+
+
+def build_lagged_features(prices, lags=5):
+    """
+    Builds the lagged percentage return features from a DataFrame with
+    adj_close and volume columns.
+
+    Columns: Volume, Today (today's % return, with near-zero returns set
+    to 0.0001 so QDA has no degenerate classes), Lag1..LagN (the raw %
+    return 1..N days earlier) and Direction (the sign of Today).
+    """
+    ret = prices['adj_close'].pct_change() * 100.0
+
+    tsret = pd.DataFrame(index=prices.index)
+    tsret["Volume"] = prices['volume']
+    tsret["Today"] = ret.mask(ret.abs() < 0.0001, 0.0001)
+    for i in range(0, lags):
+        tsret["Lag{}".format(str(i+1))] = ret.shift(i+1)
+    tsret["Direction"] = np.sign(tsret["Today"])
+    return tsret
+
+
+def asof_lagged_features(symbol, lags=5, csv_dir=None):
+    """
+    Returns, for every bar t of the symbol's file, the Lag1..LagN
+    features of the *following* bar, i.e. the % returns of bars t,
+    t-1, ... t-N+1. Each row only uses prices up to and including its
+    own date, so it can be used to forecast the next bar at t's close.
+    """
+    prices = load_symbol_csv(symbol, csv_dir)
+    ret = prices['adj_close'].pct_change() * 100.0
+    feats = pd.DataFrame(index=prices.index)
+    for i in range(0, lags):
+        feats["Lag{}".format(str(i+1))] = ret.shift(i)
+    return feats
+
+
+def _cache_key(symbol, start_date, end_date, lags, csv_path):
+    """
+    Content key for a feature set. The size and modification time of
+    the source file are included so edits to the CSV invalidate it.
+    """
+    st = os.stat(csv_path)
+    raw = repr((
+            symbol, str(start_date), str(end_date), lags,
+            st.st_size, int(st.st_mtime)
+    ))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def lagged_features(
+        symbol, start_date, end_date, lags=5, csv_dir=None, cache_dir=None):
+    """
+    Returns the lagged return features of symbol for bars between
+    start_date and end_date inclusive, computing and caching them on
+    the first request.
+
+    Rows are dropped where the file has too little history before them
+    to fill every lag.
+
+    Parameters:
+    symbol - The symbol, read from 'symbol.csv' in csv_dir.
+    start_date, end_date - The datetime range of the features.
+    lags - The number of lagged return columns.
+    csv_dir - The directory of the price files.
+    cache_dir - The on-disk cache directory, defaulting to
+        '.feature_cache' in csv_dir. False disables the disk cache.
+    """
+    csv_dir = csv_dir or DEFAULT_CSV_DIR
+    csv_path = os.path.join(csv_dir, '{}.csv'.format(symbol))
+    key = _cache_key(symbol, start_date, end_date, lags, csv_path)
+    if key in _memory_cache:
+        return _memory_cache[key].copy()
+
+    if cache_dir is None:
+        cache_dir = os.path.join(csv_dir, CACHE_DIR_NAME)
+    cache_path = None
+    if cache_dir is not False:
+        cache_path = os.path.join(cache_dir, '{}.pkl'.format(key))
+        if os.path.exists(cache_path):
+            tsret = pd.read_pickle(cache_path)
+            _memory_cache[key] = tsret
+            return tsret.copy()
+
+    tsret = build_lagged_features(load_symbol_csv(symbol, csv_dir), lags)
+    tsret = tsret[(tsret.index >= start_date) & (tsret.index <= end_date)]
+    tsret = tsret.dropna()
+
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        #write then rename so concurrent workers never see a partial file
+        tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+        tsret.to_pickle(tmp_path)
+        os.replace(tmp_path, cache_path)
+    _memory_cache[key] = tsret
+    return tsret.copy()
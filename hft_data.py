@@ -11,11 +11,14 @@ Created on Wed May 22 18:27:41 2019
 from abc import ABCMeta, abstractmethod #to define abstract base classes
 import datetime
 import os, os.path
+import sys
 
 import numpy as np
 import pandas as pd
 
+from event_driven_trading.data import asof_index, range_bounds
 from event_driven_trading.event import MarketEvent
+from event_driven_trading.resample import get_timeframe_cache
 
 class DataHandler(object): #abstract parent class
     """
@@ -63,13 +66,79 @@ class DataHandler(object): #abstract parent class
         raise NotImplementedError("Should implement get_latest_bar_value()")
         
     @abstractmethod
-    def get_latest_bars_values(self, symbol, val_type, N=1):
+    def get_latest_bars_values(self, symbol, val_type, N=1, timeframe=None):
         """
         Returns the latest N bar values from the latest_symbol list,
-        or N-k if less available
+        or N-k if less available. With a timeframe (e.g. '1h'), the
+        values are those of the bars resampled to it (see resample.py).
         """
         raise NotImplementedError("Should implement get_latest_bar_values()")
         
+    def get_latest_bars_matrix(self, val_type, N=1):
+        """
+        Returns the latest N values of val_type for every symbol as one
+        (N x symbols) array, columns in symbol_list order, or N-k rows
+        if less available. This default stacks get_latest_bars_values
+        symbol by symbol; handlers holding aligned arrays override it.
+        """
+        cols = [self.get_latest_bars_values(s, val_type, N)
+                for s in self.symbol_list]
+        n = min(len(c) for c in cols) if cols else 0
+        if n == 0:
+            return np.empty((0, len(cols)))
+        return np.column_stack([c[len(c)-n:] for c in cols])
+        
+    def get_next_bar_datetime(self):
+        """
+        Returns the datetime of the bar the next update_bars will push,
+        or None if it is not known in advance (e.g. a live feed) or the
+        data has run out. Used to schedule simulated events between bars.
+        """
+        return None
+        
+    def get_bar_times(self, symbol):
+        """
+        Returns the datetimes of the symbol's bars released so far as a
+        sorted int64 nanosecond array, the index of the as-of and range
+        queries. This default reads every bar; handlers keeping such an
+        index override it.
+        """
+        return np.array([
+                pd.Timestamp(b[0]).value
+                for b in self.get_latest_bars(symbol, N=sys.maxsize)], dtype=np.int64)
+        
+    def get_bar_asof(self, symbol, dt):
+        """
+        Returns the last bar at or before dt, in the form of
+        get_latest_bar, or None if there is none. Only bars released so
+        far are searched, so a dt beyond the current bar returns it.
+        """
+        times = self.get_bar_times(symbol)
+        i = asof_index(times, dt)
+        if i < 0:
+            return None
+        return self.get_latest_bars(symbol, len(times) - i)[0]
+        
+    def get_bars_between(self, symbol, start=None, end=None):
+        """
+        Returns the released bars with datetimes from start to end
+        inclusive, in the form of get_latest_bars. A bound of None is
+        open ended.
+        """
+        times = self.get_bar_times(symbol)
+        lo, hi = range_bounds(times, start, end)
+        if hi <= lo:
+            return []
+        return self.get_latest_bars(symbol, len(times) - lo)[:hi - lo]
+        
+    def get_bars_values_between(self, symbol, val_type, start=None, end=None):
+        """
+        Returns the val_type values of get_bars_between as an array.
+        """
+        return np.array([
+                getattr(b[1], val_type)
+                for b in self.get_bars_between(symbol, start, end)])
+        
     @abstractmethod
     def update_bars(self):
         """
@@ -85,9 +154,9 @@ be replaced with a database class to query the data for us. but this way
 we aren't concerned with the 'boilerplate' code of connecting to a db
 and using SQL.
 """
-class HistoricCSVDataHandler(DataHandler):
+class HistoricCSVDataHandlerHFT(DataHandler):
     """
-    HistoricCSVDataHandler is designed to read CSV files for
+    HistoricCSVDataHandlerHFT is designed to read CSV files for
     each requested symbol from disk and provide an interface
     to obtain the "latest" bar in a manner identical to a live
     trading interface.
@@ -110,6 +179,8 @@ class HistoricCSVDataHandler(DataHandler):
         self.csv_dir = csv_dir
         self.symbol_list = symbol_list
         self.symbol_data = {}
+        self.symbol_frames = {}
+        self.bar_matrices = {}
         self.latest_symbol_data = {}
         self.continue_backtest = True
         
@@ -143,9 +214,13 @@ class HistoricCSVDataHandler(DataHandler):
             #set the latest symbol_data to None
             self.latest_symbol_data[s] = []
             
-        #reindex the dataframes
+        #reindex the dataframes, keeping the full frames for
+        #whole-history analysis such as the pair scanner
         for s in self.symbol_list:
-            self.symbol_data[s] = self.symbol_data[s].reindex(index=comb_index, method='pad').iterrows()
+            self.symbol_frames[s] = self.symbol_data[s].reindex(index=comb_index, method='pad')
+            self.symbol_data[s] = self.symbol_frames[s].iterrows()
+        #the sorted int64 bar index of the as-of and range queries
+        self.bar_times = np.asarray(comb_index, dtype='datetime64[ns]').astype(np.int64)
             
             
     def _get_new_bar(self, symbol):
@@ -208,11 +283,13 @@ class HistoricCSVDataHandler(DataHandler):
         else:
             return getattr(bars_list[-1][1], val_type)
         
-    def get_latest_bars_values(self, symbol, val_type, N=1):
+    def get_latest_bars_values(self, symbol, val_type, N=1, timeframe=None):
         """
         Returns the last N bar values from the
         latest_symbol list, or N-k if less available.
         """
+        if timeframe is not None:
+            return get_timeframe_cache(self).values(symbol, val_type, N, timeframe)
         try:
             bars_list = self.get_latest_bars(symbol, N)
         except KeyError:
@@ -221,6 +298,58 @@ class HistoricCSVDataHandler(DataHandler):
         else:
             return np.array([getattr(b[1], val_type) for b in bars_list])
         
+    def get_latest_bars_matrix(self, val_type, N=1):
+        """
+        Returns the last N values of val_type for every symbol as one
+        (N x symbols) array, or N-k rows if less available. Every symbol
+        is reindexed onto the same bars, so this is a read-only slice of
+        a (bars x symbols) matrix built once per field.
+        """
+        matrix = self.bar_matrices.get(val_type)
+        if matrix is None:
+            matrix = np.column_stack([
+                    self.symbol_frames[s][val_type].values
+                    for s in self.symbol_list]).astype(float)
+            matrix.flags.writeable = False
+            self.bar_matrices[val_type] = matrix
+        n = len(self.latest_symbol_data[self.symbol_list[0]])
+        return matrix[max(n-N, 0):n]
+        
+    def get_next_bar_datetime(self):
+        """
+        Returns the datetime of the bar the next update_bars will push,
+        or None once the data has run out.
+        """
+        index = self.symbol_frames[self.symbol_list[0]].index
+        n = len(self.latest_symbol_data[self.symbol_list[0]])
+        return index[n] if n < len(index) else None
+        
+        
+    def get_bar_times(self, symbol):
+        """
+        Returns the datetimes of the released bars, a slice of the int64
+        index of the frames, which every symbol shares.
+        """
+        return self.bar_times[:len(self.latest_symbol_data[symbol])]
+        
+    def get_bar_asof(self, symbol, dt):
+        """
+        Returns the last released bar at or before dt, or None, by
+        binary search of the bar index.
+        """
+        bars_list = self.latest_symbol_data[symbol]
+        i = asof_index(self.bar_times[:len(bars_list)], dt)
+        return bars_list[i] if i >= 0 else None
+        
+    def get_bars_between(self, symbol, start=None, end=None):
+        bars_list = self.latest_symbol_data[symbol]
+        lo, hi = range_bounds(self.bar_times[:len(bars_list)], start, end)
+        return bars_list[lo:hi]
+        
+    def get_bars_values_between(self, symbol, val_type, start=None, end=None):
+        n = len(self.latest_symbol_data[symbol])
+        lo, hi = range_bounds(self.bar_times[:n], start, end)
+        return self.symbol_frames[symbol][val_type].values[lo:hi].copy()
         
     def update_bars(self):
         """
@@ -8,14 +8,41 @@ Created on Thu May 23 20:59:02 2019
 @author: OBar
 """
 import datetime
+import itertools
+import queue
+import threading
 import time
 
-from ib.ext.Contract import Contract
-from ib.ext.Order import Order
-from ib.opt import ibConnection, message
+from event_driven_trading.event import FillEvent, OrderEvent
+from event_driven_trading.execution import ExecutionHandler
+from event_driven_trading.mock_tws import MockContract, MockOrder
 
-from event import FillEvent, OrderEvent
-from execution import ExecutionHandler
+
+class RateLimiter(object):
+    """
+    A token bucket allowing on average rate messages per second, in
+    bursts of up to burst messages. TWS disconnects clients sending
+    more than 50 messages a second, so by default messages are simply
+    spaced 1/rate seconds apart.
+    """
+    def __init__(self, rate=45.0, burst=1):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        
+    def acquire(self):
+        """
+        Takes a token, sleeping until one is available.
+        """
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return
+            time.sleep((1.0 - self.tokens) / self.rate)
 
 """
 We now defne the IBExecutionHandler class. The __init__ constructor 
@@ -31,6 +58,14 @@ information to the Interactive Brokers API. We also have to create an initial de
 which keeps track of all subsequent orders to avoid duplicates. Finally we register the message
 handlers (which we'll de
 ne in more detail below):
+
+Orders are not sent from the event loop itself. execute_order allocates the order id, records
+the order in fill_dict and hands it to an I/O thread, which sends it to TWS no faster than the
+rate limiter allows. Acknowledgements and fills arrive on the connection's reader thread and
+are matched to fill_dict by order id, and the resulting FillEvents are put on the events queue.
+A local mock of TWS for offline testing is in mock_tws.py. IbPy is only imported when a
+connection, contract or order is made, so the handler runs against the mock without it; the
+contracts and orders are then mock_tws.MockContract and MockOrder.
 """
 
 class IBExecutionHandler(ExecutionHandler):
@@ -39,40 +74,76 @@ class IBExecutionHandler(ExecutionHandler):
     accounts when trading live directly.
     """
     def __init__(
-            self, events, order_routing="SMART", currency="USD"):
+            self, events, order_routing="SMART", currency="USD", bars=None,
+            tws_conn=None, max_rate=45.0, batch_orders=True):
         """
         initialises the IBExecutionHandler instance.
+        
+        Parameters:
+        events - The Event Queue object.
+        order_routing - The IB exchange to route orders to.
+        currency - The currency of the contracts.
+        bars - Unused, accepted for Backtest.
+        tws_conn - An open connection, by default a new ibpy
+            connection to TWS (or e.g. a mock_tws.MockTWSConnection).
+        max_rate - The most orders sent per second.
+        batch_orders - Whether the orders of each bar are collected
+            and sent as one basket (see execute_basket).
         """
         self.events = events
         self.order_routing = order_routing
         self.currency = currency
         self.fill_dict = {}
-        
-        self.tws_conn = self.create_tws_connection()
+        self.fill_lock = threading.Lock()
+        self.contracts = {}
+        self.batch_orders = batch_orders
+        self.pending = []
+        self.baskets = {}
+        self.basket_ids = itertools.count(1)
+        
+        if tws_conn is None:
+            tws_conn = self.create_tws_connection()
+        self.tws_conn = tws_conn
         self.order_id = self.create_initial_order_id()
+        self.order_ids = itertools.count(self.order_id)
         self.register_handlers()
         
+        #the outbound pipeline
+        self.rate_limiter = RateLimiter(max_rate)
+        self.outbound = queue.Queue()
+        self.sender = threading.Thread(target=self._send_orders)
+        self.sender.daemon = True
+        self.sender.start()
+        
     def _error_handler(self, msg):
         """
         Handles the capturing of error messages
         """
         #currently no error handling
-        print("Server Error:".format(msg))
+        print("Server Error: {}".format(msg))
         
     def _reply_handler(self, msg):
         """
-        Handles of server replies
-        """
-        #handle open order orderID processing
-        if msg.typeName == "openOrder" \
-        and msg.orderID == self.order_id \
-        and not self.fill_dict.has_key(msg.OrderID):
-                self.create_fill_dict_entry(msg)
-        #handle fills
-        if msg.typeName == "OrderStatus" \
-        and msg.status == "Filled" \
-        and self.fill_dict[msg.orderID]["filled"] == False:
-            self.create_fill(msg)
+        Handles of server replies, called on the connection's reader
+        thread.
+        """
+        #handle open order acknowledgements
+        if msg.typeName == "openOrder":
+            with self.fill_lock:
+                fd = self.fill_dict.get(msg.orderId)
+                if fd is not None and fd["acked"] is None:
+                    fd["acked"] = time.monotonic()
+        #handle fills, once per order
+        elif msg.typeName == "orderStatus" and msg.status == "Filled":
+            with self.fill_lock:
+                fd = self.fill_dict.get(msg.orderId)
+                if fd is None or fd["filled"]:
+                    fd = None
+                else:
+                    fd["filled"] = True
+                    fd["filled_at"] = time.monotonic()
+            if fd is not None:
+                self.create_fill(msg)
         print("Server Response: {}, {}".format(msg.typeName, msg))
             
     def create_tws_connection(self):
@@ -83,6 +154,7 @@ class IBExecutionHandler(ExecutionHandler):
         separate IDs for both the execution connection and
         market data connection, if the latter is used elsewhere.
         """      
+        from ib.opt import ibConnection
         tws_conn = ibConnection()
         tws_conn.connect()
         return tws_conn
@@ -96,6 +168,14 @@ class IBExecutionHandler(ExecutionHandler):
         #there is scopre for more logic but 1 will be default for now
         return 1
     
+    def allocate_order_id(self):
+        """
+        Returns the next order id of the session.
+        """
+        with self.fill_lock:
+            self.order_id = next(self.order_ids)
+            return self.order_id
+    
     def register_handlers(self): #registers the error and reply handler methods with the TWS connection
         """
         Register the error and server reply message handling functions
@@ -113,7 +193,12 @@ class IBExecutionHandler(ExecutionHandler):
     create_contract generated the first component of the paid.
     """
     def create_contract(self, symbol, sec_type, exch, prim_exch, curr):
-        contract = Contract()
+        try:
+            from ib.ext.Contract import Contract
+            contract = Contract()
+        except ImportError:
+            #no ibpy, e.g. offline against mock_tws
+            contract = MockContract(symbol, exch)
         contract.m_symbol = symbol
         contract.m_SecType = sec_type
         contract.m_exchange = exch
@@ -121,29 +206,51 @@ class IBExecutionHandler(ExecutionHandler):
         contract.m_currency = curr
         return contract
     
+    def get_contract(self, symbol):
+        """
+        Returns the Contract for symbol, created once per session.
+        """
+        contract = self.contracts.get(symbol)
+        if contract is None:
+            contract = self.create_contract(
+                    symbol, "STK", self.order_routing,
+                    self.order_routing, self.currency)
+            self.contracts[symbol] = contract
+        return contract
+    
     def create_order(self, order_type, quantity, action):
         """
         Create an order object (market/limit) to go long/short.
         """
-        order = Order()
+        try:
+            from ib.ext.Order import Order
+            order = Order()
+        except ImportError:
+            order = MockOrder(action, quantity, order_type)
         order.m_orderType = order_type
         order.m_totalQuantity = quantity
         order.m_action = action
         return order
     
-    def create_fill_dict_entry(self, msg):
+    def create_fill_dict_entry(self, order_id, event, contract):
         """
         Creates an entry in the Fill Dictionary that lists
         orderIds and provides security information. This is
         needed for the event-driven behaviour of the IB
-        server message behaviour
+        server message behaviour. It is made before the order
+        is sent, so no reply can arrive ahead of it.
         """
-        self.fill_dict[msg.orderId] = {
-            "symbol" : msg.contract.m_symbol,
-            "exchange" : msg.contract.m_exchange,
-            "direction" : msg.order.m_action,
-            "filled" : False
-            }
+        with self.fill_lock:
+            self.fill_dict[order_id] = {
+                "symbol" : event.symbol,
+                "exchange" : contract.m_exchange,
+                "direction" : event.direction,
+                "strategy_id" : event.strategy_id,
+                "sent" : None,
+                "acked" : None,
+                "filled" : False,
+                "filled_at" : None
+                }
         
     def create_fill(self, msg):
         """
@@ -161,11 +268,10 @@ class IBExecutionHandler(ExecutionHandler):
         
         #Create a fill event object
         fill_event = FillEvent(
-                datetime.datetime.utcnow, symbol,
-                exchange, filled, direction, fill_cost
+                datetime.datetime.utcnow(), symbol,
+                exchange, filled, direction, fill_cost,
+                strategy_id=fd["strategy_id"]
             )
-        #make sure that multiple messages don't create addtl files
-        self.fill_dict[msg.orderId]["filled"] = True
         
         #place the event onto the event queue
         self.events.put(fill_event)
@@ -179,39 +285,130 @@ class IBExecutionHandler(ExecutionHandler):
         then prepare the Contract and Order objects with their respective parameters. Once both
         are created the IbPy method placeOrder of the connection object is called with an associated
         order_id.
-        It is extremely important to call the time.sleep(1) method to ensure the order actually
-        goes through to IB. Removal of this line leads to inconsistent behaviour of the API, at least on
-        my system!
-        Finally, we increment the order ID to ensure we don't duplicate orders:
+        The order used to be followed by a time.sleep(1) to make sure it went through to IB,
+        blocking the event loop for a second per order. Instead the order is given the next
+        order id, recorded in fill_dict and queued for the sender thread, which paces the
+        placeOrder calls with the rate limiter. With batch_orders the order waits for the rest
+        of its bar's orders and goes out in their basket, otherwise it is sent on its own and
+        execute_order returns its id:
         """
         if event.type == 'ORDER':
-            #prepare the parameters for the asset order
-            asset = event.symbol
-            asset_type = "STK"
-            order_type = event.order_type
-            quantity = event.quantity
-            direction = event.direction
-
-            #create te IB contract via the passed order event
-            ib_contract = self.create_contract(
-                    asset, asset_type, self.order_routing,
-                    self.order_routing, self.currency)          
+            if self.batch_orders:
+                self.pending.append(event)
+                return None
+            basket_id = self.execute_basket([event])
+            return self.baskets[basket_id]["order_ids"][0]
             
-            #create the IB order via the passed order event
-            ib_order = self.create_order(
-                    order_type, quantity, direction
-            )
+    def process_pending_orders(self):
+        """
+        Sends the orders collected since the Backtest last called
+        this as one basket.
+        """
+        if self.pending:
+            orders, self.pending = self.pending, []
+            self.execute_basket(orders)
+            
+    def _prepare_order(self, event):
+        """
+        Returns the (order_id, Contract, Order) of an OrderEvent, with
+        its fill_dict entry made.
+        """
+        #the contract is cached per symbol
+        ib_contract = self.get_contract(event.symbol)
+        
+        #create the IB order via the passed order event
+        ib_order = self.create_order(
+                event.order_type, event.quantity, event.direction
+        )
+        
+        #allocate a new order id for this session and record the
+        #order before it can be acknowledged
+        order_id = self.allocate_order_id()
+        self.create_fill_dict_entry(order_id, event, ib_contract)
+        return order_id, ib_contract, ib_order
+        
+    def execute_basket(self, orders):
+        """
+        Submits a list of OrderEvents, e.g. all the orders of one bar,
+        as a basket: the sender thread places them back to back without
+        waiting for acknowledgements. Returns the basket id, for
+        basket_latency.
+        """
+        submitted = time.monotonic()
+        items = [self._prepare_order(event) for event in orders]
+        basket_id = next(self.basket_ids)
+        with self.fill_lock:
+            self.baskets[basket_id] = {
+                "order_ids" : [item[0] for item in items],
+                "submitted" : submitted,
+                "sent" : None
+                }
+        self.outbound.put((basket_id, items))
+        return basket_id
+        
+    def basket_latency(self, basket_id):
+        """
+        Returns the seconds from submitting a basket until its last
+        order was sent, acknowledged and filled, each None until then.
+        """
+        with self.fill_lock:
+            basket = self.baskets[basket_id]
+            entries = [self.fill_dict[i] for i in basket["order_ids"]]
+            start = basket["submitted"]
             
-            #use the connection to the send order to IB
-            self.tws_conn.placeOrder(
-                    self.order_id, ib_contract, ib_order)
+            def last(key):
+                times = [fd[key] for fd in entries]
+                if not times or any(t is None for t in times):
+                    return None
+                return max(times) - start
             
-            #note this following line is crucial.
-            #it ensures the order goes through
-            time.sleep(1)
+            return {
+                "orders" : len(entries),
+                "sent" : None if basket["sent"] is None else basket["sent"] - start,
+                "acked" : last("acked"),
+                "filled" : last("filled_at")
+                }
             
-            #increment the order id for this session
-            self.order_id += 1
+    def _send_orders(self):
+        """
+        The sender thread: sends the queued baskets to TWS in order,
+        no faster than the rate limiter allows.
+        """
+        while True:
+            item = self.outbound.get()
+            try:
+                if item is None:
+                    return
+                basket_id, items = item
+                for order_id, ib_contract, ib_order in items:
+                    self.rate_limiter.acquire()
+                    with self.fill_lock:
+                        self.fill_dict[order_id]["sent"] = time.monotonic()
+                    try:
+                        self.tws_conn.placeOrder(order_id, ib_contract, ib_order)
+                    except Exception as e:
+                        #keep sending the rest of the orders
+                        print("Order {} not sent: {}".format(order_id, e))
+                with self.fill_lock:
+                    self.baskets[basket_id]["sent"] = time.monotonic()
+            finally:
+                self.outbound.task_done()
+                
+    def flush(self):
+        """
+        Blocks until every queued order has been sent.
+        """
+        self.outbound.join()
+        
+    def close(self):
+        """
+        Sends the queued orders, stops the sender thread and
+        disconnects from TWS.
+        """
+        self.process_pending_orders()
+        self.outbound.put(None)
+        self.sender.join()
+        self.tws_conn.disconnect()
             
 
         
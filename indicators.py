@@ -0,0 +1,729 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+#indicators.py
+from __future__ import print_function
+"""
+Streaming technical indicators.
+
+Each indicator holds only the state it needs to be brought up to date
+with a single new value, so the cost of an update does not depend on the
+length of the lookback window. Strategies push the latest bar value in on
+every MarketEvent and read the current indicator value back out, instead
+of pulling the whole window from the DataHandler and reducing it again.
+
+The IndicatorCache memoises indicators per (symbol, field, kind, params)
+on a DataHandler, so that several strategies in one backtest that ask for
+the same indicator share a single instance which is updated once per bar.
+"""
+
+from collections import deque
+import sys
+
+import numpy as np
+
+
+class RollingWindow(object):
+    """
+    A fixed length ring buffer of floats backed by a preallocated numpy
+    array, with a running sum and sum of squares of its contents.
+
+    Until the buffer has been filled the statistics are taken over
+    however many values have been pushed, which mirrors taking
+    np.mean(bars[-N:]) of a list that is shorter than N.
+    """
+    def __init__(self, window):
+        """
+        Initialises the ring buffer.
+
+        Parameters:
+        window - The maximum number of values held.
+        """
+        if window < 1:
+            raise ValueError("window must be a positive integer")
+        self.window = int(window)
+        self.values = np.zeros(self.window)
+        self.count = 0
+        self.index = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self._evictions = 0
+
+    def push(self, value):
+        """
+        Adds a value to the window, evicting the oldest one if the
+        window is full. Returns the evicted value (or None).
+        """
+        value = float(value)
+        evicted = None
+        if self.count == self.window:
+            evicted = self.values[self.index]
+            self.total -= evicted
+            self.total_sq -= evicted * evicted
+            self._evictions += 1
+        else:
+            self.count += 1
+        self.values[self.index] = value
+        self.total += value
+        self.total_sq += value * value
+        self.index = (self.index + 1) % self.window
+
+        #subtracting evicted values lets the running sums drift, so they are
+        #recomputed once per full turn of evictions (amortised O(1)). Until
+        #then windows fed the same values hold bit-identical sums.
+        if self._evictions >= self.window:
+            self.total = float(self.values.sum())
+            self.total_sq = float(np.dot(self.values, self.values))
+            self._evictions = 0
+        return evicted
+
+    def latest(self, n=1):
+        """
+        Returns the last n values pushed in oldest-to-newest order,
+        or fewer if less are available.
+        """
+        n = min(n, self.count)
+        idx = (self.index - n + np.arange(n)) % self.window
+        return self.values[idx]
+
+    def mean(self):
+        if self.count == 0:
+            return np.nan
+        return self.total / self.count
+
+    def var(self, ddof=0):
+        """
+        Variance of the window contents, with the same ddof convention
+        as np.var.
+        """
+        if self.count - ddof <= 0:
+            return np.nan
+        mean = self.total / self.count
+        ss = self.total_sq - self.count * mean * mean
+        return max(ss, 0.0) / (self.count - ddof)
+
+    def assign(self, values):
+        """
+        Replaces the contents of a full window in place, values being
+        in the slot order of self.values, and recomputes the sums.
+        """
+        self.values[:] = values
+        self.total = float(self.values.sum())
+        self.total_sq = float(np.dot(self.values, self.values))
+        self._evictions = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def full(self):
+        return self.count == self.window
+
+
+class SimpleMovingAverage(object):
+    """
+    Simple moving average over the last `window` values, updated
+    in constant time via a RollingWindow running sum.
+    """
+    def __init__(self, window):
+        self.window = window
+        self.buffer = RollingWindow(window)
+
+    def update(self, value):
+        """
+        Pushes a new value and returns the updated average.
+        """
+        self.buffer.push(value)
+        return self.value
+
+    @property
+    def value(self):
+        return self.buffer.mean()
+
+    @property
+    def ready(self):
+        return self.buffer.full
+
+
+class ExponentialMovingAverage(object):
+    """
+    Exponential moving average with smoothing factor 2/(span+1),
+    seeded with the first value received. This matches
+    pandas.Series.ewm(span=span, adjust=False).mean().
+    """
+    def __init__(self, span):
+        if span < 1:
+            raise ValueError("span must be a positive integer")
+        self.span = span
+        self.alpha = 2.0 / (span + 1.0)
+        self.count = 0
+        self.value = np.nan
+
+    def update(self, value):
+        value = float(value)
+        if self.count == 0:
+            self.value = value
+        else:
+            self.value += self.alpha * (value - self.value)
+        self.count += 1
+        return self.value
+
+    @property
+    def ready(self):
+        return self.count >= self.span
+
+
+class RollingStd(object):
+    """
+    Rolling standard deviation over the last `window` values from a
+    running sum of squares. ddof follows the np.std convention, so the
+    default of 0 matches numpy arrays and 1 matches pandas.
+    """
+    def __init__(self, window, ddof=0):
+        self.window = window
+        self.ddof = ddof
+        self.buffer = RollingWindow(window)
+
+    def update(self, value):
+        self.buffer.push(value)
+        return self.value
+
+    @property
+    def value(self):
+        return np.sqrt(self.buffer.var(self.ddof))
+
+    @property
+    def ready(self):
+        return self.buffer.full
+
+
+class RollingZScore(object):
+    """
+    Z-score of the latest value against the mean and standard
+    deviation of the last `window` values (including itself), i.e.
+    ((x - x.mean())/x.std())[-1] over the window.
+    """
+    def __init__(self, window, ddof=0):
+        self.window = window
+        self.ddof = ddof
+        self.buffer = RollingWindow(window)
+        self.last = np.nan
+
+    def update(self, value):
+        self.last = float(value)
+        self.buffer.push(value)
+        return self.value
+
+    @property
+    def value(self):
+        std = np.sqrt(self.buffer.var(self.ddof))
+        if not std > 0.0:
+            return np.nan
+        return (self.last - self.buffer.mean()) / std
+
+    @property
+    def ready(self):
+        return self.buffer.full
+
+
+class BollingerBands(object):
+    """
+    Moving average with upper and lower bands num_std rolling
+    standard deviations either side. value is a (middle, upper, lower)
+    tuple.
+    """
+    def __init__(self, window, num_std=2.0, ddof=0):
+        self.window = window
+        self.num_std = num_std
+        self.ddof = ddof
+        self.buffer = RollingWindow(window)
+
+    def update(self, value):
+        self.buffer.push(value)
+        return self.value
+
+    @property
+    def value(self):
+        mid = self.buffer.mean()
+        width = self.num_std * np.sqrt(self.buffer.var(self.ddof))
+        return (mid, mid + width, mid - width)
+
+    @property
+    def ready(self):
+        return self.buffer.full
+
+
+class RelativeStrengthIndex(object):
+    """
+    Wilder's RSI. The average gain and loss are seeded with the simple
+    mean of the first `period` price changes and then smoothed with
+    avg = (avg*(period-1) + x)/period.
+    """
+    def __init__(self, period=14):
+        if period < 1:
+            raise ValueError("period must be a positive integer")
+        self.period = period
+        self.prev = None
+        self.count = 0
+        self.avg_gain = 0.0
+        self.avg_loss = 0.0
+        self.value = np.nan
+
+    def update(self, value):
+        value = float(value)
+        if self.prev is None:
+            self.prev = value
+            return self.value
+        change = value - self.prev
+        self.prev = value
+        gain = max(change, 0.0)
+        loss = max(-change, 0.0)
+        self.count += 1
+        if self.count <= self.period:
+            self.avg_gain += gain / self.period
+            self.avg_loss += loss / self.period
+            if self.count < self.period:
+                return self.value
+        else:
+            self.avg_gain = (self.avg_gain*(self.period-1) + gain) / self.period
+            self.avg_loss = (self.avg_loss*(self.period-1) + loss) / self.period
+
+        if self.avg_loss == 0.0:
+            self.value = 100.0 if self.avg_gain > 0.0 else 50.0
+        else:
+            rs = self.avg_gain / self.avg_loss
+            self.value = 100.0 - 100.0 / (1.0 + rs)
+        return self.value
+
+    @property
+    def ready(self):
+        return self.count >= self.period
+
+
+class AverageTrueRange(object):
+    """
+    Wilder's average true range over (high, low, close) bars, seeded with
+    the simple mean of the first `period` true ranges. The true range of
+    the very first bar is simply high - low.
+    """
+    def __init__(self, period=14):
+        if period < 1:
+            raise ValueError("period must be a positive integer")
+        self.period = period
+        self.prev_close = None
+        self.count = 0
+        self.seed = 0.0
+        self.value = np.nan
+
+    def update(self, high, low, close):
+        high, low, close = float(high), float(low), float(close)
+        if self.prev_close is None:
+            tr = high - low
+        else:
+            tr = max(high - low, abs(high - self.prev_close),
+                     abs(low - self.prev_close))
+        self.prev_close = close
+        self.count += 1
+        if self.count < self.period:
+            self.seed += tr
+        elif self.count == self.period:
+            self.value = (self.seed + tr) / self.period
+        else:
+            self.value = (self.value*(self.period-1) + tr) / self.period
+        return self.value
+
+    @property
+    def ready(self):
+        return self.count >= self.period
+
+
+class RollingExtremum(object):
+    """
+    Rolling min or max over the last `window` values using a monotonic
+    deque of (index, value) pairs, giving amortised O(1) updates.
+    """
+    def __init__(self, window, mode):
+        if window < 1:
+            raise ValueError("window must be a positive integer")
+        if mode not in ('min', 'max'):
+            raise ValueError("mode must be 'min' or 'max'")
+        self.window = window
+        self.mode = mode
+        self.deque = deque()
+        self.count = 0
+
+    def update(self, value):
+        value = float(value)
+        dq = self.deque
+        if self.mode == 'max':
+            while dq and dq[-1][1] <= value:
+                dq.pop()
+        else:
+            while dq and dq[-1][1] >= value:
+                dq.pop()
+        dq.append((self.count, value))
+        self.count += 1
+        #drop the head once it has slid out of the window
+        if dq[0][0] <= self.count - 1 - self.window:
+            dq.popleft()
+        return self.value
+
+    @property
+    def value(self):
+        if not self.deque:
+            return np.nan
+        return self.deque[0][1]
+
+    @property
+    def ready(self):
+        return self.count >= self.window
+
+
+class RollingMin(RollingExtremum):
+    def __init__(self, window):
+        RollingExtremum.__init__(self, window, 'min')
+
+
+class RollingMax(RollingExtremum):
+    def __init__(self, window):
+        RollingExtremum.__init__(self, window, 'max')
+
+
+class RollingOLS(object):
+    """
+    Rolling least squares regression of y on x over the last `window`
+    (y, x) pairs, kept as running sufficient statistics (sums of x, y,
+    x*y, x^2 and y^2) so that each bar is an O(1) update rather than a
+    refit of the whole window.
+
+    With add_constant=False (the default) the fit is through the origin,
+    matching sm.OLS(y, x).fit().params[0]; with add_constant=True it
+    matches sm.OLS(y, sm.add_constant(x)).fit(). The spread y - beta*x and
+    its z-score are derived from the same sums, using the current beta
+    over the whole window as a batch refit would.
+
+    The sums are kept of x - x0 and y - y0 rather than of the raw prices,
+    as the variance of a tight spread is a small difference of large
+    sums of squares. The reference (x0, y0) starts at the first bar and
+    is moved to the window means once per turn of the window, when the
+    sums are recomputed anyway, so it follows the prices.
+    """
+    def __init__(self, window, add_constant=False):
+        self.window = window
+        self.add_constant = add_constant
+        self.x = RollingWindow(window)
+        self.y = RollingWindow(window)
+        self.xy = RollingWindow(window)
+        self.x0 = None
+        self.y0 = None
+        self._since_rebase = 0
+        self.last_x = np.nan
+        self.last_y = np.nan
+
+    def update(self, y, x):
+        """
+        Pushes a new (y, x) observation into the window.
+        """
+        y = float(y)
+        x = float(x)
+        self.last_y = y
+        self.last_x = x
+        if self.x0 is None:
+            self.x0, self.y0 = x, y
+        dx = x - self.x0
+        dy = y - self.y0
+        self.y.push(dy)
+        self.x.push(dx)
+        self.xy.push(dx * dy)
+        if self.x.full:
+            self._since_rebase += 1
+            if self._since_rebase >= self.window:
+                self._rebase()
+
+    def _rebase(self):
+        """
+        Moves the reference to the means of the (full) window.
+        """
+        n = self.x.count
+        mx = self.x.total / n
+        my = self.y.total / n
+        dx = self.x.values - mx
+        dy = self.y.values - my
+        self.x.assign(dx)
+        self.y.assign(dy)
+        self.xy.assign(dx * dy)
+        self.x0 += mx
+        self.y0 += my
+        self._since_rebase = 0
+
+    @property
+    def count(self):
+        return self.x.count
+
+    @property
+    def ready(self):
+        return self.x.full
+
+    def params(self):
+        """
+        Returns (intercept, beta) for the current window. The intercept
+        is 0.0 when the regression has no constant.
+        """
+        n = self.x.count
+        if n == 0:
+            return (np.nan, np.nan) if self.add_constant else (0.0, np.nan)
+        sx, sy = self.x.total, self.y.total
+        sxx, sxy = self.x.total_sq, self.xy.total
+        x0, y0 = self.x0, self.y0
+        if self.add_constant:
+            #the slope is unchanged by shifting x and y
+            denom = n * sxx - sx * sx
+            if denom == 0.0:
+                return np.nan, np.nan
+            beta = (n * sxy - sx * sy) / denom
+            return y0 + sy / n - beta * (x0 + sx / n), beta
+        #through the origin the sums of the raw prices are needed
+        sxx_raw = sxx + 2.0 * x0 * sx + n * x0 * x0
+        if sxx_raw == 0.0:
+            return 0.0, np.nan
+        sxy_raw = sxy + x0 * sy + y0 * sx + n * x0 * y0
+        return 0.0, sxy_raw / sxx_raw
+
+    @property
+    def hedge_ratio(self):
+        return self.params()[1]
+
+    def spread_moments(self, beta=None):
+        """
+        Returns the mean and (ddof=0) standard deviation of the spread
+        y - beta*x over the window, for the fitted beta by default.
+        """
+        if beta is None:
+            beta = self.hedge_ratio
+        mean, std = self._shifted_spread_moments(beta)
+        return mean + self.y0 - beta * self.x0, std
+
+    def _shifted_spread_moments(self, beta):
+        """
+        Returns the mean and standard deviation of the spread of the
+        shifted prices, (y - y0) - beta*(x - x0).
+        """
+        n = self.x.count
+        if n == 0:
+            return np.nan, np.nan
+        sx, sy = self.x.total, self.y.total
+        sxx, syy, sxy = self.x.total_sq, self.y.total_sq, self.xy.total
+        mean = (sy - beta * sx) / n
+        ss = syy - 2.0 * beta * sxy + beta * beta * sxx
+        var = max(ss / n - mean * mean, 0.0)
+        return mean, np.sqrt(var)
+
+    def zscore(self, beta=None):
+        """
+        Returns the z-score of the latest spread against the window,
+        i.e. ((spread - spread.mean())/spread.std())[-1].
+        """
+        if beta is None:
+            beta = self.hedge_ratio
+        mean, std = self._shifted_spread_moments(beta)
+        if not std > 0.0:
+            return np.nan
+        spread = (self.last_y - self.y0) - beta * (self.last_x - self.x0)
+        return (spread - mean) / std
+
+
+class KalmanHedgeRatio(object):
+    """
+    Online Kalman filter estimate of the hedge ratio and intercept of
+    y = beta*x + alpha, treating (beta, alpha) as a random walk.
+
+    The state of `size` independent filters (one per pair) is held in
+    preallocated arrays and advanced together with a fixed number of
+    array operations per bar, so the cost per pair is constant and there
+    is no window to refit. With size=None a single filter is run and the
+    properties return floats.
+
+    delta sets the state process noise, Vw = delta/(1-delta) * I, and ve
+    the observation noise variance. zscore() is the latest one-step
+    forecast error standardised by its predicted standard deviation,
+    e/sqrt(Q), which plays the role of the OLS spread z-score.
+    """
+    def __init__(self, size=None, delta=1e-4, ve=1e-3, warmup=0):
+        self.size = size
+        n = 1 if size is None else int(size)
+        self.delta = delta
+        self.vw = delta / (1.0 - delta)
+        self.ve = ve
+        self.warmup = warmup
+        self.count = 0
+
+        #filter state: theta = [beta, alpha] and its covariance P
+        self.theta = np.zeros((n, 2))
+        self.P = np.zeros((n, 2, 2))
+
+        #preallocated work arrays
+        self._F = np.ones((n, 2))
+        self._RF = np.zeros((n, 2))
+        self._K = np.zeros((n, 2))
+        self._KRF = np.zeros((n, 2, 2))
+        self._yhat = np.zeros(n)
+        self.Q = np.zeros(n)
+        self.e = np.zeros(n)
+
+    def update(self, y, x):
+        """
+        Advances every filter by one observation. y and x are scalars,
+        or arrays of length size.
+        """
+        F = self._F
+        F[:, 0] = x
+
+        #predict: the state is a random walk so only P grows
+        self.P[:, 0, 0] += self.vw
+        self.P[:, 1, 1] += self.vw
+
+        #forecast y and its variance Q = F R F' + Ve
+        np.einsum('nij,nj->ni', self.P, F, out=self._RF)
+        np.einsum('ni,ni->n', F, self._RF, out=self.Q)
+        self.Q += self.ve
+        np.einsum('ni,ni->n', F, self.theta, out=self._yhat)
+        np.subtract(y, self._yhat, out=self.e)
+
+        #correct: K = R F'/Q, theta += K e, P = R - K F R
+        np.divide(self._RF, self.Q[:, None], out=self._K)
+        self.theta += self._K * self.e[:, None]
+        np.multiply(self._K[:, :, None], self._RF[:, None, :], out=self._KRF)
+        self.P -= self._KRF
+        self.count += 1
+
+    def _out(self, arr):
+        if self.size is None:
+            return float(arr[0])
+        return arr
+
+    @property
+    def ready(self):
+        return self.count > 0 and self.count >= self.warmup
+
+    @property
+    def hedge_ratio(self):
+        return self._out(self.theta[:, 0])
+
+    @property
+    def intercept(self):
+        return self._out(self.theta[:, 1])
+
+    def zscore(self):
+        """
+        Returns the latest forecast error over its standard deviation.
+        """
+        return self._out(self.e / np.sqrt(self.Q))
+
+
+#indicator classes available to the IndicatorCache by name
+INDICATORS = {
+    'sma': SimpleMovingAverage,
+    'ema': ExponentialMovingAverage,
+    'std': RollingStd,
+    'zscore': RollingZScore,
+    'bollinger': BollingerBands,
+    'rsi': RelativeStrengthIndex,
+    'atr': AverageTrueRange,
+    'min': RollingMin,
+    'max': RollingMax,
+}
+
+
+class IndicatorCache(object):
+    """
+    Memoises streaming indicators per (symbol, field, kind, params) for
+    one DataHandler. Every registered indicator is brought up to date at
+    most once per bar, no matter how many strategies call update() on
+    the same MarketEvent.
+    """
+    def __init__(self, bars):
+        """
+        Parameters:
+        bars - The DataHandler object the indicators read from.
+        """
+        self.bars = bars
+        self.indicators = {}
+        self.symbol_keys = {}
+        self.last_bar_date = {}
+
+    def get(self, symbol, field, kind, **params):
+        """
+        Returns the indicator for the given key, creating it if this
+        is the first request. field is a bar field name such as
+        "adj_close", or a tuple of field names for indicators with
+        several inputs (e.g. ("high", "low", "close") for 'atr').
+        """
+        key = (symbol, field, kind, tuple(sorted(params.items())))
+        ind = self.indicators.get(key)
+        if ind is None:
+            try:
+                ind_cls = INDICATORS[kind]
+            except KeyError:
+                raise ValueError("Unknown indicator kind: {}".format(kind))
+            ind = ind_cls(**params)
+            self._warm_up(symbol, field, ind)
+            self.indicators[key] = ind
+            self.symbol_keys.setdefault(symbol, []).append(key)
+        return ind
+
+    def value(self, symbol, field, kind, **params):
+        """
+        Returns the current value of the given indicator.
+        """
+        ind = self.get(symbol, field, kind, **params)
+        self.update()
+        return ind.value
+
+    def _warm_up(self, symbol, field, ind):
+        """
+        Brings a newly created indicator in step with the existing ones
+        by feeding it every bar the data handler has released so far.
+        Costs O(history) once, and nothing if no bars have arrived yet.
+        """
+        self.update()
+        #every bar released so far, or as many as a streaming handler's
+        #ring buffers still hold
+        history = self.bars.get_latest_bars(symbol, N=sys.maxsize)
+        for b in history:
+            self._push(ind, field, b[1])
+        if len(history) > 0:
+            self.last_bar_date[symbol] = history[-1][0]
+
+    def _push(self, ind, field, bar):
+        if isinstance(field, tuple):
+            ind.update(*[getattr(bar, f) for f in field])
+        else:
+            ind.update(getattr(bar, field))
+
+    def update(self, event=None):
+        """
+        Pushes the latest bar of each symbol into its indicators, if it
+        has not already been pushed. Safe to call from every strategy
+        on every MarketEvent.
+        """
+        for symbol, keys in self.symbol_keys.items():
+            bars_list = self.bars.get_latest_bars(symbol, N=1)
+            if len(bars_list) == 0:
+                continue
+            bar_date, bar = bars_list[-1]
+            if self.last_bar_date.get(symbol) == bar_date:
+                continue
+            self.last_bar_date[symbol] = bar_date
+            for key in keys:
+                self._push(self.indicators[key], key[1], bar)
+
+
+def get_indicator_cache(bars):
+    """
+    Returns the IndicatorCache attached to a DataHandler, creating it on
+    first use, so every strategy built on the same data feed shares it.
+    """
+    cache = getattr(bars, 'indicator_cache', None)
+    if cache is None:
+        cache = IndicatorCache(bars)
+        bars.indicator_cache = cache
+    return cache
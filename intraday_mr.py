@@ -11,9 +11,9 @@ Created on Sat Jun  1 16:14:13 2019
 import datetime
 import numpy as np
 import pandas as pd
-import statsmodels.api as sm
 from event_driven_trading.strategy import Strategy
 from event_driven_trading.event import SignalEvent
+from event_driven_trading.indicators import KalmanHedgeRatio, RollingOLS
 from event_driven_trading.backtest import Backtest
 from event_driven_trading.hft_data import HistoricCSVDataHandlerHFT
 from event_driven_trading.hft_portfolio import PortfolioHFT
@@ -29,13 +29,24 @@ class IntradayOLSMRStrategy(Strategy):
     (defaulting to [0.5, 3.0]) then a long/short signal pair are generated
     (for the high threshold) or an exit signal pair are generated (for the
     low threshold).
+    
+    The hedge ratio can alternatively be estimated with an online Kalman
+    filter (hedge_estimator='kalman'), in which case the z-score is the
+    filter's standardised forecast error and ols_window only sets how many
+    bars the filter runs before trading.
     """
     
     def __init__(
             self, bars, events, ols_window=100,
-            zscore_low = 0.5, zscore_high=3.0):
+            zscore_low = 0.5, zscore_high=3.0,
+            hedge_estimator='ols', delta=1e-4, ve=1e-3):
         """
         Initialises the stat arb strategy.
+        
+        Parameters:
+        hedge_estimator - 'ols' for a rolling OLS over ols_window bars,
+            or 'kalman' for an online Kalman filter.
+        delta, ve - Kalman filter process and observation noise.
         """
         self.bars = bars
         self.symbol_list = self.bars.symbol_list
@@ -43,6 +54,9 @@ class IntradayOLSMRStrategy(Strategy):
         self.ols_window = ols_window
         self.zscore_low = zscore_low
         self.zscore_high = zscore_high
+        self.hedge_estimator = hedge_estimator
+        self.delta = delta
+        self.ve = ve
         
         self.pair = ('AREX', 'WLL')
         self.datetime = datetime.datetime.utcnow()
@@ -50,6 +64,23 @@ class IntradayOLSMRStrategy(Strategy):
         self.long_market = False
         self.short_market = False
         
+        #hedge ratio model of pair[0] on pair[1], updated once per bar
+        self.hedge_model = self._create_hedge_model()
+        self.last_bar_date = None
+        self.hedge_ratio = np.nan
+        
+    def _create_hedge_model(self):
+        """
+        Creates the streaming hedge ratio estimator.
+        """
+        if self.hedge_estimator == 'ols':
+            return RollingOLS(self.ols_window)
+        if self.hedge_estimator == 'kalman':
+            return KalmanHedgeRatio(
+                    delta=self.delta, ve=self.ve, warmup=self.ols_window)
+        raise ValueError(
+                "Unknown hedge_estimator: {}".format(self.hedge_estimator))
+        
     def calculate_xy_signals(self, zscore_last):
         """
         Calculates the actual x,y signal pairings to be sent to the
@@ -94,33 +125,52 @@ class IntradayOLSMRStrategy(Strategy):
     def calculate_signals_for_pairs(self):
         """
         Generates a new set of signals based on the MR strategy
-        calculates the hedge ratio between the paid of tickers.
-        we use ols for this, ideally we'd use CADF
+        calculates the hedge ratio between the pair of tickers.
+        we use ols for this, ideally we'd use CADF.
+        
+        Rather than refitting over the last ols_window bars each time, the
+        latest close of each ticker is pushed into a RollingOLS which keeps
+        the window's sums and gives the same hedge ratio and spread z-score
+        as sm.OLS(y, x) and the batch spread statistics, in O(1) per bar.
+        A KalmanHedgeRatio can be used in its place.
         """
-        #obtain the latest window of values for each
-        #component of the pair of tickers
-        y = self.bars.get_latest_bars_values(
-                self.paid[0], "close", N=self.ols_window
-        )
-        x = self.bars.get_latest_bars_values(
-                self.pair[1], "close", N=self.ols_window
-        )
+        if not self.update_pair_window():
+            return
         
-        if y is not None and x is not None:
-            #check that all window periods are available
-            if len(y) >= self.ols_window and len(x) >= self.ols_window:
-                #calculate the current hedge ratio using OLS
-                self.hedge_ratio = sm.OLS(y, x).fit().params[0]
-                
-                #calculate the current z-score of the residuals
-                spread = y - self.hedge_ratio * x
-                zscore_last = ((spread - spread.mean())/spread.std())[-1]
-                
-                #calculate signals and add to events queue
-                y_signal, x_signal = self.calculate_xy_signals(zscore_last)
-                if y_signal is not None and x_signal is not None:
-                    self.events.put(y_signal)
-                    self.events.put(x_signal)
+        #check that all window periods are available
+        if self.hedge_model.ready:
+            #calculate the current hedge ratio
+            self.hedge_ratio = self.hedge_model.hedge_ratio
+            
+            #calculate the current z-score of the residuals
+            zscore_last = self.hedge_model.zscore()
+            
+            #calculate signals and add to events queue
+            y_signal, x_signal = self.calculate_xy_signals(zscore_last)
+            if y_signal is not None and x_signal is not None:
+                self.events.put(y_signal)
+                self.events.put(x_signal)
+    
+    def update_pair_window(self):
+        """
+        Pushes the latest close of each component of the pair into the
+        hedge ratio model. Returns False if there are no bars yet or the
+        latest bar has already been seen (the data handler keeps emitting
+        MarketEvents once a symbol's data is exhausted).
+        """
+        p0, p1 = self.pair
+        if len(self.bars.get_latest_bars(p0, N=1)) == 0 \
+        or len(self.bars.get_latest_bars(p1, N=1)) == 0:
+            return False
+        bar_date = self.bars.get_latest_bar_datetime(p0)
+        if bar_date == self.last_bar_date:
+            return False
+        self.last_bar_date = bar_date
+        self.hedge_model.update(
+                self.bars.get_latest_bar_value(p0, "close"),
+                self.bars.get_latest_bar_value(p1, "close")
+        )
+        return True
                         
     def calculate_signals(self, event):
         """
@@ -129,6 +179,183 @@ class IntradayOLSMRStrategy(Strategy):
         if event.type == 'MARKET':
             self.calculate_signals_for_pairs()
             
+            
+class IntradayOLSMRMultiPairStrategy(Strategy):
+    """
+    Runs the IntradayOLSMRStrategy rules over a list of pairs at once.
+    The latest ols_window closes of every symbol are held in one stacked
+    (symbols x window) ring buffer, and the hedge ratios, spreads and
+    z-scores of all pairs are computed in a single vectorised pass per bar
+    (batched least squares through einsum), as is the long/short/exit
+    state of each pair. Only pairs whose thresholds are crossed produce
+    Python-level work, in the form of their signal pair.
+    
+    With hedge_estimator='kalman' a batched KalmanHedgeRatio is used in
+    place of the windowed fit.
+    """
+    
+    def __init__(
+            self, bars, events, pairs=None, ols_window=100,
+            zscore_low=0.5, zscore_high=3.0,
+            hedge_estimator='ols', delta=1e-4, ve=1e-3):
+        """
+        Initialises the multi-pair stat arb strategy.
+        
+        Parameters:
+        pairs - A list of (y, x) symbol tuples, defaulting to
+            [('AREX', 'WLL')].
+        The remaining parameters are as for IntradayOLSMRStrategy.
+        """
+        self.bars = bars
+        self.symbol_list = self.bars.symbol_list
+        self.events = events
+        self.ols_window = ols_window
+        self.zscore_low = zscore_low
+        self.zscore_high = zscore_high
+        self.hedge_estimator = hedge_estimator
+        
+        self.pairs = list(pairs) if pairs is not None else [('AREX', 'WLL')]
+        self.datetime = datetime.datetime.utcnow()
+        
+        #each symbol is stored once however many pairs it is in,
+        #and the pairs index into the stacked rows
+        self.pair_symbols = sorted(set(s for p in self.pairs for s in p))
+        row = dict( (s, i) for i, s in enumerate(self.pair_symbols) )
+        self.y_idx = np.array([row[p[0]] for p in self.pairs], dtype=int)
+        self.x_idx = np.array([row[p[1]] for p in self.pairs], dtype=int)
+        
+        self.closes = np.zeros((len(self.pair_symbols), self.ols_window))
+        self.latest_close = np.zeros(len(self.pair_symbols))
+        self.bar_count = 0
+        self.last_bar_date = None
+        
+        n = len(self.pairs)
+        self.long_market = np.zeros(n, dtype=bool)
+        self.short_market = np.zeros(n, dtype=bool)
+        self.hedge_ratio = np.full(n, np.nan)
+        
+        if hedge_estimator == 'kalman':
+            self.kalman = KalmanHedgeRatio(
+                    size=n, delta=delta, ve=ve, warmup=self.ols_window)
+        elif hedge_estimator == 'ols':
+            self.kalman = None
+        else:
+            raise ValueError(
+                    "Unknown hedge_estimator: {}".format(hedge_estimator))
+            
+    def update_pair_windows(self):
+        """
+        Pushes the latest close of every pair symbol into the stacked
+        window. Returns False until every leg of every pair has a bar,
+        since the pairs share the window columns, or if the latest bar
+        has already been seen.
+        """
+        for s in self.pair_symbols:
+            if len(self.bars.get_latest_bars(s, N=1)) == 0:
+                return False
+        s0 = self.pair_symbols[0]
+        bar_date = self.bars.get_latest_bar_datetime(s0)
+        if bar_date == self.last_bar_date:
+            return False
+        self.last_bar_date = bar_date
+        for i, s in enumerate(self.pair_symbols):
+            self.latest_close[i] = self.bars.get_latest_bar_value(s, "close")
+        self.closes[:, self.bar_count % self.ols_window] = self.latest_close
+        self.bar_count += 1
+        if self.kalman is not None:
+            self.kalman.update(
+                    self.latest_close[self.y_idx],
+                    self.latest_close[self.x_idx])
+        return True
+    
+    def calculate_zscores(self):
+        """
+        Returns the hedge ratio and latest spread z-score of every pair.
+        The OLS is through the origin, as sm.OLS(y, x) in the single pair
+        strategy, and the column order of the ring buffer does not matter
+        to the fit or the spread moments.
+        """
+        if self.kalman is not None:
+            return self.kalman.hedge_ratio, self.kalman.zscore()
+        
+        y = self.closes[self.y_idx]
+        x = self.closes[self.x_idx]
+        beta = np.einsum('pw,pw->p', x, y) / np.einsum('pw,pw->p', x, x)
+        spread = y - beta[:, None] * x
+        spread_last = self.latest_close[self.y_idx] - \
+            beta * self.latest_close[self.x_idx]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            zscore = (spread_last - spread.mean(axis=1)) / spread.std(axis=1)
+        return beta, zscore
+    
+    def calculate_xy_signals(self, zscore):
+        """
+        Vectorised form of IntradayOLSMRStrategy.calculate_xy_signals,
+        applying the same rules in the same order to every pair. Returns
+        a code per pair: 0 for no signal, 1 to enter long, 2 to exit a
+        long, 3 to enter short and 4 to exit a short. As in the single
+        pair version a later rule overrides the signals of an earlier one.
+        """
+        with np.errstate(invalid='ignore'):
+            low = np.abs(zscore) <= self.zscore_low
+            enter_long = (zscore <= -self.zscore_high) & ~self.long_market
+            self.long_market |= enter_long
+            exit_long = low & self.long_market
+            self.long_market &= ~exit_long
+            enter_short = (zscore >= self.zscore_high) & ~self.short_market
+            self.short_market |= enter_short
+            exit_short = low & self.short_market
+            self.short_market &= ~exit_short
+        
+        codes = np.zeros(len(self.pairs), dtype=int)
+        codes[enter_long] = 1
+        codes[exit_long] = 2
+        codes[enter_short] = 3
+        codes[exit_short] = 4
+        return codes
+    
+    def calculate_signals_for_pairs(self):
+        """
+        Updates the windows, recomputes every pair's z-score and puts
+        the signal pairs for the pairs that crossed a threshold onto
+        the events queue.
+        """
+        if not self.update_pair_windows():
+            return
+        ready = self.kalman.ready if self.kalman is not None \
+            else self.bar_count >= self.ols_window
+        if not ready:
+            return
+        
+        self.hedge_ratio, zscore = self.calculate_zscores()
+        codes = self.calculate_xy_signals(zscore)
+        dt = self.datetime
+        for i in np.flatnonzero(codes):
+            p0, p1 = self.pairs[i]
+            hr = abs(self.hedge_ratio[i])
+            code = codes[i]
+            if code == 1:
+                y_signal = SignalEvent(1, p0, dt, 'LONG', 1.0)
+                x_signal = SignalEvent(1, p1, dt, 'SHORT', hr)
+            elif code == 2:
+                y_signal = SignalEvent(1, p0, dt, 'EXIT', 1.0)
+                x_signal = SignalEvent(1, p1, dt, 'EXIT', hr)
+            elif code == 3:
+                y_signal = SignalEvent(1, p0, dt, 'SHORT', 1.0)
+                x_signal = SignalEvent(1, p1, dt, 'LONG', hr)
+            else:
+                y_signal = SignalEvent(1, p0, dt, 'EXIT', 1.0)
+                x_signal = SignalEvent(1, p1, dt, 'EXIT', 1.0)
+            self.events.put(y_signal)
+            self.events.put(x_signal)
+    
+    def calculate_signals(self, event):
+        """
+        Calculate the SignalEvents based on market data
+        """
+        if event.type == 'MARKET':
+            self.calculate_signals_for_pairs()
+            
 if __name__ == "__main__":
     csv_dir = ''
     symbol_list = ["AREX","WLL"]
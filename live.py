@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+#live.py
+from __future__ import print_function
+"""
+An asyncio event loop for running the Backtest components live.
+
+Backtest._run_backtest polls the data handler and then sleeps for the
+heartbeat, so a bar arriving just after an update waits out the whole
+sleep before the strategies see it. LiveTrader instead runs three
+coroutines on one event loop:
+
+    market data - awaits the data handler's stream() and handles the
+        events of each round of bars as soon as it is complete.
+    execution replies - woken whenever an event is put from another
+        thread (e.g. an IBExecutionHandler fill) or a delayed event falls
+        due, and handles it at once.
+    heartbeat - marks the portfolio to market every heartbeat seconds,
+        apart from the bar handling. With a heartbeat of 0 the portfolio
+        is marked once per round of bars, as in a backtest.
+
+The strategies, portfolio and execution handlers are unchanged and still
+called synchronously from the loop; the clock follows the wall clock.
+
+With StreamingDataHandler reading one of the local feeds of
+live_data.py, the tick-to-order latency of a strategy can be measured
+offline:
+
+    feed = SimulatedSocketFeed(symbol_list, bars=1000, interval=0.001)
+    feed.start()
+    trader = LiveTrader(
+            None, symbol_list, 100000.0, 1.0, start_date,
+            functools.partial(StreamingDataHandler, port=feed.port),
+            SimulatedExecutionHandler, Portfolio, MovingAverageCrossStrategy)
+    trader.simulate_trading()
+    print(trader.latency_stats())
+"""
+
+import asyncio
+import threading
+import time
+
+import numpy as np
+
+from event_driven_trading.backtest import Backtest
+from event_driven_trading.event import MarketEvent
+from event_driven_trading.live_data import SimulatedSocketFeed, StreamingDataHandler
+
+
+class LiveTrader(Backtest):
+    """
+    Runs the Backtest components on an asyncio event loop, handling bars
+    and fills as they arrive. Takes the arguments of Backtest, with a
+    data handler providing an async stream() of bars, such as
+    StreamingDataHandler.
+    """
+    def __init__(self, *args, **kwargs):
+        super(LiveTrader, self).__init__(*args, **kwargs)
+        #seconds from the feed sending a bar to the order it triggered
+        #reaching the execution handler
+        self.tick_to_order = []
+        self.heartbeats = 0
+        self.loop = None
+        self.wakeup = None
+        self.wakeup_timer = None
+        self.loop_thread = None
+        self.unmarked = False
+
+    def _run_backtest(self):
+        asyncio.run(self._run_live())
+
+    async def _run_live(self):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.loop_thread = threading.get_ident()
+        self.events.listener = self._notify
+        tasks = [asyncio.ensure_future(self._execution_replies())]
+        if self.heartbeat > 0:
+            tasks.append(asyncio.ensure_future(self._heartbeat()))
+        try:
+            async for _ in self.data_handler.stream():
+                self._handle_live_events()
+        finally:
+            for task in tasks:
+                task.cancel()
+            if self.wakeup_timer is not None:
+                self.wakeup_timer.cancel()
+                self.wakeup_timer = None
+            self.events.listener = None
+        #the feed has closed: settle the outstanding events
+        self._dispatch_until(None)
+        self._mark_to_market()
+        if self.event_logger is not None:
+            self.event_logger.close()
+
+    async def _execution_replies(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            self._handle_live_events()
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            self.heartbeats += 1
+            self._mark_to_market()
+
+    def _notify(self):
+        #events put on the loop's own thread are handled by the caller
+        if threading.get_ident() != self.loop_thread:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def _handle_live_events(self):
+        """
+        Handles the events due by the wall clock, and reschedules the
+        single wakeup timer for the next delayed event, if any.
+        """
+        self.clock.advance_to(time.time_ns())
+        self._handle_events()
+        if self.wakeup_timer is not None:
+            self.wakeup_timer.cancel()
+            self.wakeup_timer = None
+        next_ns = self.events.next_time()
+        if next_ns is not None:
+            delay = max(next_ns - self.clock.now_ns, 0) / 1e9
+            self.wakeup_timer = self.loop.call_later(delay, self.wakeup.set)
+
+    def _dispatch(self, event):
+        super(LiveTrader, self)._dispatch(event)
+        if event.type == 'ORDER':
+            sent = getattr(self.data_handler, 'last_sent', None)
+            if sent is not None:
+                self.tick_to_order.append(time.time() - sent)
+        elif event.type == 'FILL':
+            self.unmarked = True
+
+    def _on_market(self, event):
+        for strategy in self.strategies:
+            strategy.calculate_signals(event)
+        self.execution_handler.update_timeindex(event)
+        self.unmarked = True
+        #otherwise marking to market is left to the heartbeat
+        if self.heartbeat <= 0:
+            self._mark_to_market()
+
+    def _mark_to_market(self):
+        """
+        Records a portfolio snapshot, once every symbol has a bar, if a
+        bar or fill has arrived since the last one.
+        """
+        if not self.unmarked:
+            return
+        for s in self.symbol_list:
+            if len(self.data_handler.get_latest_bars(s, 1)) == 0:
+                return
+        self.portfolio.update_timeindex(MarketEvent())
+        self.unmarked = False
+
+    def latency_stats(self):
+        """
+        Returns the count, mean and percentiles of the tick-to-order
+        latencies in milliseconds.
+        """
+        lat = np.asarray(self.tick_to_order) * 1e3
+        if len(lat) == 0:
+            return {'orders': 0}
+        return {
+                'orders': len(lat), 'mean_ms': lat.mean(),
+                'p50_ms': np.percentile(lat, 50), 'p99_ms': np.percentile(lat, 99),
+                'max_ms': lat.max()}
+
+    def _output_performance(self):
+        print("Tick-to-order latency: {}".format(self.latency_stats()))
+        super(LiveTrader, self)._output_performance()
@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+#live_data.py
+from __future__ import print_function
+"""
+Streaming market data for the live event loop.
+
+StreamingDataHandler consumes bars (or trades) from a socket or a pipe
+and buffers the latest capacity bars of each symbol in preallocated ring
+buffers, behind the usual DataHandler getters. Its async stream() pushes
+one MarketEvent per timestamp round and yields, for LiveTrader in live.py.
+A round is released once every symbol has sent its bar for the
+timestamp, or, for symbols without a bar at every timestamp, when a
+later bar arrives, so the strategies never see a round in which only some
+of the symbols have moved on.
+
+Messages are newline terminated comma separated text, either a bar
+
+    symbol,datetime_ns,open,high,low,close,adj_close,volume,sent
+
+or a trade, stored as a bar with every price at the trade price
+
+    symbol,datetime_ns,price,size,sent
+
+with sent the epoch seconds the feed sent it, used to measure latency.
+
+Two local feeds serve this format, to a socket client or a pipe:
+
+    CSVReplayServer - replays the bars of the symbol CSV files, in time
+        order, as fast as possible, at a fixed interval or at a multiple
+        of the real time between bars.
+    SimulatedSocketFeed - random walk bars at a fixed interval.
+
+    server = CSVReplayServer(csv_dir, ['AAPL', 'SPY'], interval=0.001)
+    server.start()
+    data_handler = functools.partial(StreamingDataHandler, port=server.port)
+
+Run as a script, the CSVs are replayed to stdout, to be piped into a
+handler built with pipe=proc.stdout:
+
+    python live_data.py csv_dir AAPL,SPY [interval]
+"""
+
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from event_driven_trading.data import DataHandler, asof_index, range_bounds
+from event_driven_trading.event import MarketEvent
+from event_driven_trading.resample import FIELDS, Bar, BarRingBuffer, get_timeframe_cache
+
+
+class RingBufferDataHandler(DataHandler):
+    """
+    The DataHandler getters over a dict of BarRingBuffers, self.buffers,
+    keyed by symbol, for handlers that keep only the latest bars.
+    """
+    def get_latest_bar(self, symbol):
+        return self.get_latest_bars(symbol, 1)[-1]
+
+    def get_latest_bars(self, symbol, N=1):
+        """
+        Returns the last N bars as (datetime, Bar) tuples, or N-k if
+        less available.
+        """
+        times, values = self.buffers[symbol].latest_rows(N)
+        return [
+                (pd.Timestamp(t), Bar(*row))
+                for t, row in zip(times, values.tolist()) ]
+
+    def get_latest_bar_datetime(self, symbol):
+        return pd.Timestamp(self.buffers[symbol].latest_times(1)[-1])
+
+    def get_latest_bar_value(self, symbol, val_type):
+        return self.buffers[symbol].latest(val_type, 1)[-1]
+
+    def get_latest_bars_values(self, symbol, val_type, N=1, timeframe=None):
+        if timeframe is not None:
+            return get_timeframe_cache(self).values(symbol, val_type, N, timeframe)
+        return self.buffers[symbol].latest(val_type, N).copy()
+
+    def get_latest_bars_matrix(self, val_type, N=1):
+        """
+        Returns the last N values of val_type for every symbol, or as
+        many as the symbol with the most bars has. The symbols' bars need
+        not share datetimes, and those with fewer are padded with NaN.
+        """
+        n = min(N, max([0] + [len(self.buffers[s]) for s in self.symbol_list]))
+        matrix = np.full((n, len(self.symbol_list)), np.nan)
+        for j, s in enumerate(self.symbol_list):
+            col = self.buffers[s].latest(val_type, n)
+            matrix[n - len(col):, j] = col
+        return matrix
+
+    def get_bar_times(self, symbol):
+        """
+        Returns a view of the datetimes of the bars held, which a feed
+        sends in time order.
+        """
+        buf = self.buffers[symbol]
+        return buf.latest_times(len(buf))
+
+    def get_bar_asof(self, symbol, dt):
+        buf = self.buffers[symbol]
+        times, values = buf.latest_rows(len(buf))
+        i = asof_index(times, dt)
+        if i < 0:
+            return None
+        return (pd.Timestamp(times[i]), Bar(*values[i].tolist()))
+
+    def get_bars_values_between(self, symbol, val_type, start=None, end=None):
+        buf = self.buffers[symbol]
+        lo, hi = range_bounds(buf.latest_times(len(buf)), start, end)
+        return buf.latest(val_type, len(buf))[lo:hi].copy()
+
+
+class StreamingDataHandler(RingBufferDataHandler):
+    """
+    Receives bars from a socket or pipe feed, keeping the latest capacity
+    of each symbol, and puts a MarketEvent per timestamp round once every
+    symbol has a bar. Messages of symbols outside symbol_list are ignored.
+    """
+    def __init__(self, events, csv_dir, symbol_list, host='127.0.0.1',
+                 port=None, pipe=None, capacity=10000):
+        """
+        Parameters:
+        events - The event queue.
+        csv_dir - Unused, for the DataHandler constructor signature.
+        symbol_list - The list of symbol strings.
+        host, port - The address of a socket feed.
+        pipe - A readable pipe (file object) to read instead of a socket.
+        capacity - The number of bars of each symbol held.
+        """
+        self.events = events
+        self.symbol_list = symbol_list
+        self.host = host
+        self.port = port
+        self.pipe = pipe
+
+        self.buffers = dict(
+                (s, BarRingBuffer(capacity)) for s in symbol_list )
+        self.continue_backtest = True
+        self.messages = 0
+        #wall clock time the latest bar was sent by the feed
+        self.last_sent = None
+        #the timestamp and symbols of the round in progress, and a bar of
+        #the next round held back while the last one is released
+        self.round_ns = None
+        self.round_symbols = set()
+        self.held = None
+
+    async def _connect(self):
+        """
+        Returns a StreamReader of the feed and the transport to close.
+        """
+        if self.pipe is None:
+            return await asyncio.open_connection(self.host, self.port)
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(
+                lambda: asyncio.StreamReaderProtocol(reader), self.pipe)
+        return reader, transport
+
+    async def stream(self):
+        """
+        Connects to the feed and yields after each bar is pushed, until
+        the feed closes.
+        """
+        reader, transport = await self._connect()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    #the feed has closed: release the last round
+                    if self.round_symbols and self._release_round():
+                        yield
+                    break
+                if self.on_message(line):
+                    yield
+                if self.held is not None:
+                    bar, self.held = self.held, None
+                    if self._push(*bar):
+                        yield
+        finally:
+            transport.close()
+            self.continue_backtest = False
+
+    def on_message(self, line):
+        """
+        Pushes the bar of a feed message, returning True if a MarketEvent
+        was put for a completed round. A bar of a later timestamp than an
+        incomplete round is held in self.held, for stream() to push once
+        the round has been handled.
+        """
+        parts = line.split(b',')
+        symbol = parts[0].decode('ascii')
+        if symbol not in self.buffers:
+            return False
+        if len(parts) == 9:
+            values = [float(x) for x in parts[2:8]]
+        elif len(parts) == 5:
+            price = float(parts[2])
+            values = [price, price, price, price, price, float(parts[3])]
+        else:
+            raise ValueError("Malformed feed message {!r}".format(line))
+        self.messages += 1
+        self.last_sent = float(parts[-1])
+        t_ns = int(parts[1])
+        if self.round_symbols and t_ns > self.round_ns:
+            self.held = (symbol, t_ns, values)
+            return self._release_round()
+        return self._push(symbol, t_ns, values)
+
+    def _push(self, symbol, t_ns, values):
+        """
+        Adds a bar to the round in progress, releasing the round once
+        every symbol has reported.
+        """
+        self.buffers[symbol].push(t_ns, values)
+        self.round_ns = t_ns
+        self.round_symbols.add(symbol)
+        if len(self.round_symbols) == len(self.symbol_list):
+            return self._release_round()
+        return False
+
+    def _release_round(self):
+        """
+        Ends the round in progress, putting a MarketEvent if every symbol
+        has a bar by now.
+        """
+        self.round_symbols = set()
+        for buf in self.buffers.values():
+            if len(buf) == 0:
+                return False
+        self.events.put(MarketEvent())
+        return True
+
+    def update_bars(self):
+        raise NotImplementedError(
+                "A live feed pushes bars as they arrive, through stream()")
+
+
+class FeedServer(object):
+    """
+    Serves the rounds of bars of a subclass's rounds() over a local TCP
+    socket once started, every client being sent all of them, or to a
+    pipe through replay().
+    """
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self.sock = None
+        self.running = False
+
+    def rounds(self):
+        """
+        Yields (offset, rows) per timestamp, offset being the seconds
+        after the start to send the round at (None for at once), and rows
+        the messages without their sent time, each ending in a comma.
+        """
+        raise NotImplementedError("Should implement rounds()")
+
+    def replay(self, write):
+        """
+        Sends every round through write(bytes), paced by their offsets.
+        """
+        t0 = time.time()
+        for offset, rows in self.rounds():
+            if offset is not None:
+                delay = t0 + offset - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            sent = repr(time.time()) + "\n"
+            write("".join([r + sent for r in rows]).encode('ascii'))
+
+    def start(self):
+        """
+        Starts listening, on a free port if port is 0.
+        """
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(1)
+        self.host, self.port = self.sock.getsockname()
+        self.running = True
+        t = threading.Thread(target=self._serve)
+        t.daemon = True
+        t.start()
+
+    def stop(self):
+        self.running = False
+        self.sock.close()
+
+    def _serve(self):
+        while self.running:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            t = threading.Thread(target=self._send_rounds, args=(conn,))
+            t.daemon = True
+            t.start()
+
+    def _send_rounds(self, conn):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            self.replay(conn.sendall)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+
+def _format_rows(symbols, t_ns, values):
+    return [
+            "{},{},{},".format(s, t_ns, ",".join(map(repr, row)))
+            for s, row in zip(symbols, values.tolist()) ]
+
+
+class CSVReplayServer(FeedServer):
+    """
+    Replays the bars of symbol CSV files, as read by
+    HistoricCSVDataHandler, merged into time order. Each symbol's own bars
+    are sent, without padding onto the other symbols' dates.
+    """
+    def __init__(self, csv_dir, symbol_list, speed=None, interval=None,
+                 start_date=None, host='127.0.0.1', port=0):
+        """
+        Parameters:
+        csv_dir - The directory of the 'symbol.csv' files.
+        symbol_list - The symbols to replay.
+        speed - Replay at this multiple of the real time between bars.
+        interval - Or, seconds between timestamps. With neither, the bars
+            are sent as fast as the client reads them.
+        start_date - Skips the bars before this datetime.
+        host, port - The address to listen on, port 0 picking a free one.
+        """
+        super(CSVReplayServer, self).__init__(host, port)
+        self.speed = speed
+        self.interval = interval
+
+        frames = []
+        for s in symbol_list:
+            df = pd.read_csv(
+                    os.path.join(csv_dir, '{}.csv'.format(s)),
+                    header=0, index_col=0, parse_dates=True,
+                    names=['datetime'] + list(FIELDS)).sort_index(axis=0)
+            if start_date is not None:
+                df = df[df.index >= start_date]
+            df['symbol'] = s
+            frames.append(df)
+        bars = pd.concat(frames).sort_index(axis=0, kind='mergesort')
+        self.times = np.asarray(bars.index, dtype='datetime64[ns]').astype(np.int64)
+        self.symbols = bars['symbol'].values
+        self.values = bars[list(FIELDS)].values.astype(float)
+
+    def rounds(self):
+        bounds = np.concatenate([
+                [0], np.flatnonzero(np.diff(self.times)) + 1, [len(self.times)]])
+        for i in range(len(bounds) - 1):
+            lo, hi = bounds[i], bounds[i+1]
+            t_ns = self.times[lo]
+            if self.speed:
+                offset = (t_ns - self.times[0]) / 1e9 / self.speed
+            elif self.interval:
+                offset = i * self.interval
+            else:
+                offset = None
+            yield offset, _format_rows(self.symbols[lo:hi], t_ns, self.values[lo:hi])
+
+
+class SimulatedSocketFeed(FeedServer):
+    """
+    Serves random walk bars of each symbol, one round of bars for every
+    symbol each interval seconds.
+    """
+    def __init__(self, symbol_list, bars=1000, interval=0.001,
+                 start_date=None, freq='1min', price=100.0,
+                 volatility=0.001, seed=None, host='127.0.0.1', port=0):
+        """
+        Parameters:
+        symbol_list - The symbols to send bars of.
+        bars - The number of bars of each symbol to send.
+        interval - Seconds between rounds of bars.
+        start_date, freq - The datetimes of the bars.
+        price - The starting price of every symbol.
+        volatility - The standard deviation of the log return per bar.
+        seed - Seeds the random walk.
+        host, port - The address to listen on, port 0 picking a free one.
+        """
+        super(SimulatedSocketFeed, self).__init__(host, port)
+        self.symbol_list = symbol_list
+        self.interval = interval
+        self.datetimes = pd.date_range(
+                start_date or pd.Timestamp('2020-01-01 09:30'), periods=bars, freq=freq)
+
+        rng = np.random.RandomState(seed)
+        shape = (bars, len(symbol_list))
+        close = price * np.exp(np.cumsum(rng.normal(0.0, volatility, shape), axis=0))
+        open_ = np.vstack([np.full((1, len(symbol_list)), price), close[:-1]])
+        wick = np.abs(rng.normal(0.0, volatility, (2,) + shape))
+        high = np.maximum(open_, close) * (1.0 + wick[0])
+        low = np.minimum(open_, close) * (1.0 - wick[1])
+        volume = rng.randint(100, 10000, shape).astype(float)
+        #(bars x symbols x FIELDS)
+        self.bars = np.stack([open_, high, low, close, close, volume], axis=2)
+
+    def rounds(self):
+        for i, dt in enumerate(self.datetimes):
+            offset = i * self.interval if self.interval > 0 else None
+            yield offset, _format_rows(self.symbol_list, dt.value, self.bars[i])
+
+
+if __name__ == "__main__":
+    csv_dir = sys.argv[1] if len(sys.argv) > 1 else ''
+    symbol_list = sys.argv[2].split(',') if len(sys.argv) > 2 else ['AAPL']
+    interval = float(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    out = sys.stdout.buffer
+    def write(data):
+        out.write(data)
+        out.flush()
+
+    CSVReplayServer(csv_dir, symbol_list, interval=interval).replay(write)
@@ -16,6 +16,7 @@ import statsmodels.api as sm
 import sys
 from event_driven_trading.strategy import Strategy
 from event_driven_trading.event import SignalEvent
+from event_driven_trading.indicators import get_indicator_cache
 from event_driven_trading.backtest import Backtest
 from event_driven_trading.data import HistoricCSVDataHandler
 from event_driven_trading.execution import SimulatedExecutionHandler
@@ -40,6 +41,12 @@ class MovingAverageCrossStrategy(Strategy):
         
         #set to True if a symbol is in the market
         self.bought = self._calculate_initial_bought()
+        
+        #running moving averages, shared with any other strategy on the
+        #same data handler and updated once per new bar per symbol
+        self.indicators = get_indicator_cache(self.bars)
+        self.short_sma, self.long_sma = self._create_moving_averages()
+        
     def _calculate_initial_bought(self):
         """
         Adds keys to the bought dictionary for all symbols and sets them to out
@@ -48,11 +55,28 @@ class MovingAverageCrossStrategy(Strategy):
         for s in self.symbol_list:
             bought[s] = 'OUT'
         return bought
+    
+    def _create_moving_averages(self):
+        """
+        Fetches a short and long simple moving average of adj_close for
+        every symbol from the indicator cache. The short window can never
+        look further back than the long one, as both used to be taken
+        from the same window of long_window bars.
+        """
+        short_window = min(self.short_window, self.long_window)
+        short_sma = {}
+        long_sma = {}
+        for s in self.symbol_list:
+            short_sma[s] = self.indicators.get(
+                    s, "adj_close", 'sma', window=short_window)
+            long_sma[s] = self.indicators.get(
+                    s, "adj_close", 'sma', window=self.long_window)
+        return short_sma, long_sma
+    
     """
     The core of the strategy is the calculate_signals method. It reacts to a MarketEvent
-    object and for each symbol traded obtains the latest N bar closing prices, where N is equal to
-    the largest lookback period.
-    It then calculates both the short and long period simple moving averages. The rule of the
+    object and for each symbol traded pushes the latest bar closing price into running short and
+    long period simple moving averages, so each bar costs O(1) regardless of the lookback period. The rule of the
     strategy is to enter the market (go long a stock) when the short moving average value exceeds
     the long moving average value.
     
@@ -62,13 +86,12 @@ class MovingAverageCrossStrategy(Strategy):
     """
     def calculate_signals(self, event):
         if event.type == 'MARKET':
+            self.indicators.update(event)
             for s in self.symbol_list:
-                bars = self.bars.get_latest_bars_values(
-                        s, "adj_close", N=self.long_window)
-                bar_date = self.bars.get_latest_bar_datetime(s)
-                if bars is not None and bars != []:
-                    short_sma = np.mean(bars[-self.short_window:])
-                    long_sma = np.mean(bars[-self.long_window:])
+                if len(self.bars.get_latest_bars(s, N=1)) > 0:
+                    bar_date = self.bars.get_latest_bar_datetime(s)
+                    short_sma = self.short_sma[s].value
+                    long_sma = self.long_sma[s].value
                     
                     symbol = s
                     dt = datetime.datetime.utcnow()
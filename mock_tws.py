@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+#mock_tws.py
+from __future__ import print_function
+"""
+A local mock of Trader Workstation for testing live execution offline.
+
+MockTWSServer listens on a local TCP port and answers each order with an
+openOrder acknowledgement and then an orderStatus "Filled" message, after
+configurable delays, recording the order ids in the order received and
+the peak message rate. MockTWSConnection is a client with the parts of
+the ibpy connection interface that IBExecutionHandler uses (connect,
+register, registerAll, placeOrder, disconnect). Replies are dispatched to
+the registered handlers from a reader thread, as ibpy does. Messages are
+newline delimited JSON rather than the TWS wire protocol.
+
+FakeTWSConnection needs no server at all: it records every placeOrder
+call and, optionally, acknowledges and fills each order on the spot.
+
+    server = MockTWSServer(fill_delay=0.01)
+    server.start()
+    conn = MockTWSConnection(port=server.port)
+    conn.connect()
+    handler = IBExecutionHandler(events, tws_conn=conn)
+"""
+
+import collections
+import json
+import socket
+import threading
+import time
+
+
+class MockMessage(object):
+    """
+    A reply message, with the attribute names of ibpy's messages.
+    """
+    def __init__(self, typeName, **kwargs):
+        self.typeName = typeName
+        self.__dict__.update(kwargs)
+
+    def __repr__(self):
+        items = ", ".join(
+                "{}={}".format(k, v) for k, v in sorted(self.__dict__.items())
+                if k not in ('typeName', 'contract', 'order'))
+        return "<{} {}>".format(self.typeName, items)
+
+
+class MockContract(object):
+    def __init__(self, symbol, exchange):
+        self.m_symbol = symbol
+        self.m_exchange = exchange
+
+
+class MockOrder(object):
+    def __init__(self, action, quantity, order_type):
+        self.m_action = action
+        self.m_totalQuantity = quantity
+        self.m_orderType = order_type
+
+
+class MockTWSServer(object):
+    """
+    Acknowledges and fills every order it receives, in order.
+    """
+    def __init__(self, host='127.0.0.1', port=0, ack_delay=0.0,
+                 fill_delay=0.0, fill_price=100.0):
+        """
+        Parameters:
+        host, port - The address to listen on, port 0 picking a free one.
+        ack_delay - Seconds before the openOrder acknowledgement.
+        fill_delay - Seconds after the acknowledgement before the fill.
+        fill_price - The fill price, or a callable(symbol) returning one.
+        """
+        self.ack_delay = ack_delay
+        self.fill_delay = fill_delay
+        self.fill_price = fill_price
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(1)
+        self.host, self.port = self.sock.getsockname()
+
+        self.received = []
+        self.receive_times = []
+        self.running = False
+
+    def start(self):
+        self.running = True
+        t = threading.Thread(target=self._serve)
+        t.daemon = True
+        t.start()
+
+    def stop(self):
+        self.running = False
+        self.sock.close()
+
+    def max_rate(self, window=1.0):
+        """
+        The most orders received within any window seconds.
+        """
+        best, lo = 0, 0
+        for hi, t in enumerate(self.receive_times):
+            while t - self.receive_times[lo] > window:
+                lo += 1
+            best = max(best, hi - lo + 1)
+        return best
+
+    def _serve(self):
+        while self.running:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            t = threading.Thread(target=self._handle_client, args=(conn,))
+            t.daemon = True
+            t.start()
+
+    def _handle_client(self, conn):
+        replies = collections.deque()
+        ready = threading.Condition()
+        lock = threading.Lock()
+
+        def send(msg):
+            with lock:
+                conn.sendall((json.dumps(msg) + "\n").encode('utf-8'))
+
+        def reply_loop():
+            #replies go out in the order the orders came in
+            while True:
+                with ready:
+                    while not replies:
+                        ready.wait()
+                    item = replies.popleft()
+                if item is None:
+                    return
+                due, msg = item
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                try:
+                    send(msg)
+                except OSError:
+                    return
+
+        t = threading.Thread(target=reply_loop)
+        t.daemon = True
+        t.start()
+
+        f = conn.makefile('r', encoding='utf-8')
+        for line in f:
+            msg = json.loads(line)
+            if msg['type'] != 'placeOrder':
+                continue
+            now = time.monotonic()
+            self.received.append(msg['orderId'])
+            self.receive_times.append(now)
+            price = self.fill_price
+            if callable(price):
+                price = price(msg['symbol'])
+            ack = dict(msg, type='openOrder')
+            fill = {
+                    'type': 'orderStatus', 'orderId': msg['orderId'],
+                    'status': 'Filled', 'filled': msg['quantity'],
+                    'remaining': 0, 'avgFillPrice': price}
+            with ready:
+                replies.append((now + self.ack_delay, ack))
+                replies.append((now + self.ack_delay + self.fill_delay, fill))
+                ready.notify()
+        with ready:
+            replies.append(None)
+            ready.notify()
+        conn.close()
+
+
+class MockTWSConnection(object):
+    """
+    An ibpy style connection to a MockTWSServer.
+    """
+    def __init__(self, host='127.0.0.1', port=7496):
+        self.host = host
+        self.port = port
+        self.handlers = []
+        self.sock = None
+
+    def connect(self):
+        self.sock = socket.create_connection((self.host, self.port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        t = threading.Thread(target=self._read)
+        t.daemon = True
+        t.start()
+        return True
+
+    def disconnect(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def register(self, handler, *types):
+        self.handlers.append((handler, set(types)))
+
+    def registerAll(self, handler):
+        self.handlers.append((handler, None))
+
+    def placeOrder(self, order_id, contract, order):
+        msg = {
+                'type': 'placeOrder', 'orderId': order_id,
+                'symbol': contract.m_symbol, 'exchange': contract.m_exchange,
+                'action': order.m_action, 'quantity': order.m_totalQuantity,
+                'orderType': order.m_orderType}
+        self.sock.sendall((json.dumps(msg) + "\n").encode('utf-8'))
+
+    def _dispatch(self, msg):
+        for handler, types in self.handlers:
+            if types is None or msg.typeName in types:
+                handler(msg)
+
+    def _read(self):
+        f = self.sock.makefile('r', encoding='utf-8')
+        try:
+            for line in f:
+                raw = json.loads(line)
+                kind = raw.pop('type')
+                if kind == 'openOrder':
+                    msg = MockMessage(
+                            kind, orderId=raw['orderId'],
+                            contract=MockContract(raw['symbol'], raw['exchange']),
+                            order=MockOrder(
+                                    raw['action'], raw['quantity'], raw['orderType']))
+                else:
+                    msg = MockMessage(kind, **raw)
+                self._dispatch(msg)
+        except (OSError, ValueError):
+            return
+
+
+class FakeTWSConnection(object):
+    """
+    An in-process stand-in for an ibpy connection, recording the orders
+    placed as (order_id, contract, order) and, with auto_fill, replying
+    to each at once with openOrder and orderStatus "Filled" messages.
+    """
+    def __init__(self, auto_fill=True, fill_price=100.0):
+        self.auto_fill = auto_fill
+        self.fill_price = fill_price
+        self.handlers = []
+        self.placed = []
+        self.connected = False
+
+    def connect(self):
+        self.connected = True
+        return True
+
+    def disconnect(self):
+        self.connected = False
+
+    def register(self, handler, *types):
+        self.handlers.append((handler, set(types)))
+
+    def registerAll(self, handler):
+        self.handlers.append((handler, None))
+
+    def _dispatch(self, msg):
+        for handler, types in self.handlers:
+            if types is None or msg.typeName in types:
+                handler(msg)
+
+    def placeOrder(self, order_id, contract, order):
+        self.placed.append((order_id, contract, order))
+        if self.auto_fill:
+            price = self.fill_price
+            if callable(price):
+                price = price(contract.m_symbol)
+            self._dispatch(MockMessage(
+                    'openOrder', orderId=order_id, contract=contract, order=order))
+            self._dispatch(MockMessage(
+                    'orderStatus', orderId=order_id, status='Filled',
+                    filled=order.m_totalQuantity, remaining=0,
+                    avgFillPrice=price))
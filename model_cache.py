@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#model_cache.py
+from __future__ import print_function
+"""
+On-disk cache of trained models.
+
+A fitted model is pickled under a key made from a hash of its training
+data, its class and its hyperparameters, so repeated backtests and
+parallel sweep workers that would train an identical model load it
+instead. Any change to the data or the parameters gives a new key.
+"""
+
+import hashlib
+import os, os.path
+import pickle
+
+import numpy as np
+import pandas as pd
+
+
+CACHE_DIR_NAME = '.model_cache'
+
+
+def hash_training_data(X, y):
+    """
+    Returns a hex digest of the training features and labels, including
+    the index and column names of pandas objects.
+    """
+    h = hashlib.sha1()
+    for obj in (X, y):
+        if isinstance(obj, (pd.DataFrame, pd.Series)):
+            h.update(pd.util.hash_pandas_object(obj, index=True).values.tobytes())
+            if isinstance(obj, pd.DataFrame):
+                h.update(repr(list(obj.columns)).encode('utf-8'))
+        else:
+            arr = np.ascontiguousarray(obj)
+            h.update(repr((arr.dtype.str, arr.shape)).encode('utf-8'))
+            h.update(arr.tobytes())
+    return h.hexdigest()
+
+
+def model_cache_key(model, X, y):
+    """
+    Returns the cache key for fitting an (unfitted) sklearn style model
+    on (X, y).
+    """
+    params = sorted(
+            (k, repr(v)) for k, v in model.get_params(deep=True).items())
+    raw = repr((
+            type(model).__module__, type(model).__name__, params,
+            hash_training_data(X, y)
+    ))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def fit_cached(model, X, y, cache_dir):
+    """
+    Returns model fitted on (X, y), loading a previously fitted copy from
+    cache_dir if one exists, and otherwise fitting it and saving it.
+
+    Parameters:
+    model - An unfitted estimator with get_params() and fit().
+    X, y - The training features and labels.
+    cache_dir - The cache directory, or None to always fit.
+    """
+    if cache_dir is None:
+        return model.fit(X, y)
+
+    path = os.path.join(
+            cache_dir, '{}.pkl'.format(model_cache_key(model, X, y)))
+    if os.path.exists(path):
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (EOFError, pickle.UnpicklingError):
+            #a corrupt entry is simply refitted and overwritten
+            pass
+
+    model.fit(X, y)
+    os.makedirs(cache_dir, exist_ok=True)
+    #write then rename so concurrent workers never see a partial file
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return model
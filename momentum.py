@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#momentum.py
+from __future__ import print_function
+"""
+Cross-sectional momentum strategy written against the VectorizedStrategy
+interface: the whole universe is ranked with a handful of numpy
+operations per bar rather than one Python iteration per symbol.
+"""
+
+import datetime
+
+import numpy as np
+
+from event_driven_trading.strategy import VectorizedStrategy
+from event_driven_trading.backtest import Backtest
+from event_driven_trading.data import HistoricCSVDataHandler
+from event_driven_trading.execution import SimulatedExecutionHandler
+from event_driven_trading.portfolio import Portfolio
+
+
+class CrossSectionalMomentumStrategy(VectorizedStrategy):
+    """
+    Ranks every symbol by its return over the lookback window and goes
+    long the top `quantile` of the universe and short the bottom one,
+    holding the rest out of the market. Symbols whose window contains
+    missing prices are left unchanged.
+    """
+    def __init__(self, bars, events, lookback=60, quantile=0.1,
+                 allow_short=True):
+        VectorizedStrategy.__init__(
+                self, bars, events, lookback=lookback + 1,
+                fields=("adj_close",))
+        self.quantile = quantile
+        self.allow_short = allow_short
+
+    def calculate_targets(self, windows):
+        prices = windows["adj_close"]
+        returns = prices[-1] / prices[0] - 1.0
+        valid = np.isfinite(returns)
+        n = valid.sum()
+        targets = np.full(len(returns), np.nan)
+        if n == 0:
+            return targets
+
+        #rank 0 is the worst performer among the valid symbols
+        ranks = np.full(len(returns), -1)
+        order = np.argsort(returns[valid], kind='mergesort')
+        ranks[np.flatnonzero(valid)[order]] = np.arange(n)
+        k = min(max(int(n * self.quantile), 1), n // 2)
+
+        targets[valid] = 0.0
+        targets[ranks >= n - k] = 1.0
+        if self.allow_short:
+            targets[(ranks >= 0) & (ranks < k)] = -1.0
+        return targets
+
+
+if __name__ == '__main__':
+    csv_dir = ''
+    symbol_list = ['AAPL', 'SPY', 'TSLA']
+    initial_capital = 100000.0
+    heartbeat = 0.0
+    start_date = datetime.datetime(1990, 1, 1, 0, 0, 0)
+
+    backtest = Backtest(
+            csv_dir, symbol_list, initial_capital, heartbeat,
+            start_date, HistoricCSVDataHandler, SimulatedExecutionHandler,
+            Portfolio, CrossSectionalMomentumStrategy
+    )
+    backtest.simulate_trading()
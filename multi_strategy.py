@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+#multi_strategy.py
+from __future__ import print_function
+"""
+Running several strategies in one Backtest.
+
+Backtest accepts a list of strategy classes in place of a single one. All
+of them share the one DataHandler and event loop, so the data is loaded
+and stepped through once however many strategies there are. Each strategy
+puts its signals on the queue through a StrategyEventQueue which stamps
+them with the strategy's id (1, 2, ... in list order), and the
+MultiStrategyPortfolio routes every signal and fill to that strategy's
+own sub-portfolio. The orders of each sub-portfolio are sent on as they
+are, without netting against the others.
+
+The aggregated book is the sum of the sub-portfolio holdings.
+"""
+
+from event_driven_trading.performance import create_sharpe_ratio, create_drawdowns
+
+
+class StrategyEventQueue(object):
+    """
+    Stands in for the events queue of one strategy, stamping its
+    strategy_id on the SignalEvents it puts on the real queue.
+    """
+    def __init__(self, events, strategy_id):
+        self.events = events
+        self.strategy_id = strategy_id
+
+    def put(self, event, *args, **kwargs):
+        if event is not None and event.type == 'SIGNAL':
+            event.strategy_id = self.strategy_id
+        self.events.put(event, *args, **kwargs)
+
+
+class MultiStrategyPortfolio(object):
+    """
+    Keeps a sub-portfolio per strategy, routing signals and fills to them
+    by strategy_id, and aggregates their holdings into one book.
+    """
+    def __init__(self, bars, events, start_date, initial_capital=10000.0,
+                 portfolio_cls=None, strategy_ids=(1,), allocations=None):
+        """
+        Parameters:
+        bars - The DataHandler object with current market data.
+        events - The Event Queue object.
+        start_date - The start date (bar) of the portfolio.
+        initial_capital - The starting capital of the whole book.
+        portfolio_cls - (Class) The sub-portfolio class, e.g. Portfolio.
+        strategy_ids - The ids of the strategies.
+        allocations - Optional fractions of the capital given to each
+            strategy, defaulting to an equal split.
+        """
+        self.bars = bars
+        self.events = events
+        self.symbol_list = self.bars.symbol_list
+        self.start_date = start_date
+        self.initial_capital = initial_capital
+        self.strategy_ids = list(strategy_ids)
+
+        if allocations is None:
+            allocations = [1.0 / len(self.strategy_ids)] * len(self.strategy_ids)
+        self.portfolios = dict(
+                (sid, portfolio_cls(bars, events, start_date, initial_capital * w))
+                for sid, w in zip(self.strategy_ids, allocations) )
+
+    @property
+    def current_positions(self):
+        """
+        The net position in each symbol across the strategies.
+        """
+        return dict(
+                (s, sum(p.current_positions[s] for p in self.portfolios.values()))
+                for s in self.symbol_list )
+
+    def update_timeindex(self, event):
+        for sid in self.strategy_ids:
+            self.portfolios[sid].update_timeindex(event)
+
+    def update_signal(self, event):
+        if event.type == 'SIGNAL':
+            self.portfolios[event.strategy_id].update_signal(event)
+
+    def update_fill(self, event):
+        if event.type == 'FILL':
+            self.portfolios[event.strategy_id].update_fill(event)
+
+    def create_equity_curve_dataframe(self):
+        """
+        Creates the equity curve of every sub-portfolio and of the
+        aggregated book, whose holdings are their sum.
+        """
+        cols = list(self.symbol_list) + ['cash', 'commission', 'total']
+        total = None
+        for sid in self.strategy_ids:
+            p = self.portfolios[sid]
+            p.create_equity_curve_dataframe()
+            holdings = p.equity_curve[cols]
+            total = holdings if total is None else total + holdings
+        curve = total.copy()
+        curve['returns'] = curve['total'].pct_change()
+        curve['equity_curve'] = (1.0+curve['returns']).cumprod()
+        self.equity_curve = curve
+
+    def _summary_stats(self, curve, periods):
+        total_return = curve['equity_curve'].iloc[-1]
+        sharpe_ratio = create_sharpe_ratio(curve['returns'], periods=periods)
+        drawdown, max_dd, dd_duration = create_drawdowns(curve['equity_curve'])
+        curve['drawdown'] = drawdown
+        return [("Total Return", "{:.4f}".format(((total_return-1.0) *100.0))),
+                ("Sharpe Ratio", "{:.4f}".format(sharpe_ratio)),
+                ("Max Drawdown", "{:.4f}".format((max_dd * 100.0))),
+                ("Drawdown Duration", "{:.4f}".format(dd_duration)) ]
+
+    def output_summary_stats(self, periods=252*60*6.5):
+        """
+        Creates a list of summary statistics for the aggregated book.
+        """
+        return self._summary_stats(self.equity_curve, periods)
+
+    def strategy_summary_stats(self, periods=252*60*6.5):
+        """
+        Returns a dict of the summary statistics of each sub-portfolio,
+        keyed by strategy_id.
+        """
+        return dict(
+                (sid, self._summary_stats(self.portfolios[sid].equity_curve, periods))
+                for sid in self.strategy_ids )
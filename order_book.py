@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+#order_book.py
+from __future__ import print_function
+"""
+Heap-based order matching for simulated execution.
+
+Resting orders are kept per symbol in four price-time priority heaps: buy
+limits (highest price first), sell limits (lowest first), buy stops
+(lowest trigger first) and sell stops (highest trigger first), with
+arrival order breaking ties. Matching a bar pops each heap only while its
+top order is marketable against the bar's range, so a bar costs
+O(k log n) for k fills however many orders are resting. Cancelled orders
+are dropped lazily when they reach the top of a heap.
+
+Fill prices against a bar of (open, high, low, close):
+    MKT - the open of the first bar after the order arrives.
+    LMT - the limit, or the open if the bar gaps through it.
+    STP - the stop, or the open if the bar gaps through it.
+"""
+
+import heapq
+import itertools
+
+import numpy as np
+
+
+class OrderBook(object):
+    """
+    The resting orders of one symbol, as heaps of (key, order_id) entries,
+    order ids increasing with arrival time, and a FIFO list of market
+    orders.
+    """
+    def __init__(self):
+        self.market = []
+        self.buy_limits = []
+        self.sell_limits = []
+        self.buy_stops = []
+        self.sell_stops = []
+        self.open_orders = 0
+
+
+class MatchingEngine(object):
+    """
+    Matches MKT, LMT and STP OrderEvents against successive bars.
+    """
+    def __init__(self):
+        self.books = {}
+        self.orders = {}
+        self.seq = itertools.count(1)
+
+    def submit(self, order):
+        """
+        Adds an OrderEvent to its symbol's book and returns its order id.
+        LMT and STP orders take their limit or stop from order.price.
+        """
+        if order.order_type not in ('MKT', 'LMT', 'STP'):
+            raise ValueError("Unsupported order type {}".format(order.order_type))
+        if order.order_type != 'MKT' and order.price is None:
+            raise ValueError("{} order needs a price".format(order.order_type))
+
+        order_id = next(self.seq)
+        self.orders[order_id] = order
+        book = self.books.get(order.symbol)
+        if book is None:
+            book = self.books[order.symbol] = OrderBook()
+        book.open_orders += 1
+
+        buy = order.direction == 'BUY'
+        if order.order_type == 'MKT':
+            book.market.append(order_id)
+        elif order.order_type == 'LMT':
+            if buy:
+                heapq.heappush(book.buy_limits, (-order.price, order_id))
+            else:
+                heapq.heappush(book.sell_limits, (order.price, order_id))
+        else:
+            if buy:
+                heapq.heappush(book.buy_stops, (order.price, order_id))
+            else:
+                heapq.heappush(book.sell_stops, (-order.price, order_id))
+        return order_id
+
+    def cancel(self, order_id):
+        """
+        Cancels a resting order, returning False if it has already been
+        filled or cancelled.
+        """
+        order = self.orders.pop(order_id, None)
+        if order is None:
+            return False
+        self.books[order.symbol].open_orders -= 1
+        return True
+
+    def active_symbols(self):
+        """
+        The symbols with resting orders.
+        """
+        return [s for s, book in self.books.items() if book.open_orders > 0]
+
+    def _pop_marketable(self, heap, marketable):
+        """
+        Pops the orders at the top of heap while marketable(key) holds,
+        skipping cancelled ones, and returns the live (key, order_id)s.
+        """
+        popped = []
+        while heap and marketable(heap[0][0]):
+            key, order_id = heapq.heappop(heap)
+            if order_id in self.orders:
+                popped.append((key, order_id))
+        return popped
+
+    def match(self, symbol, open_, high, low, close=None):
+        """
+        Matches the resting orders of symbol against a bar and returns a
+        list of (order, fill_price) in the order the fills occur. Market
+        orders wait for a bar with a valid open.
+        """
+        book = self.books.get(symbol)
+        if book is None or book.open_orders == 0:
+            return []
+        fills = []
+        if not np.isnan(open_):
+            for order_id in book.market:
+                if order_id in self.orders:
+                    fills.append((order_id, open_))
+            book.market = []
+
+        #stops trigger first, then limits, each in price-time priority
+        for key, order_id in self._pop_marketable(
+                book.buy_stops, lambda k: k <= high):
+            fills.append((order_id, max(open_, key)))
+        for key, order_id in self._pop_marketable(
+                book.sell_stops, lambda k: -k >= low):
+            fills.append((order_id, min(open_, -key)))
+        for key, order_id in self._pop_marketable(
+                book.buy_limits, lambda k: -k >= low):
+            fills.append((order_id, min(open_, -key)))
+        for key, order_id in self._pop_marketable(
+                book.sell_limits, lambda k: k <= high):
+            fills.append((order_id, max(open_, key)))
+
+        book.open_orders -= len(fills)
+        return [(self.orders.pop(order_id), price) for order_id, price in fills]
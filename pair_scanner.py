@@ -0,0 +1,259 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#pair_scanner.py
+from __future__ import print_function
+"""
+Scans a symbol universe for cointegrated pairs to trade with the
+intraday mean-reversion strategies.
+
+The close prices of every symbol are loaded once through one of the
+existing data handlers. The N^2 candidate pairs are then cut down with a
+vectorised correlation pre-filter, and the hedge ratios of the survivors
+are computed in one batched pass. Only the cointegrated ADF (CADF) test
+is run pair by pair, spread over a process pool. The ranked result is
+written to CSV and read back with load_pairs() into the `pairs` argument
+of IntradayOLSMRMultiPairStrategy.
+"""
+
+import inspect
+import multiprocessing
+import os, os.path
+import queue
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from statsmodels.tsa.stattools import adfuller
+from statsmodels.tsa.adfvalues import mackinnonp
+
+from event_driven_trading.hft_data import HistoricCSVDataHandlerHFT
+
+
+#statsmodels 0.15 warns on every adfuller call unless the tuple result is
+#asked for explicitly; older releases have no such argument
+ADF_OPTIONS = (
+        {'result_object': False}
+        if 'result_object' in inspect.signature(adfuller).parameters else {})
+
+
+def load_price_matrix(
+        csv_dir, symbol_list, data_handler=HistoricCSVDataHandlerHFT,
+        field="close"):
+    """
+    Loads the symbol universe through a data handler and returns the
+    aligned (bars x symbols) price matrix as a DataFrame. Each symbol is
+    read on its own calendar, the symbols are outer joined and forward
+    filled, and the matrix is trimmed to the span over which every
+    symbol has data, so no price is carried past a symbol's last bar.
+
+    Parameters:
+    csv_dir - The directory holding the 'symbol.csv' files.
+    symbol_list - The universe of symbol strings.
+    data_handler - (Class) The DataHandler used to read the files.
+    field - The bar field to test, e.g. "close" or "adj_close".
+    """
+    #one handler per symbol, as a handler pads every symbol onto the
+    #calendar of its first one
+    columns = {}
+    for s in symbol_list:
+        bars = data_handler(queue.Queue(), csv_dir, [s])
+        columns[s] = bars.symbol_frames[s][field]
+    prices = pd.DataFrame(columns, columns=symbol_list)
+    start = max(prices[s].first_valid_index() for s in symbol_list)
+    end = min(prices[s].last_valid_index() for s in symbol_list)
+    return prices.ffill().loc[start:end].dropna(axis=0, how='any')
+
+
+def prefilter_pairs(prices, min_corr=0.8, max_pairs=None):
+    """
+    Returns the (i, j) column index pairs, i < j, whose bar returns have
+    an absolute correlation of at least min_corr, most correlated first.
+    The whole correlation matrix is one numpy call, so this is cheap
+    compared with the cointegration tests it saves.
+
+    Parameters:
+    prices - The (bars x symbols) numpy price array.
+    min_corr - The minimum absolute returns correlation kept.
+    max_pairs - Optionally, keep at most this many candidates.
+    """
+    returns = np.diff(prices, axis=0) / prices[:-1]
+    corr = np.corrcoef(returns, rowvar=False)
+    i, j = np.triu_indices(corr.shape[0], k=1)
+    c = np.abs(corr[i, j])
+    keep = np.flatnonzero(c >= min_corr)
+    keep = keep[np.argsort(-c[keep], kind='mergesort')]
+    if max_pairs is not None:
+        keep = keep[:max_pairs]
+    return i[keep], j[keep], corr[i[keep], j[keep]]
+
+
+def hedge_ratios(prices, y_idx, x_idx):
+    """
+    Batched least squares hedge ratio of each y column on its x column,
+    through the origin as sm.OLS(y, x) in IntradayOLSMRStrategy.
+    """
+    y = prices[:, y_idx]
+    x = prices[:, x_idx]
+    return np.einsum('tp,tp->p', x, y) / np.einsum('tp,tp->p', x, x)
+
+
+#the price matrix is handed to each worker once, not with every task
+_worker_prices = None
+
+
+def _init_worker(prices):
+    global _worker_prices
+    _worker_prices = prices
+
+
+def cadf_test(y, x, beta, maxlag=1):
+    """
+    Runs the ADF test on the spread y - beta*x and returns the test
+    statistic, its p-value and the spread's mean reversion half-life
+    in bars. The p-value uses the MacKinnon distribution for a residual
+    based cointegration test with two variables, which is stricter than
+    the plain ADF one.
+    """
+    spread = y - beta * x
+    stat = adfuller(
+            spread, maxlag=maxlag, regression='c', autolag=None,
+            **ADF_OPTIONS)[0]
+    pvalue = mackinnonp(stat, regression='c', N=2)
+
+    #half-life from the AR(1) coefficient of the spread
+    lag = spread[:-1] - spread[:-1].mean()
+    delta = np.diff(spread)
+    denom = np.dot(lag, lag)
+    gamma = np.dot(lag, delta) / denom if denom > 0.0 else 0.0
+    half_life = -np.log(2.0) / gamma if gamma < 0.0 else np.inf
+    return stat, pvalue, half_life
+
+
+def _cadf_chunk(tasks):
+    """
+    Worker entry point. tasks is a list of (y column, x column,
+    hedge ratio, maxlag) tuples.
+    """
+    prices = _worker_prices
+    results = []
+    for y_col, x_col, beta, maxlag in tasks:
+        results.append(
+                cadf_test(prices[:, y_col], prices[:, x_col], beta, maxlag))
+    return results
+
+
+def scan_pairs(
+        prices, min_corr=0.8, max_pairs=None, maxlag=1,
+        processes=None, chunksize=256):
+    """
+    Scans every pair of columns of the price DataFrame and returns a
+    DataFrame of candidates ranked by CADF statistic (most negative,
+    i.e. most strongly mean reverting, first).
+
+    Both orderings of each candidate pair are tested, since the CADF
+    result depends on which leg is the dependent variable, and the
+    better ordering is kept.
+
+    Parameters:
+    prices - The (bars x symbols) price DataFrame.
+    min_corr - The correlation pre-filter threshold.
+    max_pairs - Optionally cap the number of candidates tested.
+    maxlag - The number of lagged differences in the ADF regression.
+    processes - The size of the process pool (default: all cores).
+    chunksize - The number of tests handed to a worker at once.
+    """
+    symbols = list(prices.columns)
+    values = np.ascontiguousarray(prices.values, dtype=float)
+
+    if values.shape[0] < 3 or values.shape[1] < 2:
+        raise ValueError(
+                "Need at least two symbols with three overlapping bars")
+    i, j, corr = prefilter_pairs(values, min_corr, max_pairs)
+    y_idx = np.concatenate([i, j])
+    x_idx = np.concatenate([j, i])
+    betas = hedge_ratios(values, y_idx, x_idx)
+
+    tasks = list(zip(y_idx.tolist(), x_idx.tolist(), betas.tolist(),
+                     [maxlag] * len(y_idx)))
+    chunks = [tasks[k:k + chunksize] for k in range(0, len(tasks), chunksize)]
+
+    if processes == 1 or len(chunks) <= 1:
+        _init_worker(values)
+        results = [_cadf_chunk(c) for c in chunks]
+    else:
+        pool = multiprocessing.Pool(
+                processes, initializer=_init_worker, initargs=(values,))
+        try:
+            results = pool.map(_cadf_chunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+    results = [r for chunk in results for r in chunk]
+
+    n = len(i)
+    if n == 0:
+        return pd.DataFrame(columns=[
+                'y', 'x', 'hedge_ratio', 'cadf_stat', 'pvalue',
+                'half_life', 'corr'])
+    stats = np.array(results).reshape(2, n, 3)
+    #keep the ordering of each pair with the more negative statistic
+    flip = stats[1, :, 0] < stats[0, :, 0]
+    best = np.where(flip[:, None], stats[1], stats[0])
+    sym = np.array(symbols)
+    ranked = pd.DataFrame({
+            'y': np.where(flip, sym[j], sym[i]),
+            'x': np.where(flip, sym[i], sym[j]),
+            'hedge_ratio': np.where(flip, betas[n:], betas[:n]),
+            'cadf_stat': best[:, 0],
+            'pvalue': best[:, 1],
+            'half_life': best[:, 2],
+            'corr': corr,
+    })
+    return ranked.sort_values('cadf_stat', kind='mergesort').reset_index(drop=True)
+
+
+def write_pairs(ranked, path):
+    """
+    Writes the ranked pair list to CSV.
+    """
+    ranked.to_csv(path, index=False)
+
+
+def load_pairs(path, top=None, max_pvalue=None):
+    """
+    Reads a ranked pair list written by write_pairs and returns it as
+    a list of (y, x) tuples, best first, ready to pass as the pairs of
+    IntradayOLSMRMultiPairStrategy.
+
+    Parameters:
+    path - The CSV file.
+    top - Optionally, only return the best `top` pairs.
+    max_pvalue - Optionally, drop pairs with a larger CADF p-value.
+    """
+    ranked = pd.read_csv(path)
+    if max_pvalue is not None:
+        ranked = ranked[ranked['pvalue'] <= max_pvalue]
+    if top is not None:
+        ranked = ranked.head(top)
+    return list(zip(ranked['y'], ranked['x']))
+
+
+if __name__ == "__main__":
+    csv_dir = sys.argv[1] if len(sys.argv) > 1 else ''
+    out_path = sys.argv[2] if len(sys.argv) > 2 else 'pairs.csv'
+    symbol_list = sorted(
+            f[:-4] for f in os.listdir(csv_dir or '.')
+            if f.endswith('.csv') and f not in ('equity.csv', out_path)
+    )
+
+    start = time.time()
+    prices = load_price_matrix(csv_dir, symbol_list)
+    print("Loaded {} symbols x {} bars in {:.1f}s".format(
+            prices.shape[1], prices.shape[0], time.time() - start))
+
+    ranked = scan_pairs(prices)
+    write_pairs(ranked, out_path)
+    print("Tested {} pairs in {:.1f}s".format(
+            len(ranked), time.time() - start))
+    print(ranked.head(20))
@@ -33,20 +33,25 @@ def create_drawdowns(pnl):
     drawdown, duration - Highest peak-to-trough drawdown and duration.
     """
     
-    #calculate the cumulative returns curve
-    #and set up the high water mark
-    hwm=[0]
-    
-    #create the drawdown and duration series
-    idx = pnl.index #index labels
-    drawdown = pd.Series(index=idx)
-    duration = pd.Series(index=idx)
-    
-    #Loop over the index range
-    for t in range(1, len(idx)):
-        hwm.append(max(hwm[t-1], pnl[t]))
-        drawdown[t] = (hwm[t]-pnl[t])
-        duration[t] = (0 if drawdown[t] == 0 else duration[t-1]+1)
+    #the high water mark starts at zero and skips missing values
+    values = np.asarray(pnl, dtype=np.float64)
+    n = len(values)
+    hwm = np.zeros(n)
+    if n > 1:
+        hwm[1:] = np.fmax.accumulate(np.fmax(values[1:], 0.0))
+    
+    #create the drawdown and duration series, undefined on the first bar
+    dd = hwm - values
+    dd[:1] = np.nan
+    
+    #the duration counts the bars since the drawdown was last zero, and is
+    #undefined until it first is
+    t = np.arange(n)
+    last_zero = np.maximum.accumulate(np.where(dd == 0, t, -1)) if n else t
+    dur = np.where(last_zero >= 1, t - last_zero, np.nan)
+    
+    drawdown = pd.Series(dd, index=pnl.index)
+    duration = pd.Series(dur, index=pnl.index)
     return drawdown, drawdown.max(), duration.max()
     
     
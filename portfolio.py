@@ -195,8 +195,13 @@ avour of how such an OMS is created:
         if fill.direction == 'SELL':
             fill_dir = -1   
     
-        #update holdings list with new quantities
-        fill_cost = self.bars.get_latest_bar_value(fill.symbol, "adj_close")
+        #update holdings list with new quantities, at the execution
+        #price where the handler reports one and otherwise at the
+        #latest bar
+        if fill.fill_cost is None:
+            fill_cost = self.bars.get_latest_bar_value(fill.symbol, "adj_close")
+        else:
+            fill_cost = fill.fill_cost
         cost = fill_dir * fill_cost * fill.quantity
         self.current_holdings[fill.symbol] += cost
         self.current_holdings['commission'] += fill.commission
@@ -228,16 +233,20 @@ avour of how such an OMS is created:
         order_type = 'MKT'
         
         if direction == 'LONG' and cur_quantity == 0:
-            order = OrderEvent(symbol, order_type, mkt_quantity, 'BUY')
+            order = OrderEvent(symbol, order_type, mkt_quantity, 'BUY',
+                               strategy_id=signal.strategy_id)
             OrderEvent(symbol, order_type, mkt_quantity, 'BUY').print_order()
         if direction == 'SHORT' and cur_quantity == 0:
-            order = OrderEvent(symbol, order_type, mkt_quantity, 'SELL')
+            order = OrderEvent(symbol, order_type, mkt_quantity, 'SELL',
+                               strategy_id=signal.strategy_id)
             OrderEvent(symbol, order_type, mkt_quantity, 'SELL').print_order()
         if direction == 'EXIT' and cur_quantity > 0:
-            order = OrderEvent(symbol, order_type, abs(cur_quantity), 'SELL')
+            order = OrderEvent(symbol, order_type, abs(cur_quantity), 'SELL',
+                               strategy_id=signal.strategy_id)
             OrderEvent(symbol, order_type, mkt_quantity, 'SELL').print_order()
         if direction == 'EXIT' and cur_quantity < 0:
-            order = OrderEvent(symbol, order_type, abs(cur_quantity), 'BUY')
+            order = OrderEvent(symbol, order_type, abs(cur_quantity), 'BUY',
+                               strategy_id=signal.strategy_id)
             OrderEvent(symbol, order_type, mkt_quantity, 'BUY').print_order()
         
         return order
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+#resample.py
+from __future__ import print_function
+"""
+Bar storage and on-the-fly resampling to longer timeframes.
+
+BarRingBuffer keeps the latest bars of one symbol in preallocated arrays.
+BarResampler aggregates a stream of bars into bars of a longer timeframe
+(e.g. 1 minute bars into 5 minute, hourly and daily ones) one bar at a
+time, so the cost of a new bar is O(1) and history is never resampled
+again. Fields are aggregated by name: open takes the first value, high
+the maximum, low the minimum, volume the sum and every other field (close,
+adj_close, oi) the last.
+
+The TimeframeCache attached to a DataHandler (see get_timeframe_cache)
+holds one resampler per (symbol, timeframe), created on the first request
+and warmed up from the bars released so far, and brings it up to date
+with the bars released since on each request. The data handlers serve it
+through
+
+    bars.get_latest_bars_values(symbol, 'close', N=20, timeframe='1h')
+
+A resampled bar is labelled with the start of its interval and only
+returned once a bar of a later interval has arrived, unless partial=True
+is passed to TimeframeCache.values.
+"""
+
+import collections
+import sys
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+from pandas.tseries.offsets import Day, Tick
+
+
+FIELDS = ('open', 'high', 'low', 'close', 'adj_close', 'volume')
+
+Bar = collections.namedtuple('Bar', FIELDS)
+
+#calendar timeframes and the pandas Period frequency their bars are
+#bucketed by. pandas names months, quarters and years differently as
+#offsets ('ME', 'MS') and as periods ('M'), so both spellings are taken.
+CALENDAR_PERIODS = {
+        'W': 'W',
+        'M': 'M', 'ME': 'M', 'MS': 'M',
+        'Q': 'Q', 'QE': 'Q', 'QS': 'Q',
+        'Y': 'Y', 'YE': 'Y', 'YS': 'Y', 'A': 'Y'}
+#the anchor of a period names its last weekday or month, e.g. 'W-FRI' or
+#'Q-NOV', so only the aliases labelled by the period end take one
+ANCHORED_PERIODS = ('W', 'Q', 'QE', 'Y', 'YE', 'A')
+
+
+class BarRingBuffer(object):
+    """
+    The latest capacity bars of one symbol, in preallocated arrays of
+    times (int64 ns) and field values. Each bar is written twice, at
+    positions i and i + capacity, so that the latest n bars are always
+    one contiguous slice and are read without copying.
+    """
+    def __init__(self, capacity, fields=FIELDS):
+        """
+        Parameters:
+        capacity - The number of bars held.
+        fields - The names of the value columns.
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be a positive integer")
+        self.capacity = int(capacity)
+        self.fields = tuple(fields)
+        self.columns = dict( (f, i) for i, f in enumerate(self.fields) )
+        self.times = np.zeros(2 * self.capacity, dtype=np.int64)
+        self.values = np.zeros((2 * self.capacity, len(self.fields)))
+        self.count = 0
+
+    def push(self, t_ns, values):
+        i = self.count % self.capacity
+        j = i + self.capacity
+        self.times[i] = self.times[j] = t_ns
+        self.values[i] = self.values[j] = values
+        self.count += 1
+
+    def _window(self, n):
+        n = min(n, self.count, self.capacity)
+        end = (self.count - 1) % self.capacity + self.capacity + 1
+        return end - n, end
+
+    def latest(self, field, n=1):
+        """
+        Returns a view of the last n values of field, oldest first, or
+        fewer if less are held.
+        """
+        start, end = self._window(n)
+        return self.values[start:end, self.columns[field]]
+
+    def latest_times(self, n=1):
+        start, end = self._window(n)
+        return self.times[start:end]
+
+    def latest_rows(self, n=1):
+        """
+        Returns views of the last n times and (n x fields) values.
+        """
+        start, end = self._window(n)
+        return self.times[start:end], self.values[start:end]
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+
+def _ns(dt):
+    return pd.Timestamp(dt).value
+
+
+def _bar_fields(bar):
+    """
+    The field names of a bar, a namedtuple or a pandas Series.
+    """
+    fields = getattr(bar, '_fields', None)
+    return tuple(fields) if fields is not None else tuple(bar.index)
+
+
+class BarResampler(object):
+    """
+    Aggregates bars, in time order, into bars of a longer timeframe.
+    """
+    def __init__(self, timeframe, capacity=10000):
+        """
+        Parameters:
+        timeframe - A pandas frequency, e.g. '5min', '1h', '1D', 'W',
+            'W-FRI', 'M' or 'Q'. Fixed lengths, including multiples of a
+            day, are aligned to the epoch, and calendar ones (a single
+            week, month, quarter or year, see CALENDAR_PERIODS) to their
+            pandas periods. Anything else raises a ValueError.
+        capacity - The number of resampled bars held.
+        """
+        self.timeframe = timeframe
+        self.capacity = capacity
+        self.freq_ns, self.period = self._parse_timeframe(timeframe)
+
+        self.fields = None
+        self.bars = None
+        #the interval start and field values of the bar in progress
+        self.bucket = None
+        self.bar = None
+        self.last_ns = None
+
+    def _setup(self, fields):
+        self.fields = tuple(fields)
+        self.bars = BarRingBuffer(self.capacity, self.fields)
+        col = dict( (f, i) for i, f in enumerate(self.fields) )
+        self.i_max = [col[f] for f in ('high',) if f in col]
+        self.i_min = [col[f] for f in ('low',) if f in col]
+        self.i_sum = [col[f] for f in ('volume',) if f in col]
+        self.i_last = [
+                i for f, i in col.items() if f not in ('open', 'high', 'low', 'volume')]
+
+    @staticmethod
+    def _parse_timeframe(timeframe):
+        """
+        Returns the length in ns of a fixed timeframe, or the Period
+        frequency of a calendar one, as (freq_ns, period).
+        """
+        base, _, anchor = timeframe.partition('-')
+        if base in CALENDAR_PERIODS and (not anchor or base in ANCHORED_PERIODS):
+            period = CALENDAR_PERIODS[base] + ('-' + anchor if anchor else '')
+            try:
+                pd.Period(pd.Timestamp(0), period)
+            except ValueError:
+                raise ValueError("Unsupported timeframe {!r}".format(timeframe))
+            return None, period
+        try:
+            offset = to_offset(timeframe)
+        except ValueError:
+            raise ValueError("Unsupported timeframe {!r}".format(timeframe))
+        if isinstance(offset, Tick):
+            return offset.nanos, None
+        if isinstance(offset, Day):
+            return offset.n * 86400 * 10**9, None
+        raise ValueError(
+                "Unsupported timeframe {!r}: expected a fixed length or one "
+                "of {}".format(timeframe, ', '.join(sorted(CALENDAR_PERIODS))))
+
+    def _bucket(self, t_ns):
+        if self.freq_ns is not None:
+            return t_ns - t_ns % self.freq_ns
+        return pd.Period(pd.Timestamp(t_ns), self.period).start_time.value
+
+    def add(self, t_ns, values, fields=FIELDS):
+        """
+        Adds a bar at time t_ns with the given field values, pushing the
+        bar in progress if this one starts a new interval.
+        """
+        if self.fields is None:
+            self._setup(fields)
+        values = np.asarray(values, dtype=np.float64)
+        bucket = self._bucket(t_ns)
+        if bucket != self.bucket:
+            if self.bucket is not None:
+                self.bars.push(self.bucket, self.bar)
+            self.bucket = bucket
+            self.bar = values.copy()
+        else:
+            b = self.bar
+            b[self.i_max] = np.maximum(b[self.i_max], values[self.i_max])
+            b[self.i_min] = np.minimum(b[self.i_min], values[self.i_min])
+            b[self.i_sum] += values[self.i_sum]
+            b[self.i_last] = values[self.i_last]
+        self.last_ns = t_ns
+
+    def latest(self, field, n=1, partial=False):
+        """
+        Returns the last n values of field of the completed bars, the
+        last of them the bar in progress if partial.
+        """
+        if self.bars is None:
+            return np.empty(0)
+        if not partial or self.bucket is None:
+            return self.bars.latest(field, n).copy()
+        done = self.bars.latest(field, n - 1) if n > 1 else np.empty(0)
+        return np.append(done, self.bar[self.bars.columns[field]])
+
+
+class TimeframeCache(object):
+    """
+    The resamplers of one DataHandler, per (symbol, timeframe).
+    """
+    def __init__(self, bars, capacity=10000):
+        """
+        Parameters:
+        bars - The DataHandler object the bars are read from.
+        capacity - The number of resampled bars held per resampler.
+        """
+        self.bars = bars
+        self.capacity = capacity
+        self.resamplers = {}
+
+    def get(self, symbol, timeframe):
+        """
+        Returns the up to date resampler of symbol to timeframe, creating
+        it if this is the first request.
+        """
+        key = (symbol, timeframe)
+        resampler = self.resamplers.get(key)
+        if resampler is None:
+            resampler = BarResampler(timeframe, self.capacity)
+            self.resamplers[key] = resampler
+        for dt, bar in self._new_bars(symbol, resampler.last_ns):
+            fields = _bar_fields(bar)
+            resampler.add(_ns(dt), [getattr(bar, f) for f in fields], fields)
+        return resampler
+
+    def values(self, symbol, val_type, N=1, timeframe='1D', partial=False):
+        """
+        Returns the last N values of val_type of the symbol's bars
+        resampled to timeframe, or N-k if less available.
+        """
+        return self.get(symbol, timeframe).latest(val_type, N, partial)
+
+    def _new_bars(self, symbol, last_ns):
+        """
+        Returns the bars released after last_ns, all of them if None,
+        reading back twice as far each time until it is reached.
+        """
+        if last_ns is None:
+            return self.bars.get_latest_bars(symbol, N=sys.maxsize)
+        k = 1
+        while True:
+            bars = self.bars.get_latest_bars(symbol, N=k)
+            if len(bars) < k or _ns(bars[0][0]) <= last_ns:
+                return [b for b in bars if _ns(b[0]) > last_ns]
+            k *= 2
+
+
+def get_timeframe_cache(bars):
+    """
+    Returns the TimeframeCache attached to a DataHandler, creating it on
+    first use, so every strategy built on the same data feed shares it.
+    """
+    cache = getattr(bars, 'timeframe_cache', None)
+    if cache is None:
+        cache = TimeframeCache(bars)
+        bars.timeframe_cache = cache
+    return cache
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+#signal_cache.py
+from __future__ import print_function
+"""
+Signal stream caching.
+
+A strategy's SignalEvent stream depends only on the market data and the
+strategy parameters, not on portfolio sizing or execution assumptions. The
+first run of a strategy over a data set records its signals to a compact
+compressed file keyed by a hash of the strategy, its source code, its
+parameters, the data handler and the contents of the data files, so that
+editing the strategy invalidates its signals. Later runs, such as sweeps over
+portfolio or execution settings, replay the file instead of recomputing
+the signals.
+
+Usage, in place of the strategy class given to Backtest:
+
+    strategy = cached_strategy(MovingAverageCrossStrategy,
+                               short_window=50, long_window=200)
+"""
+
+import datetime
+import functools
+import hashlib
+import inspect
+import os, os.path
+
+import numpy as np
+
+from event_driven_trading.strategy import Strategy
+from event_driven_trading.event import SignalEvent
+
+
+CACHE_DIR_NAME = '.signal_cache'
+SIGNAL_TYPES = ('LONG', 'SHORT', 'EXIT')
+
+
+def hash_data_files(csv_dir, symbol_list, chunk_size=1 << 20):
+    """
+    Returns a hex digest of the contents of every 'symbol.csv' file.
+    """
+    h = hashlib.sha1()
+    for s in symbol_list:
+        h.update(s.encode('utf-8'))
+        with open(os.path.join(csv_dir, '{}.csv'.format(s)), 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def hash_strategy_source(strategy_cls):
+    """
+    Returns a hex digest of the source code of strategy_cls and of the
+    classes it inherits from. A class whose source is unavailable (e.g.
+    defined interactively) is hashed by name only.
+    """
+    h = hashlib.sha1()
+    for cls in inspect.getmro(strategy_cls):
+        if cls is object:
+            continue
+        h.update('{}.{}'.format(cls.__module__, cls.__qualname__).encode('utf-8'))
+        try:
+            h.update(inspect.getsource(cls).encode('utf-8'))
+        except (OSError, TypeError):
+            pass
+    return h.hexdigest()
+
+
+def signal_cache_key(strategy_cls, params, bars):
+    """
+    Returns the cache key for running strategy_cls with the given
+    keyword params over the data handler's data set.
+    """
+    raw = repr((
+            strategy_cls.__module__, strategy_cls.__name__,
+            hash_strategy_source(strategy_cls),
+            sorted((k, repr(v)) for k, v in params.items()),
+            type(bars).__module__, type(bars).__name__,
+            list(bars.symbol_list),
+            hash_data_files(bars.csv_dir, bars.symbol_list)
+    ))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def write_signals(path, records, symbol_list):
+    """
+    Writes a list of (bar number, strategy_id, symbol, signal_type,
+    strength) records to a compressed .npz file, with symbols and signal
+    types stored as small integer codes.
+    """
+    symbol_code = dict( (s, i) for i, s in enumerate(symbol_list) )
+    type_code = dict( (t, i) for i, t in enumerate(SIGNAL_TYPES) )
+    n = len(records)
+    bar = np.empty(n, dtype=np.int64)
+    strategy_id = np.empty(n, dtype=np.int32)
+    symbol = np.empty(n, dtype=np.int32)
+    signal_type = np.empty(n, dtype=np.int8)
+    strength = np.empty(n, dtype=np.float64)
+    for k, r in enumerate(records):
+        bar[k] = r[0]
+        strategy_id[k] = r[1]
+        symbol[k] = symbol_code[r[2]]
+        signal_type[k] = type_code[r[3]]
+        strength[k] = r[4]
+
+    cache_dir = os.path.dirname(path)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    #write then rename so a partial file is never picked up
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(
+                f, bar=bar, strategy_id=strategy_id, symbol=symbol,
+                signal_type=signal_type, strength=strength,
+                symbols=np.array(symbol_list))
+    os.replace(tmp_path, path)
+
+
+class SignalRecorder(object):
+    """
+    Stands in for the events queue of a recorded strategy, forwarding
+    every event to the real queue and keeping a record of the signals.
+    """
+    def __init__(self, events, strategy):
+        self.events = events
+        self.strategy = strategy
+
+    def put(self, event, *args, **kwargs):
+        if event.type == 'SIGNAL':
+            self.strategy.records.append((
+                    self.strategy.bar_count, event.strategy_id,
+                    event.symbol, event.signal_type, event.strength))
+        self.events.put(event, *args, **kwargs)
+
+
+class SignalRecordingStrategy(Strategy):
+    """
+    Runs a strategy as normal while recording its signals, and writes
+    them to path once the data handler reports the end of the data.
+    """
+    def __init__(self, bars, events, strategy_cls, params, path):
+        self.bars = bars
+        self.symbol_list = self.bars.symbol_list
+        self.events = events
+        self.path = path
+        self.records = []
+        self.bar_count = 0
+        self.written = False
+        self.strategy = strategy_cls(
+                bars, SignalRecorder(events, self), **params)
+
+    def calculate_signals(self, event):
+        if event.type == 'MARKET':
+            self.bar_count += 1
+        self.strategy.calculate_signals(event)
+        #update_bars still emits a MarketEvent for the bar on which the
+        #data runs out, after which the backtest stops
+        if event.type == 'MARKET' and not self.bars.continue_backtest:
+            self.save()
+
+    def save(self):
+        if not self.written:
+            write_signals(self.path, self.records, self.symbol_list)
+            self.written = True
+
+
+class SignalReplayStrategy(Strategy):
+    """
+    Replays a recorded signal stream, putting each bar's signals on the
+    events queue, in their original order, on the same MarketEvent on
+    which they were first generated.
+    """
+    def __init__(self, bars, events, path):
+        self.bars = bars
+        self.symbol_list = self.bars.symbol_list
+        self.events = events
+        with np.load(path) as data:
+            self.bar = data['bar']
+            self.strategy_id = data['strategy_id']
+            self.symbol = data['symbol']
+            self.signal_type = data['signal_type']
+            self.strength = data['strength']
+            self.symbols = [str(s) for s in data['symbols']]
+        self.bar_count = 0
+        self.pos = 0
+
+    def calculate_signals(self, event):
+        if event.type == 'MARKET':
+            self.bar_count += 1
+            n = len(self.bar)
+            if self.pos >= n or self.bar[self.pos] != self.bar_count:
+                return
+            dt = datetime.datetime.utcnow()
+            while self.pos < n and self.bar[self.pos] == self.bar_count:
+                k = self.pos
+                self.events.put(SignalEvent(
+                        int(self.strategy_id[k]), self.symbols[self.symbol[k]],
+                        dt, SIGNAL_TYPES[self.signal_type[k]],
+                        float(self.strength[k])))
+                self.pos += 1
+
+
+def _create_cached_strategy(bars, events, strategy_cls, params, cache_dir):
+    if cache_dir is None:
+        cache_dir = os.path.join(bars.csv_dir, CACHE_DIR_NAME)
+    key = signal_cache_key(strategy_cls, params, bars)
+    path = os.path.join(cache_dir, '{}.npz'.format(key))
+    if os.path.exists(path):
+        return SignalReplayStrategy(bars, events, path)
+    return SignalRecordingStrategy(bars, events, strategy_cls, params, path)
+
+
+def cached_strategy(strategy_cls, cache_dir=None, **params):
+    """
+    Returns a strategy constructor for Backtest which replays the cached
+    signals of strategy_cls(bars, events, **params) for the backtest's
+    data set if they exist, and otherwise runs and records it.
+
+    Parameters:
+    strategy_cls - (Class) The strategy to run.
+    cache_dir - The cache directory, defaulting to '.signal_cache' in
+        the data directory.
+    params - Keyword arguments for strategy_cls, part of the cache key.
+    """
+    return functools.partial(
+            _create_cached_strategy, strategy_cls=strategy_cls,
+            params=params, cache_dir=cache_dir)
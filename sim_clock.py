@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+#sim_clock.py
+from __future__ import print_function
+"""
+Simulated time for the event loop.
+
+The Backtest keeps a SimulatedClock at the time of the latest bar and
+dispatches events from a TimedEventQueue, a heap keyed on (event time,
+arrival order) with the put/get interface of queue.Queue. Events put
+without a time are due immediately, so with no latency the queue behaves
+exactly like the FIFO queue it replaces. Events scheduled in the future,
+such as fills arriving after an order latency, are held back until the
+clock reaches them, and are dispatched before any later bar. Each put and
+get is O(log n) in the number of pending events.
+
+Times are held as int64 nanoseconds since the epoch. A listener, if
+set, is called after every put; the live runner uses it to wake its event
+loop when a fill arrives from another thread.
+
+The latency helpers return callables giving a latency in seconds, for
+SimulatedExecutionHandler(latency=...):
+
+    execution_handler = functools.partial(
+            SimulatedExecutionHandler,
+            latency=lognormal_latency(0.05, 0.5, seed=1))
+"""
+
+import heapq
+import itertools
+import queue
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+def to_ns(dt):
+    """
+    Returns a datetime (or Timestamp) as int64 nanoseconds.
+    """
+    return pd.Timestamp(dt).value
+
+
+class SimulatedClock(object):
+    """
+    The current simulated time, which only moves forwards.
+    """
+    def __init__(self, start=None):
+        self.now_ns = to_ns(start) if start is not None else 0
+
+    @property
+    def now(self):
+        return pd.Timestamp(self.now_ns)
+
+    def advance_to(self, t):
+        """
+        Moves the clock to t (a datetime or nanoseconds), unless it is
+        already later.
+        """
+        t_ns = t if isinstance(t, (int, np.integer)) else to_ns(t)
+        if t_ns > self.now_ns:
+            self.now_ns = int(t_ns)
+
+
+class TimedEventQueue(object):
+    """
+    A priority queue of events keyed on their due time, releasing only
+    those due at or before the clock's current time. Safe to put to
+    from other threads, such as a live execution handler's reader.
+    """
+    def __init__(self, clock):
+        self.clock = clock
+        self.heap = []
+        self.seq = itertools.count()
+        self.lock = threading.Lock()
+        self.listener = None
+
+    def put(self, event, block=True, timeout=None, at=None):
+        """
+        Adds an event due at time at (a datetime or nanoseconds),
+        defaulting to now.
+        """
+        if at is None:
+            t_ns = self.clock.now_ns
+        elif isinstance(at, (int, np.integer)):
+            t_ns = int(at)
+        else:
+            t_ns = to_ns(at)
+        with self.lock:
+            heapq.heappush(self.heap, (t_ns, next(self.seq), event))
+        if self.listener is not None:
+            self.listener()
+
+    def get(self, block=False, timeout=None):
+        """
+        Returns the earliest due event, raising queue.Empty if there is
+        none. Never blocks: the clock only moves when the Backtest
+        advances it.
+        """
+        with self.lock:
+            if self.heap and self.heap[0][0] <= self.clock.now_ns:
+                return heapq.heappop(self.heap)[2]
+        raise queue.Empty
+
+    def next_time(self):
+        """
+        The due time in nanoseconds of the earliest pending event, or
+        None if the queue is empty.
+        """
+        return self.heap[0][0] if self.heap else None
+
+    def qsize(self):
+        return len(self.heap)
+
+    def empty(self):
+        return not self.heap
+
+
+def constant_latency(seconds):
+    return lambda: seconds
+
+
+def uniform_latency(low, high, seed=None):
+    """
+    Latencies drawn uniformly from [low, high) seconds.
+    """
+    rng = np.random.RandomState(seed)
+    return lambda: rng.uniform(low, high)
+
+
+def lognormal_latency(median, sigma, seed=None):
+    """
+    Log-normal latencies with the given median in seconds and log
+    standard deviation sigma, giving the long right tail of real
+    order round trips.
+    """
+    rng = np.random.RandomState(seed)
+    mu = np.log(median)
+    return lambda: rng.lognormal(mu, sigma)
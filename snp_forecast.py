@@ -11,6 +11,8 @@ Created on Tue May 28 18:59:56 2019
 """
 
 import datetime
+import os.path
+import numpy as np
 import pandas as pd
 import sys
 from sklearn.discriminant_analysis import QuadraticDiscriminantAnalysis as QDA
@@ -22,6 +24,8 @@ from event_driven_trading.data import HistoricCSVDataHandler
 from event_driven_trading.execution import SimulatedExecutionHandler
 from event_driven_trading.portfolio import Portfolio
 from event_driven_trading.create_lagged_series import create_lagged_series
+from event_driven_trading.model_cache import fit_cached, CACHE_DIR_NAME
+from event_driven_trading.feature_store import asof_lagged_features
 
 
 
@@ -30,8 +34,28 @@ class SPYDailyForecastStrategy(Strategy):
     SP500 forecast strategy. It uses a quadratic discriminant analyser
     to predict the returns for a subsequent time period and then generated
     long/exit signals based on the prediction
+    
+    The trained model is only built when first needed, and is loaded from
+    the on-disk model cache if an identical model (same training data,
+    model class and hyperparameters) has been trained before.
+    
+    With batch_predict (the default) the lag features of every bar are
+    built once and run through a single batched predict, so that per-bar
+    signal generation is an array lookup rather than a predict call.
     """
-    def __init__(self, bars, events):
+    def __init__(self, bars, events, model_cls=QDA, model_params=None,
+                 model_cache_dir=None, batch_predict=True):
+        """
+        Parameters:
+        bars - The DataHandler object with current market data.
+        events - The Event Queue object.
+        model_cls - (Class) The sklearn classifier to forecast with.
+        model_params - A dict of keyword arguments for model_cls.
+        model_cache_dir - Where trained models are cached, defaulting
+            to '.model_cache' in the data directory. False disables it.
+        batch_predict - Precompute all predictions up front (True) or
+            call predict on every bar (False).
+        """
         self.bars = bars
         self.symbol_list = self.bars.symbol_list
         self.events = events
@@ -45,18 +69,36 @@ class SPYDailyForecastStrategy(Strategy):
         self.short_market = False
         self.bar_index = 0
         
-        self.model = self.create_symbol_forecast_model()
+        self.model_cls = model_cls
+        self.model_params = model_params or {}
+        if model_cache_dir is None:
+            model_cache_dir = os.path.join(self.bars.csv_dir, CACHE_DIR_NAME)
+        self.model_cache_dir = model_cache_dir or None
+        self._model = None
         
+        self.features = ["Lag1", "Lag2"]
+        self.batch_predict = batch_predict
+        self.pred_dates = None
+        self.preds = None
+        
+    @property
+    def model(self):
+        """
+        The forecast model, trained or loaded from the cache on first use.
+        """
+        if self._model is None:
+            self._model = self.create_symbol_forecast_model()
+        return self._model
         
     def create_symbol_forecast_model(self):
         #Create a lagged series of the SP500 Stock market
         snpret = create_lagged_series(
                 self.symbol_list[0], self.model_start_date,
-                self.model_end_date, lags=5
+                self.model_end_date, lags=5, csv_dir=self.bars.csv_dir
                 )
         
         ##use the prior two days of returns as predictors
-        X = snpret[["Lag1", "Lag2"]]
+        X = snpret[self.features]
         y = snpret["Direction"]
         
         #Create training and test sets
@@ -67,20 +109,67 @@ class SPYDailyForecastStrategy(Strategy):
         y_test = y[y.index >= start_test]
         """
         NOTE: we can replace the model with a random fores, SVM, or 
-        Logit Regression. just import the library and change the model=QDA()
-        line
+        Logit Regression. just pass its class as model_cls (and any
+        hyperparameters as model_params)
+        """
+        model = self.model_cls(**self.model_params)
+        return fit_cached(model, X_train, y_train, self.model_cache_dir)
+    
+    def precompute_predictions(self):
         """
-        model = QDA()
-        model.fit(X_train, y_train)
-        return model          
+        Builds the lag features for every bar of the symbol's data and
+        forecasts them with one batched predict. The row stored against
+        date t holds the returns of t and t-1, which are known at the
+        close of t, and its forecast is for the following bar.
+        """
+        feats = asof_lagged_features(
+                self.symbol_list[0], lags=len(self.features),
+                csv_dir=self.bars.csv_dir)
+        feats = feats[self.features].dropna()
+        self.pred_dates = feats.index.values.astype('datetime64[ns]')
+        self.preds = self.model.predict(feats)
+        
+    def lookup_prediction(self, bar_date):
+        """
+        Returns the precomputed forecast made at the close of bar_date,
+        or None if there is none. The lookup takes the last row dated at
+        or before the bar and then requires it to be the bar itself, so a
+        feature row from after the bar can never be used, and a stale one
+        from before it (a gap in the feature data) is not used either.
+        """
+        if self.preds is None:
+            self.precompute_predictions()
+        t = np.datetime64(pd.Timestamp(bar_date).to_datetime64(), 'ns')
+        pos = np.searchsorted(self.pred_dates, t, side='right') - 1
+        if pos < 0 or self.pred_dates[pos] != t:
+            return None
+        return self.preds[pos]
+        
+    def predict_latest_bar(self):
+        """
+        Returns the forecast for the bar after the latest one, or None
+        if there is not enough data yet.
+        """
+        sym = self.symbol_list[0]
+        if self.batch_predict:
+            return self.lookup_prediction(self.bars.get_latest_bar_datetime(sym))
+        
+        #returns of the latest bar and the one before it, in percent
+        prices = self.bars.get_latest_bars_values(sym, "adj_close", N=3)
+        if len(prices) < 3:
+            return None
+        rets = (prices[1:] / prices[:-1] - 1.0) * 100.0
+        X = pd.DataFrame([[rets[1], rets[0]]], columns=self.features)
+        return self.model.predict(X)[0]
+        
     #now to override the calculate_signals method of the Strat base class
     def calculate_signals(self, event):
         """
         Calculate the signalevents based on marketdata.
         
         We wait for five bars to have elapsed (i.e. five days in this strategy!) and then obtain the
-        lagged returns values. We then wrap these values in a Pandas Series so that the predict method
-        of the model will function correctly. We then calculate a prediction, which manifests itself as a
+        prediction made from the lagged returns values, either precomputed in one batch or from a
+        single predict call on the latest bars. The prediction manifests itself as a
         +1 or -1. If the prediction is a +1 and we are not already long the market, we create a SignalEvent
         to go long and let the class know we are now in the market. If the prediction is -1 and we are
         long the market, then we simply exit the market:
@@ -91,20 +180,9 @@ class SPYDailyForecastStrategy(Strategy):
         if event.type == 'MARKET':
             self.bar_index += 1
             if self.bar_index > 5:
-                #the 'adj_close' field below needs to be returns. but no returns data exists in the data.py file
-                lags = self.bars.get_latest_bars_values(
-                        self.symbol_list[0], "adj_close", N=3
-                )
-                pred_series = ([[lags[1]*100.0, lags[2]*100.0]])
-                """
-                pd.Series(
-                        {
-                                'Lag1': lags[1]*100.0,
-                                'Lag2': lags[2]*100.0
-                        }
-                )
-                """
-                pred = self.model.predict(pred_series)
+                pred = self.predict_latest_bar()
+                if pred is None:
+                    return
                 if pred > 0 and not self.long_market:
                     self.long_market = True
                     signal = SignalEvent(1, sym, dt, 'LONG', 1.0)
@@ -38,6 +38,103 @@ class Strategy(object):
         raise NotImplementedError("Should implement calculate_signals()")
         
         
+class VectorizedStrategy(Strategy):
+    """
+    VectorizedStrategy is an optional interface for cross-sectional
+    strategies. Instead of looping over symbol_list and querying the
+    data handler per symbol, a derived class implements
+    calculate_targets, which receives the latest window of each field
+    as one (lookback x symbols) array and returns a vector of target
+    signals, one per symbol:
+        +x - be long (with strength x)
+        -x - be short (with strength x)
+        0 - be out of the market
+        NaN - leave the symbol as it is
+    
+    The base class keeps the current target direction of every symbol
+    and turns the vector into SignalEvents only for the symbols whose
+    direction changed, so a bar in which nothing changes costs one
+    comparison over the whole universe.
+    """
+    def __init__(self, bars, events, lookback=1, fields=("adj_close",),
+                 strategy_id=1):
+        """
+        Parameters:
+        bars - The DataHandler object with current market data.
+        events - The Event Queue object.
+        lookback - The number of bars in each window.
+        fields - The bar fields passed to calculate_targets.
+        strategy_id - The id stamped on the generated signals.
+        """
+        self.bars = bars
+        self.symbol_list = self.bars.symbol_list
+        self.events = events
+        self.lookback = lookback
+        self.fields = tuple(fields)
+        self.strategy_id = strategy_id
+        
+        #current direction per symbol: 1 long, -1 short, 0 out
+        self.positions = np.zeros(len(self.symbol_list))
+        
+    @abstractmethod
+    def calculate_targets(self, windows):
+        """
+        Returns the vector of target signals, given a dict of field
+        name to (lookback x symbols) array, newest bar last.
+        """
+        raise NotImplementedError("Should implement calculate_targets()")
+        
+    def get_windows(self):
+        """
+        Returns the latest window of every field, or None while fewer
+        than lookback bars are available.
+        """
+        windows = {}
+        for f in self.fields:
+            windows[f] = self.bars.get_latest_bars_matrix(f, N=self.lookback)
+            if windows[f].shape[0] < self.lookback:
+                return None
+        return windows
+    
+    def emit_target_changes(self, targets):
+        """
+        Puts a SignalEvent on the queue for every symbol whose target
+        direction differs from its current one. A flip straight from long
+        to short (or back) is sent as an EXIT only, leaving the symbol
+        flat: the portfolio only opens positions from flat and its
+        positions change on the fill, after both signals of the bar would
+        have been handled. The new entry follows on the next bar whose
+        target is still the opposite direction.
+        """
+        targets = np.asarray(targets, dtype=float)
+        direction = np.where(np.isnan(targets), self.positions, np.sign(targets))
+        changed = np.flatnonzero(direction != self.positions)
+        if len(changed) == 0:
+            return
+        dt = datetime.datetime.utcnow()
+        for i in changed:
+            symbol = self.symbol_list[i]
+            if self.positions[i] != 0:
+                self.events.put(SignalEvent(
+                        self.strategy_id, symbol, dt, 'EXIT', 1.0))
+                self.positions[i] = 0
+            elif direction[i] != 0:
+                self.events.put(SignalEvent(
+                        self.strategy_id, symbol, dt,
+                        'LONG' if direction[i] > 0 else 'SHORT', abs(targets[i])))
+                self.positions[i] = direction[i]
+        
+    def calculate_signals(self, event):
+        """
+        Feeds the latest windows to calculate_targets and emits the
+        signals for the symbols that changed.
+        """
+        if event.type == 'MARKET':
+            windows = self.get_windows()
+            if windows is not None:
+                self.emit_target_changes(self.calculate_targets(windows))
+        
+        
         
         
         
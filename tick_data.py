@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+#tick_data.py
+from __future__ import print_function
+"""
+Tick level data: trades and bid/ask quotes.
+
+Each symbol has a trade file 'symbol_trades.csv' with the columns
+
+    datetime, price, size
+
+and/or a quote file 'symbol_quotes.csv' with the columns
+
+    datetime, bid, ask, bid_size, ask_size
+
+which are parsed once, in chunks, into compact numpy record arrays: int64
+nanosecond timestamps, prices as int32 multiples of 1 / price_scale (or
+float32 with price_scale=None) and int32 sizes, 16 bytes a trade and 24 a
+quote against 40-56 as float64 DataFrame rows. The arrays are cached on
+disk as .npy files keyed by the source file's size and modification time,
+and memory mapped on later runs rather than parsed again.
+
+TickDataHandler replays the ticks of every symbol in time order behind a
+cursor, with as-of quote lookups by binary search of the released
+quotes, and builds bars of bar_freq from the trades on the fly with a
+TickBarAggregator, so bar strategies, portfolios and execution handlers
+run on tick data unchanged:
+
+    data_handler = functools.partial(TickDataHandler, bar_freq='5min')
+"""
+
+import hashlib
+import os, os.path
+
+import numpy as np
+import pandas as pd
+
+from event_driven_trading.event import MarketEvent
+from event_driven_trading.live_data import RingBufferDataHandler
+from event_driven_trading.resample import BarRingBuffer
+
+
+CACHE_DIR_NAME = '.tick_cache'
+
+TRADE_COLUMNS = ['price', 'size']
+QUOTE_COLUMNS = ['bid', 'ask', 'bid_size', 'ask_size']
+PRICE_COLUMNS = ('price', 'bid', 'ask')
+
+
+def tick_dtype(columns, price_scale=10000):
+    """
+    The record dtype of a tick file's columns: int64 ns timestamps, int32
+    sizes and int32 scaled prices, or float32 prices if price_scale is
+    None.
+    """
+    price_type = np.float32 if price_scale is None else np.int32
+    return np.dtype([('timestamp', np.int64)] + [
+            (c, price_type if c in PRICE_COLUMNS else np.int32)
+            for c in columns ])
+
+
+def _cache_key(csv_path, price_scale):
+    st = os.stat(csv_path)
+    raw = repr((os.path.basename(csv_path), price_scale, st.st_size, int(st.st_mtime)))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def read_tick_csv(csv_path, columns, price_scale=10000, chunksize=1000000):
+    """
+    Parses a tick CSV file into a record array sorted by time, a chunk
+    at a time so the whole file is never held as float64 columns.
+    """
+    dtype = tick_dtype(columns, price_scale)
+    limit = np.iinfo(np.int32).max
+    chunks = []
+    for df in pd.read_csv(
+            csv_path, header=0, names=['datetime'] + columns,
+            chunksize=chunksize):
+        rec = np.empty(len(df), dtype=dtype)
+        rec['timestamp'] = pd.to_datetime(df['datetime']).values.astype(
+                'datetime64[ns]').astype(np.int64)
+        for c in columns:
+            values = df[c].values
+            if c in PRICE_COLUMNS and price_scale is not None:
+                values = np.rint(values * price_scale)
+                if len(values) and np.abs(values).max() > limit:
+                    raise ValueError(
+                            "{} prices overflow int32 at price_scale {}".format(
+                                    csv_path, price_scale))
+            rec[c] = values
+        chunks.append(rec)
+    ticks = np.concatenate(chunks) if chunks else np.empty(0, dtype=dtype)
+    return ticks[np.argsort(ticks['timestamp'], kind='mergesort')]
+
+
+def load_ticks(csv_path, columns, price_scale=10000, cache_dir=None):
+    """
+    Returns the ticks of csv_path, from the .npy cache in cache_dir
+    (memory mapped) if it is current, otherwise parsing and caching them.
+
+    Parameters:
+    csv_path - The tick CSV file.
+    columns - The columns after datetime, TRADE_COLUMNS or QUOTE_COLUMNS.
+    price_scale - Prices are stored as int32 multiples of 1 / price_scale,
+        or as float32 if None.
+    cache_dir - The on-disk cache directory, defaulting to '.tick_cache'
+        beside the CSV. False disables the disk cache.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(csv_path), CACHE_DIR_NAME)
+    if cache_dir is False:
+        return read_tick_csv(csv_path, columns, price_scale)
+
+    cache_path = os.path.join(
+            cache_dir, '{}.npy'.format(_cache_key(csv_path, price_scale)))
+    if os.path.exists(cache_path):
+        return np.load(cache_path, mmap_mode='r')
+    ticks = read_tick_csv(csv_path, columns, price_scale)
+    os.makedirs(cache_dir, exist_ok=True)
+    #write then rename so concurrent workers never see a partial file
+    tmp_path = '{}.{}.tmp.npy'.format(cache_path, os.getpid())
+    np.save(tmp_path, ticks)
+    os.replace(tmp_path, cache_path)
+    return ticks
+
+
+class TickBarAggregator(object):
+    """
+    Builds bars of a fixed frequency from batches of trades in time
+    order, into a BarRingBuffer. Bars are labelled with the start of
+    their interval and only pushed once it has ended; intervals with no
+    trades have no bar.
+    """
+    def __init__(self, freq, capacity=10000):
+        """
+        Parameters:
+        freq - The bar length, e.g. '1min' or a pandas Timedelta.
+        capacity - The number of bars held.
+        """
+        self.freq_ns = pd.Timedelta(freq).value
+        self.bars = BarRingBuffer(capacity)
+        #the bucket and [open, high, low, close, volume] of the open bar
+        self.bucket = None
+        self.bar = None
+
+    def add(self, times, prices, sizes):
+        """
+        Adds a batch of trades, pushing every bar it completes.
+        """
+        if len(times) == 0:
+            return
+        buckets = times // self.freq_ns
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        ends = np.r_[starts[1:], len(times)] - 1
+        bars = np.column_stack([
+                prices[starts], np.maximum.reduceat(prices, starts),
+                np.minimum.reduceat(prices, starts), prices[ends],
+                np.add.reduceat(sizes.astype(np.float64), starts)])
+        buckets = buckets[starts]
+
+        if self.bucket is not None:
+            if buckets[0] == self.bucket:
+                #the first bar of the batch continues the open one
+                bars[0, 0] = self.bar[0]
+                bars[0, 1] = max(bars[0, 1], self.bar[1])
+                bars[0, 2] = min(bars[0, 2], self.bar[2])
+                bars[0, 4] += self.bar[4]
+            else:
+                self._push(self.bucket, self.bar)
+        for k in range(len(buckets) - 1):
+            self._push(buckets[k], bars[k])
+        self.bucket = buckets[-1]
+        self.bar = bars[-1]
+
+    def close_until(self, t_ns):
+        """
+        Pushes the open bar if its interval ends at or before t_ns.
+        """
+        if self.bucket is not None and (self.bucket + 1) * self.freq_ns <= t_ns:
+            self._push(self.bucket, self.bar)
+            self.bucket = None
+            self.bar = None
+
+    def _push(self, bucket, bar):
+        o, h, l, c, v = bar
+        self.bars.push(bucket * self.freq_ns, (o, h, l, c, c, v))
+
+
+class TickDataHandler(RingBufferDataHandler):
+    """
+    Replays the trades and quotes of each symbol from tick files, one bar
+    interval per update_bars (or one timestamp with tick_by_tick), and
+    serves bars aggregated from the trades through the usual getters.
+    """
+    def __init__(self, events, csv_dir, symbol_list, bar_freq='1min',
+                 price_scale=10000, tick_by_tick=False, capacity=10000,
+                 cache_dir=None):
+        """
+        Parameters:
+        events - The event queue.
+        csv_dir - The directory of the 'symbol_trades.csv' and
+            'symbol_quotes.csv' files. Either may be missing.
+        symbol_list - The list of symbol strings.
+        bar_freq - The length of the bars built from the trades.
+        price_scale - Prices are stored as int32 multiples of
+            1 / price_scale, or as float32 if None.
+        tick_by_tick - Release the ticks of one timestamp per update
+            rather than a whole bar interval.
+        capacity - The number of bars of each symbol held.
+        cache_dir - The tick cache directory, as for load_ticks.
+        """
+        self.events = events
+        self.csv_dir = csv_dir
+        self.symbol_list = symbol_list
+        self.price_scale = price_scale
+        self.tick_by_tick = tick_by_tick
+        self.continue_backtest = True
+
+        self.trades = {}
+        self.quotes = {}
+        for s in symbol_list:
+            self.trades[s] = self._load(s, 'trades', TRADE_COLUMNS, cache_dir)
+            self.quotes[s] = self._load(s, 'quotes', QUOTE_COLUMNS, cache_dir)
+        #the number of trades and quotes of each symbol released
+        self.trade_pos = dict( (s, 0) for s in symbol_list )
+        self.quote_pos = dict( (s, 0) for s in symbol_list )
+        #ticks before cursor_ns have been released
+        self.cursor_ns = None
+
+        self.aggregators = dict(
+                (s, TickBarAggregator(bar_freq, capacity)) for s in symbol_list )
+        self.buffers = dict( (s, a.bars) for s, a in self.aggregators.items() )
+        self.freq_ns = pd.Timedelta(bar_freq).value
+
+    def _load(self, symbol, kind, columns, cache_dir):
+        path = os.path.join(self.csv_dir, '{}_{}.csv'.format(symbol, kind))
+        if not os.path.exists(path):
+            return np.empty(0, dtype=tick_dtype(columns, self.price_scale))
+        return load_ticks(path, columns, self.price_scale, cache_dir)
+
+    def _to_price(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if self.price_scale is not None:
+            values = values / self.price_scale
+        return values
+
+    @property
+    def nbytes(self):
+        """
+        The size of the tick arrays in bytes.
+        """
+        return sum(
+                self.trades[s].nbytes + self.quotes[s].nbytes
+                for s in self.symbol_list)
+
+    def _next_tick_ns(self):
+        """
+        The time of the earliest unreleased tick, or None.
+        """
+        times = []
+        for s in self.symbol_list:
+            for ticks, pos in ((self.trades[s], self.trade_pos[s]),
+                               (self.quotes[s], self.quote_pos[s])):
+                if pos < len(ticks):
+                    times.append(ticks['timestamp'][pos])
+        return min(times) if times else None
+
+    def _next_cursor(self):
+        t_ns = self._next_tick_ns()
+        if t_ns is None:
+            return None
+        if self.tick_by_tick:
+            return int(t_ns) + 1
+        return (int(t_ns) // self.freq_ns + 1) * self.freq_ns
+
+    def get_next_bar_datetime(self):
+        cursor = self._next_cursor()
+        return pd.Timestamp(cursor) if cursor is not None else None
+
+    def update_bars(self):
+        """
+        Releases the ticks before the next cursor, aggregating the trades
+        into bars, and pushes a MarketEvent. Until every symbol has a
+        completed bar the ticks are released without one, as bar
+        consumers such as the portfolio read the latest bar of every
+        symbol.
+        """
+        while True:
+            cursor = self._next_cursor()
+            if cursor is None:
+                #flush the last bars
+                for agg in self.aggregators.values():
+                    agg.close_until(np.iinfo(np.int64).max)
+                self.continue_backtest = False
+                break
+            self._release(cursor)
+            if self._has_bars():
+                break
+        if self._has_bars():
+            self.events.put(MarketEvent())
+
+    def _has_bars(self):
+        return all(len(self.buffers[s]) > 0 for s in self.symbol_list)
+
+    def _release(self, cursor):
+        """
+        Releases the ticks before cursor.
+        """
+        for s in self.symbol_list:
+            trades = self.trades[s]
+            lo = self.trade_pos[s]
+            hi = np.searchsorted(trades['timestamp'], cursor, side='left')
+            if hi > lo:
+                batch = trades[lo:hi]
+                self.aggregators[s].add(
+                        batch['timestamp'], self._to_price(batch['price']),
+                        batch['size'])
+                self.trade_pos[s] = hi
+            self.aggregators[s].close_until(cursor)
+            self.quote_pos[s] = np.searchsorted(
+                    self.quotes[s]['timestamp'], cursor, side='left')
+        self.cursor_ns = cursor
+
+    def _quote(self, symbol, i):
+        q = self.quotes[symbol][i]
+        return (pd.Timestamp(int(q['timestamp'])),
+                float(self._to_price(q['bid'])), float(self._to_price(q['ask'])),
+                int(q['bid_size']), int(q['ask_size']))
+
+    def get_latest_quote(self, symbol):
+        """
+        Returns the latest released quote as (datetime, bid, ask,
+        bid_size, ask_size), or None if there is none yet.
+        """
+        pos = self.quote_pos[symbol]
+        return self._quote(symbol, pos - 1) if pos > 0 else None
+
+    def get_quote_asof(self, symbol, dt):
+        """
+        Returns the last released quote at or before dt, as for
+        get_latest_quote, by binary search. Quotes after the cursor are
+        never returned, whatever dt is.
+        """
+        times = self.quotes[symbol]['timestamp'][:self.quote_pos[symbol]]
+        i = np.searchsorted(times, pd.Timestamp(dt).value, side='right') - 1
+        return self._quote(symbol, i) if i >= 0 else None
+
+    def get_latest_quotes(self):
+        """
+        Returns a dict of arrays of the latest bid, ask, bid_size and
+        ask_size in symbol_list order, NaN for symbols with no quote yet.
+        """
+        out = dict( (c, np.full(len(self.symbol_list), np.nan)) for c in QUOTE_COLUMNS )
+        for j, s in enumerate(self.symbol_list):
+            pos = self.quote_pos[s]
+            if pos > 0:
+                q = self.quotes[s][pos - 1]
+                for c in QUOTE_COLUMNS:
+                    out[c][j] = q[c]
+        for c in ('bid', 'ask'):
+            out[c] = self._to_price(out[c])
+        return out
+
+    def get_latest_trades(self, symbol, N=1):
+        """
+        Returns the datetimes (int64 ns), prices and sizes of the last N
+        released trades, or N-k if less available.
+        """
+        pos = self.trade_pos[symbol]
+        batch = self.trades[symbol][max(pos - N, 0):pos]
+        return (np.asarray(batch['timestamp']), self._to_price(batch['price']),
+                np.asarray(batch['size']))